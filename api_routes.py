@@ -1,32 +1,30 @@
 import os
-from flask import Blueprint, jsonify, request, current_app
+import json
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context, url_for
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 import psycopg2
-import boto3
-from botocore.client import Config
 from botocore.exceptions import NoCredentialsError, ClientError
 
 from models import User
 from db import get_db
+from migrate import pending_migrations
+from catalog import get_catalog
+from search import SORT_KEYS, get_search_index
+from s3_client import get_s3_client, presign_get_object, presign_lifetime_cap
+from storage import LocalStorage, send_file_range
+from hashing import HashingBusy, get_hasher
+from thumbnails import DEFAULT_WIDTH, THUMBNAIL_FORMATS, srcsets, variant_key
+from hls import HLS_PREFIX, MAX_URL_LIFETIME, PLAYLIST_MIMETYPE, get_playlist_cache, rewrite_playlist
 
 
 api_routes = Blueprint('api_routes', __name__)
 
 
-def get_s3_client():
-    """
-    Creates a new S3 client for each request. Otherwise, if caching a request, there's a risk
-    that the credentials expire. Handles both local development (using AWS_PROFILE) and deployed
-    (using IAM Role) scenarios.
-    """
-    region_name = current_app.config.get('AWS_REGION')
-
-    return boto3.client(
-        's3',
-        region_name=region_name,
-        config=Config(signature_version='s3v4')  # Explicitly use v4 signatures
-    )
+def too_busy():
+    """The response for when the password hashing queue is full."""
+    response = jsonify({"message": "The server is busy, please try again in a moment."})
+    response.headers['Retry-After'] = '1'
+    return response, 429
 
 
 @api_routes.route('/api/signup', methods=['POST'])
@@ -46,12 +44,20 @@ def signup():
             # The message is kept generic to prevent user enumeration.
             return jsonify({"message": "An account with this email may already exist."}), 409
 
-        password_hash = generate_password_hash(password)
+        password_hash = get_hasher().hash(password)
         new_user = User.create(conn, email, password_hash)
         conn.commit()
 
         login_user(new_user)  # Log the new user in, setting the HttpOnly session cookie.
         return jsonify({"message": "Signup successful.", "user": {"email": new_user.email}}), 201
+
+    except HashingBusy:
+        return too_busy()
+
+    except psycopg2.IntegrityError:
+        # signed up concurrently, caught by the unique index on lower(email)
+        conn.rollback()
+        return jsonify({"message": "An account with this email may already exist."}), 409
     
     except psycopg2.Error as e:
         current_app.logger.error(f"Database error during signup: {e}")
@@ -70,9 +76,20 @@ def login():
 
     conn = get_db()
     user = User.get_by_email(conn, email)
+    hasher = get_hasher()
+
+    try:
+        # Unknown emails are checked against a dummy hash, so they take as long as known ones.
+        if user:
+            password_valid = hasher.verify(user.password_hash, password)
+        else:
+            password_valid = hasher.verify_unknown_user(password)
+
+    except HashingBusy:
+        return too_busy()
 
     # Use a generic error message to prevent user enumeration attacks.
-    if not user or not check_password_hash(user.password_hash, password):
+    if not password_valid:
         return jsonify({"message": "Invalid email or password."}), 401
 
     login_user(user) # This sets the secure HttpOnly session cookie.
@@ -94,89 +111,150 @@ def check_auth():
 
 
 # routes for video streaming
-# ----------------------------------------------------------------------------
+# ----------------------------------------------------------------------------
+MAX_PAGE_SIZE = 1000
+MAX_BATCH_SIZE = 100
+
+
+def video_info(s3, bucket_name, entry):
+    """
+    Turns a catalog entry into the JSON object sent to the client.
+
+    If the thumbnail has scaled variants, `thumbnail_srcset` holds a srcset
+    value per image format and `thumbnail_url` points to a small JPEG variant
+    instead of the uploaded original. Videos packaged for adaptive streaming
+    have an `hls_url` with their master playlist.
+    """
+    hls_key = entry.get('hls_key')
+    info = {
+        'key': entry['key'],
+        'size': entry['size'],
+        'thumbnail_url': None,
+        'thumbnail_srcset': None,
+        'hls_url': url_for('api_routes.hls_playlist', playlist=hls_key[len(HLS_PREFIX):]) if hls_key else None,
+        'label': entry['label'],
+    }
+
+    tkey = entry['thumbnail_key']
+    widths = entry.get('thumbnail_widths')
+
+    try:
+        if tkey is not None and widths:
+            urls = {
+                (width, fmt): presign_get_object(s3, bucket_name, variant_key(entry['name'], width, fmt))
+                for width in widths
+                for fmt in THUMBNAIL_FORMATS
+            }
+            fallback = min(widths, key=lambda width: abs(width - DEFAULT_WIDTH))
+            info['thumbnail_url'] = urls[(fallback, 'jpeg')]
+            info['thumbnail_srcset'] = srcsets(urls)
+
+        elif tkey is not None:
+            info['thumbnail_url'] = presign_get_object(s3, bucket_name, tkey)
+
+    except ClientError as e:
+        current_app.logger.error(f"Could not generate presigned URL for thumbnail {tkey}: {e}")
+
+    return info
+
+
 @api_routes.route('/api/videos', methods=['GET'])
 @login_required
 def list_videos():
     """
-    Lists videos available in the S3 bucket.
+    Lists videos available in the S3 bucket. The listing itself is served from the
+    worker's catalog cache (read from the bucket's catalog.json manifest where
+    there is one), only the thumbnail URLs are signed per request.
+
+    Without query parameters the whole catalog is returned as a JSON list. With
+    `limit` (and `cursor`, taken from the previous page's `next_cursor`) a single
+    page is returned. With `format=ndjson` the videos are streamed one JSON
+    object per line, so the client can render them while the bucket is walked.
     """
     s3 = get_s3_client()
     bucket_name = current_app.config.get('S3_BUCKET_NAME')
+    catalog = get_catalog()
 
-    assets = dict()
-    video_extensions = ('.mp4', '.mov', '.avi', '.mkv')
-    thumb_extensions = ('.png', '.jpg', '.jpeg')
-
-    try:
-        response = s3.list_objects_v2(Bucket=bucket_name)
-
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                key = obj['Key']
-                name, ext = os.path.splitext(key)
-                ext = ext.lower()
+    if request.args.get('format') == 'ndjson':
+        return Response(stream_with_context(stream_videos(s3, bucket_name, catalog)), mimetype='application/x-ndjson')
 
-                if name not in assets:
-                    assets[name] = dict()
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({"message": "limit must be a positive number."}), 400
 
-                if ext in video_extensions:
-                    assets[name]['video'] = {'key': key, 'size': obj['Size']}
+    try:
+        if limit is None and cursor is None:
+            videos = [video_info(s3, bucket_name, entry) for entry in catalog.get_videos(s3, bucket_name)]
+            return jsonify(videos), 200
 
-                elif ext in thumb_extensions:
-                    assets[name]['thumbnail'] = {'key': key}
+        limit = min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+        page, next_cursor = catalog.get_page(s3, bucket_name, cursor, limit)
+        videos = [video_info(s3, bucket_name, entry) for entry in page]
+        return jsonify({"videos": videos, "next_cursor": next_cursor}), 200
 
-                elif ext == '.txt':
-                    try:
-                        label_obj = s3.get_object(Bucket=bucket_name, Key=key)
-                        label_content = label_obj['Body'].read().decode('utf-8').strip()
-                        assets[name]['label'] = label_content
+    except NoCredentialsError:
+        current_app.logger.error("AWS credentials not found")
+        return jsonify({"message": "AWS credentials not configured."}), 500
+    
+    except ClientError as e:
+        current_app.logger.error(f"S3 Error: {e}")
+        return jsonify({"message": f"Error accessing S3: {e}"}), 500
 
-                    except Exception as e:
-                        current_app.logger.error(f"Could not read label file {key}: {e}")
-                
-            videos = []
 
-            for name, data in assets.items():
-                if 'video' not in data:
-                    continue
+def stream_videos(s3, bucket_name, catalog):
+    """
+    Yields the videos as newline-delimited JSON, a chunk per batch of the
+    catalog: from memory when it is fresh, else as the bucket is walked.
+    Errors can't change the status code once streaming has started, so they
+    are reported as a final line.
+    """
+    try:
+        for batch in catalog.iter_batches(s3, bucket_name):
+            yield ''.join(json.dumps(video_info(s3, bucket_name, entry)) + '\n' for entry in batch)
 
-                video_info = {
-                    'key': data['video']['key'],
-                    'size': data['video']['size'],
-                    'thumbnail_url': None,
-                    'label': name,
-                }
+    except NoCredentialsError:
+        current_app.logger.error("AWS credentials not found")
+        yield json.dumps({"error": "AWS credentials not configured."}) + '\n'
 
-                if 'thumbnail' in data:
-                    tkey = data['thumbnail']['key']
+    except ClientError as e:
+        current_app.logger.error(f"S3 Error: {e}")
+        yield json.dumps({"error": f"Error accessing S3: {e}"}) + '\n'
 
-                    try:
-                        turl = s3.generate_presigned_url(
-                            'get_object',
-                            Params={'Bucket': bucket_name, 'Key': tkey},
-                            ExpiresIn=3600
-                        )
 
-                        video_info['thumbnail_url'] = turl
+@api_routes.route('/api/search', methods=['GET'])
+@login_required
+def search_videos():
+    """
+    Searches the catalog by name and label. Each word of `q` matches words
+    starting with it (an empty query matches all videos). The matches are
+    sorted by `sort` ('name', 'label' or 'size') in `order` ('asc' or 'desc'),
+    and the page from `offset` on with up to `limit` videos is returned,
+    together with the total number of matches.
+    """
+    query = request.args.get('q', '')
+    sort = request.args.get('sort', 'name')
+    order = request.args.get('order', 'asc')
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = max(1, min(request.args.get('limit', 50, type=int), MAX_PAGE_SIZE))
 
-                    except ClientError as e:
-                        current_app.logger.error(f"Could not generate presigned URL for thumbnail {tkey}: {e}")
+    if sort not in SORT_KEYS or order not in ('asc', 'desc'):
+        return jsonify({"message": f"sort must be one of {', '.join(SORT_KEYS)} and order asc or desc."}), 400
 
-                if 'label' in data:
-                    video_info['label'] = data['label']
+    s3 = get_s3_client()
+    bucket_name = current_app.config.get('S3_BUCKET_NAME')
+    index = get_search_index()
 
-                videos.append(video_info)
+    try:
+        index.sync(get_catalog().get_videos(s3, bucket_name))
+        page, total = index.search(query, sort, order == 'desc', offset, limit)
+        videos = [video_info(s3, bucket_name, entry) for entry in page]
+        return jsonify({"videos": videos, "total": total, "offset": offset, "limit": limit}), 200
 
-            # videos = [{'key': obj['Key'], 'size': obj['Size']} for obj in response['Contents']]
-            return jsonify(videos), 200
-        else:
-            return jsonify([]), 200  # Empty bucket
-        
     except NoCredentialsError:
         current_app.logger.error("AWS credentials not found")
         return jsonify({"message": "AWS credentials not configured."}), 500
-    
+
     except ClientError as e:
         current_app.logger.error(f"S3 Error: {e}")
         return jsonify({"message": f"Error accessing S3: {e}"}), 500
@@ -192,11 +270,7 @@ def stream_video(video_key):
     bucket_name = current_app.config.get('S3_BUCKET_NAME')
 
     try:
-        presigned_url = s3.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': bucket_name, 'Key': video_key},
-            ExpiresIn=3600  # Link expires in 1 hour
-        )
+        presigned_url = presign_get_object(s3, bucket_name, video_key)  # Link expires in 1 hour
         return jsonify({"url": presigned_url}), 200
     
     except NoCredentialsError:
@@ -208,33 +282,143 @@ def stream_video(video_key):
         return jsonify({"message": f"Error generating stream URL: {e}"}), 500
 
 
+@api_routes.route('/api/stream/batch', methods=['POST'])
+@login_required
+def stream_video_batch():
+    """
+    Generates presigned streaming URLs for several videos at once, so the client
+    can prefetch the URLs of the videos it is currently showing.
+    Expects a JSON body of the form {"keys": ["video-1.mp4", ...]}.
+    """
+    data = request.get_json(silent=True) or {}
+    keys = data.get('keys')
+
+    if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+        return jsonify({"message": "A list of video keys is required."}), 400
+
+    if len(keys) > MAX_BATCH_SIZE:
+        return jsonify({"message": f"At most {MAX_BATCH_SIZE} keys can be signed at once."}), 400
+
+    s3 = get_s3_client()
+    bucket_name = current_app.config.get('S3_BUCKET_NAME')
+
+    try:
+        urls = {key: presign_get_object(s3, bucket_name, key) for key in keys}
+        return jsonify({"urls": urls}), 200
+
+    except NoCredentialsError:
+        current_app.logger.error("AWS credentials not found")
+        return jsonify({"message": "AWS credentials not configured."}), 500
+
+    except ClientError as e:
+        current_app.logger.error(f"S3 Error: {e}")
+        return jsonify({"message": f"Error generating stream URLs: {e}"}), 500
+
+
+@api_routes.route('/api/media/<path:key>', methods=['GET'])
+@login_required
+def serve_media(key):
+    """
+    Streams an object from local storage, with Range and conditional request
+    support. Only used with STORAGE_BACKEND 'local', where the stream URLs
+    point here instead of at presigned S3 URLs.
+    """
+    storage = get_s3_client()
+    path = storage.path(key) if isinstance(storage, LocalStorage) else None
+    if path is None or not os.path.isfile(path):
+        return jsonify({"message": "File not found."}), 404
+
+    return send_file_range(path, current_app.config.get('STORAGE_CHUNK_SIZE', 256 * 1024))
+
+
 # debugging: check if connection to database works
 # ----------------------------------------------------------------------------
 @api_routes.route('/api/health-check')
 def health_check():
-    """A simple endpoint to verify database connectivity and table existence."""
+    """A simple endpoint to verify database connectivity and that the schema is up to date."""
     try:
         conn = get_db()
         with conn.cursor() as cur:
             # Check 1: Basic connection
             cur.execute('SELECT 1')
-            
-            # Check 2: Verify that the 'users' table exists
-            cur.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_schema = 'public' AND table_name = 'users'
-                );
-            """)
-            table_exists = cur.fetchone()[0]
-
-            if not table_exists:
-                return jsonify({"status": "error", "message": "Database connection successful, but 'users' table not found."}), 500
-
-        return jsonify({"status": "ok", "message": "Database connection and 'users' table check successful."}), 200
+
+        # Check 2: Verify that all migrations have been applied (see migrate.py)
+        pending = pending_migrations(conn)
+        if pending:
+            return jsonify({
+                "status": "error",
+                "message": "Database connection successful, but migrations are pending.",
+                "pending_migrations": [str(migration) for migration in pending],
+            }), 500
+
+        return jsonify({"status": "ok", "message": "Database connection and schema check successful."}), 200
     
     except psycopg2.Error as e:
         return jsonify({"status": "error", "message": f"Database connection failed: {e}"}), 500
     
     except Exception as e:
-        return jsonify({"status": "error", "message": f"An unexpected error occurred: {e}"}), 500
\ No newline at end of file
+        return jsonify({"status": "error", "message": f"An unexpected error occurred: {e}"}), 500
+
+
+@api_routes.route('/api/hls/<path:playlist>', methods=['GET'])
+@login_required
+def hls_playlist(playlist):
+    """
+    Serves a playlist of a video packaged with package_hls.py. Segment URIs
+    are replaced with presigned S3 URLs, while the rendition playlists of a
+    master playlist stay relative, so they are requested (and signed) here too.
+    The URLs are valid for at most as long as the credentials that sign them,
+    and the playlist is cached no longer than they stay valid.
+    """
+    if not playlist.endswith('.m3u8') or '..' in playlist.split('/'):
+        return jsonify({"message": "Playlist not found."}), 404
+
+    s3 = get_s3_client()
+    bucket_name = current_app.config.get('S3_BUCKET_NAME')
+    key = HLS_PREFIX + playlist
+
+    try:
+        text = get_playlist_cache().get(s3, bucket_name, key)
+        if text is None:
+            return jsonify({"message": "Playlist not found."}), 404
+
+        max_lifetime = presign_lifetime_cap(MAX_URL_LIFETIME)
+        body = rewrite_playlist(
+            text, key,
+            lambda segment_key, expires_in, min_lifetime: presign_get_object(
+                s3, bucket_name, segment_key, expires_in, min_lifetime
+            ),
+            max_lifetime,
+        )
+
+    except NoCredentialsError:
+        current_app.logger.error("AWS credentials not found")
+        return jsonify({"message": "AWS credentials not configured."}), 500
+
+    except ClientError as e:
+        current_app.logger.error(f"S3 Error: {e}")
+        return jsonify({"message": f"Error accessing S3: {e}"}), 500
+
+    response = Response(body, mimetype=PLAYLIST_MIMETYPE)
+    # the signed URLs must not be shared between users, and a cached copy must
+    # leave the safety margin of their lifetime, as PresignedUrlCache does
+    response.cache_control.private = True
+    margin = current_app.extensions['presigned_urls'].safety_margin
+    response.cache_control.max_age = max(0, min(300, max_lifetime - margin))
+    return response
+
+
+@api_routes.route('/api/stats')
+@login_required  # the counters describe the deployment, they are not for anonymous visitors
+def stats():
+    """Reuse counters of the worker's shared resources, to confirm pooling works in production."""
+    return jsonify({
+        "pid": os.getpid(),
+        "s3_clients": current_app.extensions['s3_clients'].stats(),
+        "presigned_urls": current_app.extensions['presigned_urls'].stats(),
+        "db_pool": current_app.extensions['db_pool'].stats(),
+        "user_cache": current_app.extensions['user_cache'].stats(),
+        "password_hasher": current_app.extensions['password_hasher'].stats(),
+        "hls_playlists": current_app.extensions['hls_playlists'].stats(),
+        "search_index": current_app.extensions['search_index'].stats(),
+    }), 200
@@ -1,13 +1,24 @@
 import os
+import threading
+import time
 from flask import Flask, jsonify, request, redirect, url_for
 from flask_login import LoginManager
-from flask_wtf.csrf import CSRFProtect, generate_csrf
+from flask_wtf.csrf import CSRFProtect, generate_csrf, validate_csrf
+from wtforms.validators import ValidationError
 
 from werkzeug.exceptions import HTTPException
 from models import User
 from file_routes import file_routes
 from api_routes import api_routes
 from db import get_db, init_app
+import catalog
+import s3_client
+import user_cache
+import hashing
+import static_assets
+import hls
+import search
+import metrics
 
 
 # --- APP SETUP ---
@@ -21,12 +32,61 @@ app = Flask(__name__, static_folder=None)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'a-very-secret-key-that-you-should-change')
 
 app.config['DATABASE_URL'] = os.environ.get('DATABASE_URL')
+app.config['DB_POOL_MIN_SIZE'] = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+app.config['DB_POOL_MAX_SIZE'] = int(os.environ.get('DB_POOL_MAX_SIZE', 10))  # connections per worker
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 5))  # seconds to wait for a free connection
+app.config['DB_PREPARED_STATEMENTS'] = os.environ.get('DB_PREPARED_STATEMENTS', '1') == '1'  # off behind PgBouncer
+app.config['DB_CONNECT_TIMEOUT'] = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))  # seconds to open a connection
 app.config['AWS_REGION'] = os.environ.get('AWS_REGION')
 app.config['S3_BUCKET_NAME'] = 'streaming-site-video-data'  # hardcoded for now
-
-# Initialize database management
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 's3')  # 's3', or 'local' to serve STORAGE_ROOT
+app.config['STORAGE_ROOT'] = os.environ.get('STORAGE_ROOT')  # directory standing in for the bucket
+app.config['STORAGE_CHUNK_SIZE'] = int(os.environ.get('STORAGE_CHUNK_SIZE', 256 * 1024))  # bytes per read when streaming
+app.config['CATALOG_TTL'] = int(os.environ.get('CATALOG_TTL', 60))  # seconds between bucket listings
+app.config['CATALOG_MANIFEST'] = os.environ.get('CATALOG_MANIFEST', '1') == '1'  # read catalog.json instead of listing
+app.config['S3_FETCH_WORKERS'] = int(os.environ.get('S3_FETCH_WORKERS', 16))  # threads downloading labels
+app.config['S3_FETCH_TIMEOUT'] = float(os.environ.get('S3_FETCH_TIMEOUT', 10))  # seconds per batch of downloads
+app.config['S3_READ_TIMEOUT'] = float(os.environ.get('S3_READ_TIMEOUT', 5))  # seconds per S3 call
+app.config['S3_MAX_POOL_CONNECTIONS'] = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 32))  # HTTP connections per worker
+app.config['S3_CREDENTIAL_REFRESH_MARGIN'] = int(os.environ.get('S3_CREDENTIAL_REFRESH_MARGIN', 300))  # seconds
+app.config['PRESIGN_SAFETY_MARGIN'] = int(os.environ.get('PRESIGN_SAFETY_MARGIN', 1800))  # min. remaining URL lifetime
+app.config['PRESIGN_CACHE_ENTRIES'] = int(os.environ.get('PRESIGN_CACHE_ENTRIES', 10000))
+app.config['PRESIGN_CACHE_BYTES'] = int(os.environ.get('PRESIGN_CACHE_BYTES', 8 * 1024 * 1024))
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 10000))
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 300))  # seconds, 0 disables the cache
+# processes per worker, 0 = inline; by default the gunicorn workers (WEB_CONCURRENCY) share the CPU cores
+app.config['HASH_WORKERS'] = int(os.environ.get(
+    'HASH_WORKERS', max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', 4)))))
+app.config['HASH_MAX_PENDING'] = int(os.environ.get('HASH_MAX_PENDING', 4 * app.config['HASH_WORKERS'] or 4))  # before 429s
+app.config['STATIC_PRELOAD'] = os.environ.get('STATIC_PRELOAD', '1') == '1'  # load static files at startup
+app.config['HLS_PLAYLIST_CACHE_SIZE'] = int(os.environ.get('HLS_PLAYLIST_CACHE_SIZE', 1000))
+app.config['HLS_PLAYLIST_CACHE_TTL'] = int(os.environ.get('HLS_PLAYLIST_CACHE_TTL', 300))  # seconds
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '0') == '1'  # /metrics and Server-Timing headers
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # /metrics requires it as a bearer token, and is off without it
+app.config['SLOW_REQUEST_THRESHOLD'] = float(os.environ.get('SLOW_REQUEST_THRESHOLD', 0))  # seconds, 0 = don't log
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))  # share of requests profiled
+app.config['WARM_UP'] = os.environ.get('WARM_UP', '1') == '1'  # connect and load the catalog before serving requests
+app.config['WARM_UP_TIMEOUT'] = float(os.environ.get('WARM_UP_TIMEOUT', 10))  # seconds, then serve while it finishes
+
+# Time every request and its calls to S3, the database and the hasher. This
+# comes first, so the timing covers the other extensions' request hooks too.
+metrics.init_app(app)
+
+# Initialize database management (a connection pool per worker)
 init_app(app)
 
+# Initialize the shared S3 client, the cached video catalog, its search index and HLS playlists
+s3_client.init_app(app)
+catalog.init_app(app)
+hls.init_app(app)
+search.init_app(app)
+
+# Password hashing runs in a separate process pool
+hashing.init_app(app)
+
+# Static files are served from memory
+static_assets.init_app(app)
+
 # --- FLASK-LOGIN SETUP ---
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -34,10 +94,22 @@ login_manager.init_app(app)
 # this line specifies the function that returns the login page
 login_manager.login_view = 'file_routes.serve_index'
 
+# The user is looked up on every authenticated request, so the rows are cached
+# and the database is only queried on a cache miss.
+user_cache.init_app(app)
+
 @login_manager.user_loader
 def load_user(user_id):
+    cache = user_cache.get_user_cache()
+    row = cache.get(user_id)
+    if row is not None:
+        return User(id=row[0], email=row[1], password_hash=row[2])
+
     conn = get_db()
-    return User.get(conn, user_id)
+    user = User.get(conn, user_id)
+    if user is not None:
+        cache.set(user)
+    return user
 
 # If an unauthenticated user tries to access a @login_required route,
 # Flask-Login will normally redirect. For an API, return a 401 error.
@@ -54,11 +126,29 @@ def unauthorized():
 # --- CSRF PROTECTION SETUP ---
 csrf = CSRFProtect(app)
 
-# After each request, we set a new CSRF token in a cookie.
-# This is the "double-submit" cookie pattern.
+def csrf_cookie_is_fresh():
+    """
+    Whether the request's CSRF cookie holds a token of the current session
+    that is less than half of WTF_CSRF_TIME_LIMIT old.
+    """
+    time_limit = app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    try:
+        validate_csrf(request.cookies.get('csrf_token'), time_limit=time_limit // 2 if time_limit else None)
+    except ValidationError:
+        return False
+    return True
+
+# After pages and API calls, we make sure the browser has a valid CSRF token
+# in a cookie. This is the "double-submit" cookie pattern. A new token is
+# only issued when the cookie is missing, stale or from another session.
+# Static files are left alone, so they stay free of Set-Cookie and can be
+# cached by browsers and proxies.
 @app.after_request
 def set_csrf_cookie(response):
-    response.set_cookie('csrf_token', generate_csrf())
+    if response.mimetype != 'text/html' and not request.path.startswith('/api/'):
+        return response
+    if not csrf_cookie_is_fresh():
+        response.set_cookie('csrf_token', generate_csrf())
     return response
 
 
@@ -83,6 +173,52 @@ def handle_exception(e):
     return "<h1>500 - Internal Server Error</h1><p>Something went wrong on our end.</p>", 500
 
 
+# --- WORKER WARM-UP ---
+def warm_up(notify=None):
+    """
+    Prepares a freshly started worker for its first requests: opens the
+    database connections, starts the password hashing processes, builds the
+    S3 client and loads the catalog (and with it the search index). Gunicorn
+    runs this in every worker before it accepts requests, see gunicorn.conf.py.
+
+    The steps run in a background thread. This waits for them for up to
+    WARM_UP_TIMEOUT seconds, calling `notify` every second to tell gunicorn
+    the worker is alive, and then lets the worker serve while they finish, so
+    an unreachable S3 or database can't keep it from answering. A step that
+    fails is logged and left to the first request that needs it.
+    """
+    if not app.config['WARM_UP']:
+        return
+
+    thread = threading.Thread(target=run_warm_up_steps, name='warm-up', daemon=True)
+    thread.start()
+    deadline = time.monotonic() + app.config['WARM_UP_TIMEOUT']
+    while thread.is_alive() and time.monotonic() < deadline:
+        thread.join(min(1, max(0, deadline - time.monotonic())))
+        if notify is not None:
+            notify()
+    if thread.is_alive():
+        app.logger.warning(f"Warm-up didn't finish within {app.config['WARM_UP_TIMEOUT']}s, serving requests meanwhile")
+
+
+def run_warm_up_steps():
+    steps = [
+        ('database pool', lambda: app.config['DATABASE_URL'] and app.extensions['db_pool'].warm()),
+        ('password hasher', lambda: app.extensions['password_hasher'].warm()),
+        ('S3 client', lambda: s3_client.get_s3_client()),
+        # with a client that doesn't retry, the shared one retries as usual
+        ('catalog', lambda: catalog.get_catalog().get_videos(s3_client.get_warm_up_client(), app.config['S3_BUCKET_NAME'])),
+    ]
+    with app.app_context():
+        for name, step in steps:
+            start = time.perf_counter()
+            try:
+                step()
+                app.logger.info(f"Warmed up the {name} in {time.perf_counter() - start:.2f}s")
+            except Exception as e:
+                app.logger.warning(f"Warm-up of the {name} failed: {e}")
+
+
 # --- BLUEPRINT REGISTRATION ---
 app.register_blueprint(file_routes)
 app.register_blueprint(api_routes)
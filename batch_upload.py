@@ -0,0 +1,366 @@
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from botocore.exceptions import ClientError
+
+from catalog import classify_key, iter_objects
+import thumbnails
+from upload_script import delete_thumbnail_variants, record_in_manifest, transfer_file, upload_thumbnail_variants
+
+
+MANIFEST_EXTENSIONS = ('.csv', '.jsonl')
+
+ACL = 'bucket-owner-full-control'
+
+
+class BatchItem:
+    """One object of a batch upload: a video, its thumbnail or its label."""
+
+    def __init__(self, name, kind, object_name, path=None, data=None):
+        self.name = name
+        self.kind = kind
+        self.object_name = object_name
+        self.path = path
+        self.data = data  # the encoded label, for labels
+        self.size = len(data) if data is not None else os.path.getsize(path)
+        self.skip = False
+        self.error = None
+        self.uploaded = False
+        self.widths = None  # of the scaled variants created for an uploaded thumbnail
+        self._sha256 = None
+
+    def sha256(self):
+        if self._sha256 is None:
+            self._sha256 = self._digest('sha256')
+        return self._sha256
+
+    def md5(self):
+        return self._digest('md5')
+
+    def _digest(self, algorithm):
+        if self.data is not None:
+            return hashlib.new(algorithm, self.data).hexdigest()
+        return file_digest(self.path, algorithm)
+
+
+class BatchProgress:
+    """
+    A single progress line for all files of a batch, replacing the per-file
+    ProgressPercentage. Redrawn at most every `interval` seconds.
+    """
+
+    def __init__(self, total_bytes, total_files, interval=0.5):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.interval = interval
+        self.bytes_done = 0
+        self.files_done = 0
+        self.started = time.monotonic()
+        self._drawn = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, bytes_amount):
+        with self._lock:
+            self.bytes_done += bytes_amount
+            self._draw()
+
+    def file_done(self):
+        with self._lock:
+            self.files_done += 1
+            self._draw(force=True)
+
+    def _draw(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._drawn < self.interval:
+            return
+        self._drawn = now
+
+        elapsed = max(now - self.started, 1e-6)
+        percentage = self.bytes_done / self.total_bytes * 100 if self.total_bytes else 100.0
+        sys.stdout.write(
+            f"\r-> {self.files_done}/{self.total_files} files, {self.bytes_done / (1024*1024):.2f}MB / "
+            f"{self.total_bytes / (1024*1024):.2f}MB ({percentage:.2f}%), {self.bytes_done / elapsed / (1024*1024):.2f}MB/s"
+        )
+        sys.stdout.flush()
+
+
+def file_digest(path, algorithm='sha256'):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, algorithm).hexdigest()
+
+
+def is_unchanged(item, remote):
+    """
+    Whether an object in the bucket (its head_object response) has the content
+    of the item: by the SHA-256 checksum batch uploads store in the metadata,
+    else by the ETag, which is the MD5 of single-part uploads. Objects that
+    have neither, such as multipart uploads of other tools, count as changed.
+    """
+    checksum = remote.get('Metadata', {}).get('sha256')
+    if checksum is not None:
+        return checksum == item.sha256()
+
+    etag = remote.get('ETag', '').strip('"')
+    return bool(etag) and '-' not in etag and etag == item.md5()
+
+
+def is_manifest(path):
+    return os.path.isfile(path) and os.path.splitext(path)[1].lower() in MANIFEST_EXTENSIONS
+
+
+def scan_directory(directory):
+    """
+    Groups the files of a directory by base name, the same way the site groups
+    the objects of the bucket: 'intro.mp4', 'intro.png' and 'intro.txt' become
+    the video, thumbnail and label of 'intro'. The label is the text of the
+    .txt file. Subdirectories and files of other types are ignored.
+    """
+    groups = dict()
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        name, kind = classify_key(filename)
+        if kind is None or not os.path.isfile(path):
+            continue
+
+        group = groups.setdefault(name, dict())
+        if kind in group:
+            print(f"Warning: '{filename}' ignored, '{name}' already has a {kind}.")
+            continue
+
+        if kind == 'label':
+            with open(path, encoding='utf-8') as f:
+                group['label'] = f.read().strip()
+        else:
+            group[kind] = path
+    return groups
+
+
+def read_manifest(path):
+    """
+    Reads a CSV file with the columns file, label and thumbnail (label and
+    thumbnail may be empty), or a JSONL file with one object with these keys
+    per line, into the same groups as scan_directory. Relative paths are
+    relative to the manifest.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    groups = dict()
+    for row in rows:
+        video = os.path.join(directory, row['file'])
+        name, _ = os.path.splitext(os.path.basename(video))
+        if name in groups:
+            print(f"Warning: '{row['file']}' ignored, the manifest already has a video named '{name}'.")
+            continue
+
+        group = groups[name] = {'video': video}
+        if row.get('label'):
+            group['label'] = row['label']
+        if row.get('thumbnail'):
+            group['thumbnail'] = os.path.join(directory, row['thumbnail'])
+    return groups
+
+
+def plan_batch(s3_client, bucket_name, groups):
+    """
+    Turns the groups into the list of objects to upload. Objects that are
+    already in the bucket with the same size and content (see is_unchanged)
+    are skipped.
+    """
+    items = []
+    for name, group in sorted(groups.items()):
+        if 'video' not in group:
+            print(f"Warning: '{name}' has no video and is skipped.")
+            continue
+
+        video = group['video']
+        if not os.path.isfile(video):
+            print(f"Warning: '{video}' not found, '{name}' is skipped.")
+            continue
+
+        items.append(BatchItem(name, 'video', name + os.path.splitext(video)[1], path=video))
+        if 'thumbnail' in group:
+            if os.path.isfile(group['thumbnail']):
+                ext = os.path.splitext(group['thumbnail'])[1].lower()
+                items.append(BatchItem(name, 'thumbnail', name + ext, path=group['thumbnail']))
+            else:
+                print(f"Warning: thumbnail '{group['thumbnail']}' not found, '{name}' is uploaded without it.")
+        if 'label' in group:
+            items.append(BatchItem(name, 'label', name + '.txt', data=group['label'].encode('utf-8')))
+
+    # one listing instead of a request per object; only same-sized objects need a closer look
+    existing = {obj['Key']: obj['Size'] for obj in iter_objects(s3_client, bucket_name)}
+    for item in items:
+        if existing.get(item.object_name) != item.size:
+            continue
+        try:
+            remote = s3_client.head_object(Bucket=bucket_name, Key=item.object_name)
+        except ClientError:
+            continue
+        item.skip = is_unchanged(item, remote)
+
+    return items
+
+
+def print_plan(items):
+    for item in items:
+        action = 'skip' if item.skip else 'upload'
+        print(f"{action:>6}  {item.object_name}  ({item.size / (1024*1024):.2f}MB)")
+
+    pending = [item for item in items if not item.skip]
+    print(f"\n{len(pending)} of {len(items)} objects to upload, "
+          f"{sum(item.size for item in pending) / (1024*1024):.2f}MB in total.")
+
+
+def upload_item(s3_client, bucket_name, item, transfer_config, progress, resume):
+    extra_args = {'ACL': ACL, 'Metadata': {'sha256': item.sha256()}}
+
+    if item.data is not None:
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=item.object_name,
+            Body=item.data,
+            ContentType='text/plain; charset=utf-8',
+            **extra_args
+        )
+        progress(item.size)
+    else:
+        transfer_file(s3_client, item.path, bucket_name, item.object_name, transfer_config,
+                      callback=progress, resume=resume, extra_args=extra_args)
+
+    if item.kind == 'thumbnail' and thumbnails.can_render():
+        with open(item.path, 'rb') as f:
+            item.widths = upload_thumbnail_variants(s3_client, bucket_name, item.name, f.read())
+
+
+def run_batch(s3_client, bucket_name, items, transfer_config, jobs=4, resume=False):
+    """
+    Uploads all items that aren't skipped with `jobs` files in flight at once.
+    If a video fails, the thumbnail and label uploaded with it are removed
+    again, as in a single upload. Returns a summary dict.
+    """
+    pending = [item for item in items if not item.skip]
+    progress = BatchProgress(sum(item.size for item in pending), len(pending))
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # largest first, so a big video doesn't start last and run on its own
+        futures = {
+            executor.submit(upload_item, s3_client, bucket_name, item, transfer_config, progress, resume): item
+            for item in sorted(pending, key=lambda item: item.size, reverse=True)
+        }
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                future.result()
+                item.uploaded = True
+            except Exception as e:
+                item.error = e
+            progress.file_done()
+
+    elapsed = time.monotonic() - started
+    sys.stdout.write("\n")
+
+    failed_videos = {item.name for item in pending if item.kind == 'video' and item.error is not None}
+    for item in pending:
+        if item.name in failed_videos and item.uploaded:
+            s3_client.delete_object(Bucket=bucket_name, Key=item.object_name)
+            delete_thumbnail_variants(s3_client, bucket_name, item.name, item.widths or [])
+            item.uploaded = False
+
+    uploaded = [item for item in pending if item.uploaded]
+    uploaded_bytes = sum(item.size for item in uploaded)
+    return {
+        'uploaded': len(uploaded),
+        'skipped': len(items) - len(pending),
+        'failed': [(item.object_name, item.error) for item in pending if item.error is not None],
+        'removed': [item.object_name for item in pending if item.name in failed_videos and item.error is None],
+        'bytes': uploaded_bytes,
+        'seconds': elapsed,
+        'videos': len({item.name for item in uploaded if item.kind == 'video'}),
+    }
+
+
+def print_summary(summary):
+    seconds = max(summary['seconds'], 1e-6)
+    print("\n--- Summary ---")
+    print(f"Uploaded:  {summary['uploaded']} objects ({summary['videos']} videos), "
+          f"{summary['bytes'] / (1024*1024):.2f}MB in {summary['seconds']:.1f}s")
+    print(f"Throughput: {summary['bytes'] / seconds / (1024*1024):.2f}MB/s, "
+          f"{summary['uploaded'] / seconds:.2f} objects/s")
+    print(f"Skipped:   {summary['skipped']} objects already in the bucket")
+
+    if summary['failed']:
+        print(f"Failed:    {len(summary['failed'])} objects")
+        for object_name, error in summary['failed']:
+            print(f"  {object_name}: {error}")
+    if summary['removed']:
+        print(f"Removed:   {', '.join(summary['removed'])} (their video failed)")
+
+
+def manifest_entries(items):
+    """The catalog entries of all videos of the batch that are now in the bucket."""
+    videos = dict()
+    for item in items:
+        if item.kind == 'video' and (item.skip or item.uploaded):
+            videos[item.name] = {
+                'name': item.name,
+                'key': item.object_name,
+                'size': item.size,
+                'thumbnail_key': None,
+                'thumbnail_widths': None,
+                'label': None,
+            }
+            if item.uploaded:
+                videos[item.name]['hls_key'] = None  # the package was made from the previous upload
+
+    for item in items:
+        if item.name in videos and (item.skip or item.uploaded):
+            if item.kind == 'thumbnail':
+                videos[item.name]['thumbnail_key'] = item.object_name
+                # None for a skipped thumbnail keeps the variants the manifest has
+                videos[item.name]['thumbnail_widths'] = (item.widths or []) if item.uploaded else None
+            elif item.kind == 'label':
+                videos[item.name]['label'] = item.data.decode('utf-8')
+
+    return list(videos.values())
+
+
+def ingest(source, s3_client, bucket_name, transfer_config, jobs=4, resume=False, dry_run=False):
+    """
+    Uploads all videos of a directory or manifest, with their thumbnails and
+    labels, and adds them to the bucket's catalog manifest. Returns True if
+    nothing failed.
+    """
+    groups = read_manifest(source) if is_manifest(source) else scan_directory(source)
+    items = plan_batch(s3_client, bucket_name, groups)
+
+    if not thumbnails.can_render() and any(item.kind == 'thumbnail' and not item.skip for item in items):
+        print("Warning: Pillow is not installed, so no scaled thumbnails are created. "
+              "Install it and run --backfill-thumbnails.")
+
+    print(f"\n--- Batch upload of '{source}' to bucket '{bucket_name}' ---")
+    print_plan(items)
+    if dry_run:
+        return True
+
+    summary = None
+    if not all(item.skip for item in items):
+        summary = run_batch(s3_client, bucket_name, items, transfer_config, jobs, resume)
+        print_summary(summary)
+
+    # one manifest update for the whole batch; skipped videos are included in
+    # case they were uploaded before the bucket had a manifest
+    videos = manifest_entries(items)
+    recorded = not videos or record_in_manifest(s3_client, bucket_name, videos)
+    return recorded and not (summary and summary['failed'])
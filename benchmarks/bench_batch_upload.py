@@ -0,0 +1,104 @@
+"""
+Measures the batch mode of upload_script.py on a library of small videos
+(each with a thumbnail and a label) against a local S3 stand-in (a moto
+server, `pip install "moto[server]"`): one invocation of the script per
+video, as before, and one batch run with different numbers of parallel files.
+A second batch run over the same library shows the cost of skipping
+everything that is already uploaded.
+
+Usage: python benchmarks/bench_batch_upload.py [--videos 100] [--size 2] [--jobs 1 4 8]
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from moto.server import ThreadedMotoServer  # noqa: E402
+
+
+def make_library(directory, videos, size_mb):
+    block = os.urandom(size_mb * 1024 * 1024)
+    for i in range(videos):
+        name = os.path.join(directory, f"video-{i:04d}")
+        with open(name + '.mp4', 'wb') as f:
+            f.write(block[i:] + block[:i])
+        with open(name + '.png', 'wb') as f:
+            f.write(os.urandom(20000))
+        with open(name + '.txt', 'w') as f:
+            f.write(f"Video {i}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--videos', type=int, default=100)
+    parser.add_argument('--size', type=int, default=2, help="Video size in MB.")
+    parser.add_argument('--jobs', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--processes', type=int, default=20,
+                        help="Videos uploaded with one process each (the time is extrapolated to all videos).")
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    os.environ.update({
+        'AWS_ENDPOINT_URL': f"http://{host}:{port}",
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+    })
+
+    # imported after AWS_ENDPOINT_URL is set, so its clients talk to the stand-in
+    from batch_upload import ingest
+    from upload_script import create_s3_client, create_transfer_config
+
+    print(f"{'mode':>22} {'seconds':>8} {'videos/s':>9}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_library(directory, args.videos, args.size)
+
+        # the script uses the 'default' profile, which then takes its credentials from the config file
+        config_file = os.path.join(directory, 'aws-config')
+        with open(config_file, 'w') as f:
+            f.write("[default]\naws_access_key_id = testing\naws_secret_access_key = testing\n")
+
+        s3_client = create_s3_client(None, 'us-east-1')
+        s3_client.create_bucket(Bucket='bench-processes')
+        count = min(args.processes, args.videos)
+        start = time.perf_counter()
+        for i in range(count):
+            name = os.path.join(directory, f"video-{i:04d}")
+            with open(name + '.txt') as f:
+                label = f.read()
+            subprocess.run(
+                [sys.executable, os.path.join(ROOT, 'upload_script.py'), name + '.mp4', '-b', 'bench-processes',
+                 '-r', 'us-east-1', '-l', label, '-t', name + '.png'],
+                check=True, stdout=subprocess.DEVNULL, env=dict(os.environ, AWS_CONFIG_FILE=config_file),
+            )
+        elapsed = (time.perf_counter() - start) / count * args.videos
+        print(f"{'process per video':>22} {elapsed:>8.2f} {args.videos / elapsed:>9.1f}")
+
+        for jobs in args.jobs:
+            bucket = f"bench-batch-{jobs}"
+            s3_client = create_s3_client(None, 'us-east-1', jobs * 10)
+            s3_client.create_bucket(Bucket=bucket)
+
+            for label in (f"batch, {jobs} jobs", f"rerun, {jobs} jobs"):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    assert ingest(directory, s3_client, bucket, create_transfer_config(), jobs)
+                elapsed = time.perf_counter() - start
+                print(f"{label:>22} {elapsed:>8.2f} {args.videos / elapsed:>9.1f}")
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares the cost of building the /api/videos listing with the cached catalog
+against the previous approach of listing the bucket and downloading every label
+on each request, and a catalog read from the catalog.json manifest (a cold
+read, and a refresh of an unchanged manifest) against one built from the listing.
+
+Usage: python benchmarks/bench_catalog.py [--latency 0.002] [--sizes 10 1000 50000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import Catalog, build_manifest, classify_key, iter_objects, read_label, save_manifest  # noqa: E402
+from fake_s3 import FakeS3Client, populate  # noqa: E402
+
+BUCKET = 'bench-bucket'
+
+
+def uncached_listing(s3):
+    """The listing as it was built before the catalog: one GET per label, every time."""
+    assets = dict()
+    for obj in iter_objects(s3, BUCKET):
+        name, kind = classify_key(obj['Key'])
+        if kind is None:
+            continue
+        asset = assets.setdefault(name, dict())
+        if kind == 'label':
+            asset['label'] = read_label(s3, BUCKET, obj['Key'])
+        else:
+            asset[kind] = obj['Key']
+    return [name for name, data in assets.items() if 'video' in data]
+
+
+def measure(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def run(size, latency):
+    s3 = FakeS3Client()
+    populate(s3, size, BUCKET)
+    s3.latency = latency
+    results = dict()
+
+    s3.calls.clear()
+    results['uncached'] = (measure(lambda: uncached_listing(s3)), sum(s3.calls.values()))
+
+    catalog = Catalog(ttl=60, use_manifest=False)
+    s3.calls.clear()
+    results['cold'] = (measure(lambda: catalog.get_videos(s3, BUCKET)), sum(s3.calls.values()))
+
+    s3.calls.clear()
+    results['warm'] = (measure(lambda: catalog.get_videos(s3, BUCKET), repeat=1000), sum(s3.calls.values()))
+
+    # change one label, then refresh: only that label should be downloaded again
+    s3.put_object(Bucket=BUCKET, Key='video-000000.txt', Body='Renamed')
+    catalog.invalidate()
+    s3.calls.clear()
+    results['incremental'] = (measure(lambda: catalog.get_videos(s3, BUCKET)), sum(s3.calls.values()))
+
+    s3.latency = 0.0
+    save_manifest(s3, BUCKET, build_manifest(s3, BUCKET))
+    s3.latency = latency
+
+    catalog = Catalog(ttl=60)
+    s3.calls.clear()
+    results['manifest'] = (measure(lambda: catalog.get_videos(s3, BUCKET)), sum(s3.calls.values()))
+
+    catalog.invalidate()
+    s3.calls.clear()
+    results['unchanged'] = (measure(lambda: catalog.get_videos(s3, BUCKET)), sum(s3.calls.values()))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated S3 round trip time in seconds.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 50000], help="Number of objects in the bucket.")
+    args = parser.parse_args()
+
+    print(f"{'objects':>8} {'mode':>12} {'ms/request':>12} {'S3 calls':>9}")
+    for size in args.sizes:
+        for mode, (ms, calls) in run(size, args.latency).items():
+            print(f"{size:>8} {mode:>12} {ms:>12.3f} {calls:>9}")
+
+
+if __name__ == '__main__':
+    main()
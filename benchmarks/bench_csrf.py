@@ -0,0 +1,124 @@
+"""
+Measures static file throughput with the CSRF cookie set on every response
+(the old `set_csrf_cookie`) and only on pages and API responses that need a
+new token (app.set_csrf_cookie), then checks that CSRF protection of
+/api/signup, /api/login and /api/logout still works the same way:
+
+  - without a token, or with a forged one, the requests fail with 400
+  - with the token from the cookie, they succeed, also after login and logout
+  - static files come without Set-Cookie, the page sets the cookie once
+
+The database is the in-memory stand-in from fake_db.py.
+
+Usage: python benchmarks/bench_csrf.py [--requests 5000]
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('HASH_WORKERS', '0')
+
+from flask_wtf.csrf import generate_csrf  # noqa: E402
+
+import app as site  # noqa: E402
+from fake_db import FakeDatabase, FakePool  # noqa: E402
+
+FILES = ['js/main.js', 'js/video.js', 'js/auth.js', 'css/style.css', 'locales/en.json', 'img/flags/us.svg']
+
+
+def set_csrf_cookie_every_response(response):
+    response.set_cookie('csrf_token', generate_csrf())
+    return response
+
+
+def replace_hook(old, new):
+    hooks = site.app.after_request_funcs[None]
+    hooks[hooks.index(old)] = new
+
+
+def run(label, requests):
+    client = site.app.test_client()
+    client.get('/')  # a returning visitor: session and CSRF cookies are set
+
+    cookies = 0
+    start = time.perf_counter()
+    for i in range(requests):
+        response = client.get('/' + FILES[i % len(FILES)])
+        cookies += bool(response.headers.getlist('Set-Cookie'))
+    elapsed = time.perf_counter() - start
+    print(f"{label:>20} {requests / elapsed:>10.0f} req/s {cookies / requests:>12.0%}")
+
+
+def post(client, path, body=None, token=None):
+    headers = {'X-CSRF-Token': token} if token is not None else {}
+    return client.post(path, json=body or {}, headers=headers).status_code
+
+
+def csrf_cookie(client):
+    cookie = client.get_cookie('csrf_token')
+    return cookie.value if cookie is not None else None
+
+
+def check_protection():
+    site.app.extensions['db_pool'] = FakePool(FakeDatabase())
+    client = site.app.test_client()
+    credentials = {'email': 'viewer@example.com', 'password': 'secret'}
+    results = []
+
+    def check(description, actual, expected):
+        results.append(actual == expected)
+        print(f"  {'ok' if actual == expected else 'FAILED':>6}  {description}: {actual}")
+
+    for path in FILES:
+        response = client.get('/' + path)
+        check(f"no Set-Cookie on /{path}", response.headers.getlist('Set-Cookie'), [])
+    check("no token before the page is loaded", csrf_cookie(client), None)
+
+    response = client.get('/')
+    check("the page sets the CSRF cookie", 'csrf_token' in str(response.headers.getlist('Set-Cookie')), True)
+    token = csrf_cookie(client)
+    check("the page doesn't replace a valid cookie", client.get('/').headers.getlist('Set-Cookie'), [])
+
+    check("signup without token", post(client, '/api/signup', credentials), 400)
+    check("signup with a forged token", post(client, '/api/signup', credentials, token[::-1]), 400)
+    check("signup with the cookie's token", post(client, '/api/signup', credentials, token), 201)
+
+    check("logout without token", post(client, '/api/logout'), 400)
+    check("logout with the cookie's token", post(client, '/api/logout', token=csrf_cookie(client)), 200)
+
+    check("login without token", post(client, '/api/login', credentials), 400)
+    check("login with a forged token", post(client, '/api/login', credentials, 'forged'), 400)
+    check("login with the cookie's token", post(client, '/api/login', credentials, csrf_cookie(client)), 200)
+
+    other = site.app.test_client()
+    other.get('/')
+    check("logout with another session's token", post(client, '/api/logout', token=csrf_cookie(other)), 400)
+
+    client.delete_cookie('csrf_token')
+    client.get('/api/check-auth')
+    check("an API response replaces a missing cookie", csrf_cookie(client) is not None, True)
+    check("logout with the new token", post(client, '/api/logout', token=csrf_cookie(client)), 200)
+    return all(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    print(f"{'CSRF cookie':>20} {'static':>14} {'Set-Cookie':>12}")
+    replace_hook(site.set_csrf_cookie, set_csrf_cookie_every_response)
+    run('every response', args.requests)
+    replace_hook(set_csrf_cookie_every_response, site.set_csrf_cookie)
+    run('when needed', args.requests)
+
+    print("\nCSRF protection:")
+    if not check_protection():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
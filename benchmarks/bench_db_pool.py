@@ -0,0 +1,79 @@
+"""
+Load test for the database layer: simulates requests that each run one
+`User.get` lookup (what Flask-Login's user_loader does), either with a fresh
+connection per request (the previous behaviour) or through db.ConnectionPool.
+
+Needs a local PostgreSQL with the app's `users` table, e.g.
+    DATABASE_URL=postgresql://localhost/streaming python benchmarks/bench_db_pool.py --threads 8 --requests 2000
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import ConnectionPool  # noqa: E402
+from models import User  # noqa: E402
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def run(label, checkout, checkin, threads, requests):
+    latencies = []
+    lock = threading.Lock()
+    per_thread = requests // threads
+
+    def worker():
+        local = []
+        for i in range(per_thread):
+            start = time.perf_counter()
+            conn = checkout()
+            try:
+                User.get(conn, i + 1)
+            finally:
+                checkin(conn)
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"{label:>12} {len(latencies) / elapsed:>10.0f} req/s"
+          f"  p50 {percentile(latencies, 0.5) * 1000:7.2f}ms"
+          f"  p99 {percentile(latencies, 0.99) * 1000:7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help="Defaults to DATABASE_URL.")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--pool-size', type=int, default=4, help="Smaller than --threads to exercise waiting.")
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error("a database is required, pass --dsn or set DATABASE_URL")
+
+    run('connect', lambda: psycopg2.connect(args.dsn), lambda conn: conn.close(), args.threads, args.requests)
+
+    pool = ConnectionPool(args.dsn, max_size=args.pool_size, timeout=30)
+    run('pool', pool.getconn, pool.putconn, args.threads, args.requests)
+    print(json.dumps(pool.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Compares the playback of progressive MP4 with adaptive HLS (package_hls.py)
+over a few simulated network traces.
+
+A synthetic 1080p video (a test pattern with noise, so it doesn't compress
+to nothing) is packaged with package_hls.py into a local directory. Playback
+is then simulated with the real segment sizes: the MP4 is the 1080p encoding
+downloaded front to back, HLS downloads segment by segment and picks the
+rendition from its throughput estimate, the way hls.js does. Both start once
+the first segment's worth of video is buffered and buffer at most 30 seconds
+ahead. The benchmark reports the startup time, the number and total length of
+stalls and the average bitrate played.
+
+Needs ffmpeg with libx264. Usage: python benchmarks/bench_hls.py [--duration 20] [--ffmpeg ffmpeg]
+"""
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from package_hls import MEDIA_PLAYLIST, RENDITIONS, measure_bandwidth, package  # noqa: E402
+
+
+MAX_BUFFER = 30  # seconds of video a player buffers ahead
+REQUEST_LATENCY = 0.05  # seconds per request (presigning is done by the site, not counted)
+
+# name -> Mbit/s for each second, repeated as needed
+TRACES = {
+    'steady 10 Mbit/s': [10],
+    'variable': [8, 8, 6, 3, 1.5, 1.5, 0.8, 0.8, 2, 4, 6, 8, 8, 8, 3, 2],
+    'mobile 2 Mbit/s': [2, 2.5, 1.5, 2, 1, 2.5],
+}
+
+
+def make_source(ffmpeg, path, duration):
+    subprocess.run([
+        ffmpeg, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1920x1080:rate=30:duration={duration},noise=alls=30:allf=t',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '18', '-c:a', 'aac', '-shortest', path,
+    ], check=True)
+
+
+def read_segments(directory):
+    """[(duration, bits)] of a rendition's segments."""
+    with open(os.path.join(directory, MEDIA_PLAYLIST)) as f:
+        lines = f.read().splitlines()
+    return [
+        (float(line[len('#EXTINF:'):].split(',')[0]), os.path.getsize(os.path.join(directory, uri)) * 8)
+        for line, uri in zip(lines, lines[1:]) if line.startswith('#EXTINF:')
+    ]
+
+
+def download(trace, start, bits):
+    """The time at which a download of `bits` started at `start` finishes."""
+    t = start + REQUEST_LATENCY
+    while bits > 0:
+        rate = trace[int(t) % len(trace)] * 1e6
+        step = min(int(t) + 1 - t, bits / rate)
+        bits -= step * rate
+        t += step
+    return t
+
+
+def simulate(trace, renditions, choose):
+    """
+    Plays the video segment by segment. `renditions` are (bandwidth, segments)
+    lowest first, `choose(estimate, buffer)` returns the index of the rendition
+    for the next segment. Returns the playback statistics.
+    """
+    clock, buffer, playing = 0.0, 0.0, False
+    startup, stalls, stalled, estimate = None, 0, 0.0, None
+    played_bits, played_seconds, switches, previous = 0, 0.0, 0, None
+
+    for i in range(len(renditions[0][1])):
+        if buffer > MAX_BUFFER:
+            clock += buffer - MAX_BUFFER
+            buffer = MAX_BUFFER
+
+        index = choose(estimate, buffer)
+        duration, bits = renditions[index][1][i]
+        finished = download(trace, clock, bits)
+        elapsed = finished - clock
+        throughput = bits / max(elapsed - REQUEST_LATENCY, 1e-6)
+        estimate = throughput if estimate is None else 0.7 * estimate + 0.3 * throughput
+
+        if playing:
+            if elapsed > buffer:
+                stalls += 1
+                stalled += elapsed - buffer
+            buffer = max(buffer - elapsed, 0.0)
+        clock = finished
+        buffer += duration
+
+        if not playing:
+            playing, startup = True, clock
+        switches += previous is not None and index != previous
+        previous = index
+        played_bits += bits
+        played_seconds += duration
+
+    return {
+        'startup': startup,
+        'stalls': stalls,
+        'stalled': stalled,
+        'bitrate': played_bits / played_seconds / 1e6,
+        'switches': switches,
+    }
+
+
+def abr(renditions):
+    """Like hls.js: start low, then the highest rendition that fits into 80% of the estimate."""
+    def choose(estimate, buffer):
+        if estimate is None:
+            return 0
+        fitting = [i for i, (bandwidth, _) in enumerate(renditions) if bandwidth <= 0.8 * estimate]
+        index = fitting[-1] if fitting else 0
+        # with less than one segment buffered, don't risk a stall on a bigger segment
+        return min(index, 1) if buffer < 4 else index
+    return choose
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=int, default=20, help="Length of the test video in seconds (encoding it takes a while).")
+    parser.add_argument('--ffmpeg', default='ffmpeg', help="The ffmpeg executable, built with libx264.")
+    parser.add_argument('--segment-duration', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'source.mp4')
+        make_source(args.ffmpeg, source, args.duration)
+
+        output_dir = os.path.join(directory, 'hls')
+        with contextlib.redirect_stdout(io.StringIO()):
+            names = package(args.ffmpeg, source, output_dir, list(RENDITIONS), args.segment_duration, 'ultrafast')
+
+        renditions = [
+            (measure_bandwidth(os.path.join(output_dir, name))[0], read_segments(os.path.join(output_dir, name)))
+            for name in names
+        ]
+
+    print(f"{args.duration}s video, {args.segment_duration}s segments, renditions (peak Mbit/s): "
+          + ', '.join(f"{name} {bandwidth / 1e6:.1f}" for name, (bandwidth, _) in zip(names, renditions)) + "\n")
+    print(f"{'trace':>18} {'mode':>6} {'startup s':>10} {'stalls':>7} {'stalled s':>10} {'Mbit/s':>7} {'switches':>9}")
+
+    for trace_name, trace in TRACES.items():
+        modes = {
+            # progressive download of the single 1080p file
+            'mp4': simulate(trace, renditions[-1:], lambda estimate, buffer: 0),
+            'hls': simulate(trace, renditions, abr(renditions)),
+        }
+        for mode, result in modes.items():
+            print(f"{trace_name:>18} {mode:>6} {result['startup']:>10.2f} {result['stalls']:>7} "
+                  f"{result['stalled']:>10.1f} {result['bitrate']:>7.2f} {result['switches']:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Measures the wall-clock time of a cold catalog build against an S3 stand-in
+that adds a fixed latency to every call, with labels downloaded one after the
+other (1 worker) and through the catalog's thread pool.
+
+Usage: python benchmarks/bench_label_fetch.py [--labels 300] [--latency 0.02] [--workers 1 4 16 32]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import Catalog  # noqa: E402
+from fake_s3 import FakeS3Client, populate  # noqa: E402
+
+BUCKET = 'bench-bucket'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--labels', type=int, default=300, help="Number of videos, each with a label.")
+    parser.add_argument('--latency', type=float, default=0.02, help="Simulated S3 round trip time in seconds.")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16, 32], help="Thread pool sizes to compare.")
+    args = parser.parse_args()
+
+    s3 = FakeS3Client()
+    populate(s3, args.labels * 3, BUCKET)
+    s3.latency = args.latency
+
+    print(f"{args.labels} labels, {args.latency * 1000:.0f}ms per S3 call")
+    print(f"{'workers':>8} {'build ms':>10} {'speedup':>8}")
+
+    baseline = None
+    for workers in args.workers:
+        catalog = Catalog(max_workers=workers, batch_size=max(100, workers * 4))
+        start = time.perf_counter()
+        videos = catalog.get_videos(s3, BUCKET)
+        elapsed = (time.perf_counter() - start) * 1000
+        assert len(videos) == args.labels
+
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>10.1f} {baseline / elapsed:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Measures the latency of the login lookup (User.get_by_email) against a real
+PostgreSQL database with `--users` accounts (default one million).
+
+The schema is built by migrate.py in a scratch schema `bench_login_query`,
+which is dropped afterwards. The users table is filled, and the lookup is
+timed on one connection as it ran before and after the migrations:
+
+  email = %s              the old exact-match query, without an index
+  lower(email)            the case-insensitive query, without an index
+  lower(email), index     after 0002_users_email_lower_unique.sql
+  ..., prepared           the same, as a statement prepared on the connection
+  id, prepared            User.get, for comparison
+
+Every lookup is for a random existing user, the case-insensitive ones with
+the email's case changed.
+
+Usage: python benchmarks/bench_login_query.py --database-url postgresql://localhost/postgres [--users 1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import psycopg2  # noqa: E402
+
+from db import PreparingConnection, execute_prepared  # noqa: E402
+from migrate import load_migrations, migrate  # noqa: E402
+from models import GET_USER, GET_USER_BY_EMAIL  # noqa: E402
+
+SCHEMA = 'bench_login_query'
+OLD_GET_USER_BY_EMAIL = "SELECT id, email, password_hash FROM users WHERE email = %s"
+PASSWORD_HASH = 'scrypt:32768:8:1$' + 'x' * 16 + '$' + 'f' * 128  # the length of a real hash
+
+
+def connect(database_url, connection_factory=None):
+    conn = psycopg2.connect(database_url, connection_factory=connection_factory)
+    with conn.cursor() as cur:
+        cur.execute(f"SET search_path TO {SCHEMA}")
+    conn.commit()
+    return conn
+
+
+def email(i):
+    return f"user{i}@example.com"
+
+
+def fill(conn, users):
+    with conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO users (email, password_hash) "
+            "SELECT 'user' || i || '@example.com', %s FROM generate_series(1, %s) AS i",
+            (PASSWORD_HASH, users),
+        )
+        cur.execute("ANALYZE users")
+    conn.commit()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def measure(label, conn, query, lookups):
+    latencies = []
+    with conn.cursor() as cur:
+        for key, expected in lookups:
+            start = time.perf_counter()
+            query(cur, key)
+            row = cur.fetchone()
+            latencies.append(time.perf_counter() - start)
+            assert row is not None and row[0] == expected, (key, row)
+    conn.rollback()
+    print(f"{label:>28} {len(latencies):>8} {percentile(latencies, 0.5) * 1000:>9.3f} "
+          f"{percentile(latencies, 0.99) * 1000:>9.3f} {len(latencies) / sum(latencies):>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'),
+                        help="A PostgreSQL database to create the scratch schema in. Defaults to DATABASE_URL.")
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--lookups', type=int, default=5000, help="Lookups per indexed query.")
+    parser.add_argument('--scans', type=int, default=50, help="Lookups per query without an index (full table scans).")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        print("Error: No database given. Provide it with --database-url or the DATABASE_URL environment variable.")
+        sys.exit(1)
+
+    rng = random.Random(0)
+    ids = [rng.randint(1, args.users) for _ in range(args.lookups)]
+    exact = [(email(i), i) for i in ids]
+    mixed_case = [(email(i).upper() if i % 2 else email(i).capitalize(), i) for i in ids]
+
+    admin = psycopg2.connect(args.database_url)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cur.execute(f"CREATE SCHEMA {SCHEMA}")
+
+    try:
+        conn = connect(args.database_url)
+        migrations = load_migrations()
+        migrate(conn, migrations[:1], log=lambda message: None)  # the users table as it was
+
+        start = time.perf_counter()
+        fill(conn, args.users)
+        print(f"{args.users} users inserted in {time.perf_counter() - start:.1f}s\n")
+        print(f"{'query':>28} {'lookups':>8} {'p50 ms':>9} {'p99 ms':>9} {'per s':>9}")
+
+        measure('email = %s', conn,
+                lambda cur, key: cur.execute(OLD_GET_USER_BY_EMAIL, (key,)), exact[:args.scans])
+        measure('lower(email)', conn,
+                lambda cur, key: execute_prepared(conn, cur, 'user_get_by_email', GET_USER_BY_EMAIL, (key,)),
+                mixed_case[:args.scans])
+
+        start = time.perf_counter()
+        migrate(conn, migrations, log=lambda message: None)
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE users")
+        conn.commit()
+        print(f"{'(index built in':>28} {time.perf_counter() - start:.1f}s)")
+
+        measure('lower(email), index', conn,
+                lambda cur, key: execute_prepared(conn, cur, 'user_get_by_email', GET_USER_BY_EMAIL, (key,)),
+                mixed_case)
+
+        prepared = connect(args.database_url, PreparingConnection)
+        measure('lower(email), index, prepared', prepared,
+                lambda cur, key: execute_prepared(prepared, cur, 'user_get_by_email', GET_USER_BY_EMAIL, (key,)),
+                mixed_case)
+        measure('id, prepared', prepared,
+                lambda cur, key: execute_prepared(prepared, cur, 'user_get', GET_USER, (key,)),
+                [(i, i) for i in ids])
+        prepared.close()
+        conn.close()
+
+    finally:
+        with admin.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        admin.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+Measures /api/videos latency while other clients flood /api/login, with
+password hashing done inline in the request thread (HASH_WORKERS=0, no queue
+limit, the previous behaviour) and in the hashing process pool.
+
+The app runs in a threaded server with in-memory S3 and database stand-ins.
+
+Usage: python benchmarks/bench_login_storm.py [--storm 16] [--seconds 10]
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from app import app  # noqa: E402
+import api_routes  # noqa: E402
+from hashing import PasswordHasher  # noqa: E402
+from fake_db import FakeDatabase, FakePool  # noqa: E402
+from fake_s3 import FakeS3Client, populate  # noqa: E402
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def request(port, method, path, body=None, cookie=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    headers = {'Content-Type': 'application/json'}
+    if cookie:
+        headers['Cookie'] = cookie
+    conn.request(method, path, body=json.dumps(body) if body else None, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    return response
+
+
+def run(label, hasher, port, storm, seconds):
+    app.extensions['password_hasher'] = hasher
+
+    login = request(port, 'POST', '/api/login', {'email': 'viewer@example.com', 'password': 'secret'})
+    cookie = '; '.join(header.split(';')[0] for header in login.msg.get_all('Set-Cookie'))
+
+    stop = threading.Event()
+    statuses = []
+
+    def attacker():
+        while not stop.is_set():
+            response = request(port, 'POST', '/api/login', {'email': 'viewer@example.com', 'password': 'wrong'})
+            statuses.append(response.status)
+
+    attackers = [threading.Thread(target=attacker) for _ in range(storm)]
+    for t in attackers:
+        t.start()
+
+    latencies = []
+    deadline = time.monotonic() + seconds
+    try:
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            assert request(port, 'GET', '/api/videos', cookie=cookie).status == 200
+            latencies.append(time.perf_counter() - start)
+    finally:
+        stop.set()
+        for t in attackers:
+            t.join()
+
+    rejected = statuses.count(429)
+    print(f"{label:>8} p50 {percentile(latencies, 0.5) * 1000:8.1f}ms  p99 {percentile(latencies, 0.99) * 1000:8.1f}ms"
+          f"  logins {len(statuses):>5}  rejected {rejected:>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--storm', type=int, default=16, help="Concurrent clients sending logins.")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Hashing processes.")
+    args = parser.parse_args()
+
+    s3 = FakeS3Client()
+    populate(s3, 300, app.config['S3_BUCKET_NAME'])
+    api_routes.get_s3_client = lambda: s3
+
+    db = FakeDatabase()
+    db.add_user('viewer@example.com', generate_password_hash('secret'))
+    app.extensions['db_pool'] = FakePool(db)
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    run('inline', PasswordHasher(max_workers=0, max_pending=10000), server.port, args.storm, args.seconds)
+    pool = PasswordHasher(max_workers=args.workers)
+    pool.verify(generate_password_hash('warm-up'), 'warm-up')  # start the processes
+    run('pool', pool, server.port, args.storm, args.seconds)
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
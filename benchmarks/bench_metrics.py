@@ -0,0 +1,154 @@
+"""
+Measures the overhead of metrics.py: per request (timing, Server-Timing
+header, histograms), per span, and per S3 call through the botocore hooks.
+
+The request overhead is measured on a view that does no work besides
+`--spans` empty spans, the worst case relative to real requests, which
+spend milliseconds on S3 and the database. Each configuration runs in
+Flask's test client without a network:
+
+  disabled   METRICS_ENABLED off (spans are no-ops)
+  enabled    timing, histograms and Server-Timing
+  profiled   enabled, and every request profiled by the stack sampler
+
+S3 calls are answered by botocore's Stubber, so only the client's own
+overhead is compared with and without instrumentation.
+
+Each configuration also streams `--ranges` 206 responses from
+storage.send_file_range, whose bodies bypass Werkzeug's close callbacks,
+and checks that every one was counted in the request histogram and that no
+stack sampler was left running.
+
+Usage: python benchmarks/bench_metrics.py [--requests 20000] [--spans 5] [--ranges 200]
+"""
+import argparse
+import datetime
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import boto3  # noqa: E402
+from botocore.stub import Stubber  # noqa: E402
+from flask import Flask  # noqa: E402
+
+import metrics  # noqa: E402
+from storage import send_file_range  # noqa: E402
+
+
+CONFIGS = {
+    'disabled': {'METRICS_ENABLED': False},
+    'enabled': {'METRICS_ENABLED': True},
+    'profiled': {'METRICS_ENABLED': True, 'PROFILE_SAMPLE_RATE': 1.0},
+}
+
+
+def create_app(config, spans, media_path):
+    app = Flask(__name__)
+    app.config.update(config, METRICS_TOKEN='bench')
+    metrics.init_app(app)
+
+    @app.route('/work')
+    def work():
+        for i in range(spans):
+            with metrics.span('db', 'query'):
+                pass
+        return 'ok'
+
+    @app.route('/media')
+    def media():
+        return send_file_range(media_path, chunk_size=4096)
+
+    return app
+
+
+def time_requests(app, n):
+    client = app.test_client()
+    for _ in range(200):
+        client.get('/work').close()
+
+    start = time.perf_counter()
+    for _ in range(n):
+        client.get('/work').close()  # closing runs the histogram update
+    return (time.perf_counter() - start) / n
+
+
+def check_ranges(app, n):
+    """
+    Streams `n` bounded and open-ended 206 responses and returns how many the
+    request histogram counted, and how many stack samplers are still running.
+    """
+    client = app.test_client()
+    for i in range(n):
+        response = client.get('/media', headers={'Range': 'bytes=100-8291' if i % 2 else 'bytes=100-'})
+        assert response.status_code == 206, response.status_code
+        response.close()
+
+    recorded = 0
+    if app.extensions.get('metrics') is not None:
+        counted = app.extensions['metrics'].requests.render()
+        recorded = sum(int(line.rsplit(' ', 1)[1]) for line in counted
+                       if line.startswith('http_request_duration_seconds_count') and 'endpoint="media"' in line)
+    samplers = sum(thread.name == 'stack-sampler' for thread in threading.enumerate())
+    return recorded, samplers
+
+
+def time_s3_calls(instrument, n):
+    client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='x', aws_secret_access_key='x')
+    if instrument:
+        metrics.Metrics().instrument_s3(client)
+
+    response = {
+        'Body': io.BytesIO(b'label'), 'ContentLength': 5, 'ETag': '"e"',
+        'LastModified': datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+    }
+    with Stubber(client) as stubber:
+        for _ in range(n):
+            stubber.add_response('get_object', response, {'Bucket': 'bucket', 'Key': 'label.txt'})
+
+        start = time.perf_counter()
+        for _ in range(n):
+            client.get_object(Bucket='bucket', Key='label.txt')
+        return (time.perf_counter() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--spans', type=int, default=5, help="Spans per request.")
+    parser.add_argument('--s3-calls', type=int, default=5000)
+    parser.add_argument('--ranges', type=int, default=200, help="Streamed 206 responses to check per configuration.")
+    args = parser.parse_args()
+
+    media = tempfile.NamedTemporaryFile(suffix='.mp4')
+    media.write(os.urandom(64 * 1024))
+    media.flush()
+
+    print(f"{args.requests} requests with {args.spans} spans each, {args.ranges} streamed ranges\n")
+    print(f"{'config':>10} {'us/request':>11} {'overhead us':>12} {'ranges counted':>15} {'samplers left':>14}")
+    baseline = None
+    for name, config in CONFIGS.items():
+        app = create_app(config, args.spans, media.name)
+        per_request = time_requests(app, args.requests)
+        baseline = per_request if baseline is None else baseline
+        recorded, samplers = check_ranges(app, args.ranges)
+        print(f"{name:>10} {per_request * 1e6:>11.1f} {(per_request - baseline) * 1e6:>12.1f} "
+              f"{recorded:>15} {samplers:>14}")
+        if config['METRICS_ENABLED'] and (recorded != args.ranges or samplers):
+            sys.exit(f"{name}: {recorded} of {args.ranges} streamed ranges counted, {samplers} samplers left running")
+
+    print(f"\n{args.s3_calls} stubbed S3 get_object calls\n")
+    print(f"{'hooks':>10} {'us/call':>11} {'overhead us':>12}")
+    plain = time_s3_calls(False, args.s3_calls)
+    hooked = time_s3_calls(True, args.s3_calls)
+    print(f"{'off':>10} {plain * 1e6:>11.1f} {0:>12.1f}")
+    print(f"{'on':>10} {hooked * 1e6:>11.1f} {(hooked - plain) * 1e6:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Simulates a connection that drops partway through a video upload and
+compares the time and the bytes sent again when the upload is restarted
+from scratch (boto3's upload_file) with a `--resume` rerun, which only sends
+the missing parts.
+
+Runs against a local S3 stand-in (a moto server, `pip install "moto[server]"`).
+
+Usage: python benchmarks/bench_resume.py [--size 500] [--part-size 16] [--fail-at 0.8]
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moto.server import ThreadedMotoServer  # noqa: E402
+
+from bench_upload import BUCKET, make_file  # noqa: E402
+
+
+class LinkDown(Exception):
+    pass
+
+
+def count_bytes(s3_client, fail_after=None):
+    """Counts the bytes of every part sent, failing once `fail_after` bytes were sent."""
+    sent = [0]
+
+    def before_send(request, **kwargs):
+        if fail_after is not None and sent[0] >= fail_after:
+            raise LinkDown()
+        if request.method == 'PUT' and 'uploadId=' in request.url:
+            sent[0] += int(request.headers.get('Content-Length', 0))
+
+    s3_client.meta.events.register('before-send.s3.UploadPart', before_send)
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=500, help="File size in MB.")
+    parser.add_argument('--part-size', type=int, default=16, help="Part size in MB.")
+    parser.add_argument('--fail-at', type=float, default=0.8, help="Fraction of the file sent before the link drops.")
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    os.environ.update({
+        'AWS_ENDPOINT_URL': f"http://{host}:{port}",
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+    })
+
+    # imported after AWS_ENDPOINT_URL is set, so its clients talk to the stand-in
+    from upload_script import create_s3_client, create_transfer_config, upload_to_s3
+
+    fail_after = int(args.size * 1024 * 1024 * args.fail_at)
+    transfer_config = create_transfer_config(args.part_size, 4)
+
+    print(f"{'mode':>8} {'1st run MB':>11} {'rerun MB':>9} {'rerun s':>8}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = make_file(directory, args.size)
+
+        for mode in ('restart', 'resume'):
+            resume = mode == 'resume'
+            results = []
+
+            for limit in (fail_after, None):
+                s3_client = create_s3_client(None, 'us-east-1', 4)
+                s3_client.create_bucket(Bucket=BUCKET)
+                sent = count_bytes(s3_client, limit)
+
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    try:
+                        uploaded = upload_to_s3(s3_client, path, BUCKET, transfer_config=transfer_config,
+                                                show_progress=False, resume=resume)
+                    except LinkDown:
+                        uploaded = False
+                results.append((sent[0], time.perf_counter() - start, uploaded))
+
+            (first, _, _), (rerun, elapsed, uploaded) = results
+            assert uploaded
+            s3_client.delete_object(Bucket=BUCKET, Key=os.path.basename(path))
+            print(f"{mode:>8} {first / 2 ** 20:>11.0f} {rerun / 2 ** 20:>9.0f} {elapsed:>8.2f}")
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
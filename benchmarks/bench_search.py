@@ -0,0 +1,128 @@
+"""
+Measures the catalog search index (search.py) at `--titles` videos: the time
+and memory to build it, the time to sync it after a catalog refresh that
+changed a few videos, and the latency of typical queries, compared with
+filtering and sorting the catalog list on every query.
+
+The titles are drawn from a vocabulary of made-up words with a Zipf-like
+distribution, so short prefixes match many videos and long ones few, as in
+real titles.
+
+Usage: python benchmarks/bench_search.py [--titles 100000] [--queries 200]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import make_entry  # noqa: E402
+from search import SORT_KEYS, SearchIndex, tokenize  # noqa: E402
+
+
+def make_catalog(titles, rng):
+    vocabulary = sorted({
+        ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 10))) for _ in range(5000)
+    })
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    videos = []
+    for i in range(titles):
+        words = rng.choices(vocabulary, weights, k=rng.randint(2, 6))
+        name = f"{'-'.join(words[:2])}-{i:06d}"
+        label = ' '.join(words).capitalize() + f" (part {rng.randint(1, 20)})"
+        asset = {'video': {'Key': f'{name}.mp4', 'Size': rng.randint(10, 4000) * 1024 * 1024}}
+        videos.append(make_entry(name, asset, label))
+    videos.sort(key=lambda entry: entry['name'])
+    return videos, vocabulary
+
+
+def linear_search(videos, query, sort, descending, offset, limit):
+    """What a search without an index does: filter and sort the whole catalog."""
+    words = tokenize(query)
+    matches = [
+        entry for entry in videos
+        if all(any(term.startswith(word) for term in tokenize(entry['name'] + ' ' + entry['label'])) for word in words)
+    ]
+    matches.sort(key=SORT_KEYS[sort], reverse=descending)
+    return matches[offset:offset + limit], len(matches)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def time_queries(search, queries):
+    latencies, total = [], 0
+    for query, sort, descending in queries:
+        start = time.perf_counter()
+        _, matches = search(query, sort, descending, 0, 50)
+        latencies.append(time.perf_counter() - start)
+        total += matches
+    return latencies, total / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--titles', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200, help="Queries per kind.")
+    parser.add_argument('--linear-queries', type=int, default=10, help="Queries per kind without the index.")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    videos, vocabulary = make_catalog(args.titles, rng)
+    common, rare = vocabulary[:50], vocabulary[-2000:]
+
+    tracemalloc.start()
+    SearchIndex().sync(videos)
+    memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.sync(videos)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.search('', 'size', True, 0, 50)  # builds the orderings
+    index.search('', 'label', False, 0, 50)
+    orderings = time.perf_counter() - start
+
+    # a refresh: a new list with 10 videos removed, 10 added and 10 relabelled
+    refreshed = [dict(entry) for entry in videos[10:]]
+    for entry in refreshed[:10]:
+        entry['label'] = 'Renamed ' + entry['label']
+    refreshed += make_catalog(10, random.Random(1))[0]
+    start = time.perf_counter()
+    index.sync(refreshed)
+    resync = time.perf_counter() - start
+
+    print(f"{args.titles} titles, {index.stats()['words']} distinct words\n")
+    print(f"index build          {build * 1000:8.1f} ms, {memory / 1e6:.1f} MB peak")
+    print(f"sort orderings       {orderings * 1000:8.1f} ms (name, size, label)")
+    print(f"sync after refresh   {resync * 1000:8.1f} ms (30 of {len(refreshed)} videos changed)\n")
+
+    kinds = {
+        'no query, by size': lambda: ('', 'size', True),
+        '1-letter prefix': lambda: (rng.choice(string.ascii_lowercase), 'name', False),
+        '3-letter prefix': lambda: (rng.choice(common)[:3], 'label', False),
+        'common word': lambda: (rng.choice(common), 'name', False),
+        'rare word': lambda: (rng.choice(rare), 'name', False),
+        'two words': lambda: (f"{rng.choice(common)} {rng.choice(common)[:3]}", 'size', True),
+    }
+
+    print(f"{'query':>18} {'matches':>8} {'p50 ms':>10} {'p99 ms':>8} {'linear p50 ms':>14}")
+    for kind, make_query in kinds.items():
+        queries = [make_query() for _ in range(args.queries)]
+        latencies, matches = time_queries(index.search, queries)
+        linear, _ = time_queries(lambda *query: linear_search(refreshed, *query), queries[:args.linear_queries])
+        print(f"{kind:>18} {matches:>8.0f} {percentile(latencies, 0.5) * 1000:>10.3f} "
+              f"{percentile(latencies, 0.99) * 1000:>8.3f} {percentile(linear, 0.5) * 1000:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+Measures how fast the site starts: the time to import the app and to run
+`upload_script.py --help`, and under gunicorn with `--workers` workers
+
+  ready      seconds from starting gunicorn until each worker has answered
+             its first request (the slowest worker)
+  first      how long the first request of each worker took inside the
+             worker (p50 and max over the workers, from Server-Timing)
+  restart    seconds from stopping a worker until its replacement has
+             answered its first request, and how long that request took
+
+for these configurations:
+
+  cold       WARM_UP=0, each worker imports the app and loads everything on first use
+  warm       the default: each worker connects and loads the catalog before accepting requests
+  preload    WEB_PRELOAD=1 and warm-up: the app is imported once by the master
+
+Every request is GET /api/videos?limit=100 with a session cookie for the
+benchmark user, sent by `--workers` x 2 clients until every worker answered.
+S3 is a moto server with `--objects` objects (needs `pip install
+moto[server]`), so the workers import, build and use a real boto3 client.
+The database is the stand-in from fake_db.py.
+
+Usage: python benchmarks/bench_startup.py [--workers 4] [--objects 600] [--configs cold warm preload]
+"""
+import argparse
+import http.client
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_suite import fill_bucket, start_moto  # noqa: E402
+
+CONFIGS = {
+    'cold': {'WARM_UP': '0', 'WEB_PRELOAD': '0'},
+    'warm': {'WARM_UP': '1', 'WEB_PRELOAD': '0'},
+    'preload': {'WARM_UP': '1', 'WEB_PRELOAD': '1'},
+}
+PATH = '/api/videos?limit=100'
+
+
+def create_app():
+    """The app gunicorn runs, with a user in the database stand-in and the worker's pid on every response."""
+    from werkzeug.security import generate_password_hash
+
+    from app import app
+    from fake_db import FakeDatabase, FakePool
+
+    db = FakeDatabase()
+    db.add_user('viewer@example.com', generate_password_hash('secret'))
+    app.extensions['db_pool'] = FakePool(db)
+
+    @app.after_request
+    def add_worker_pid(response):
+        response.headers['X-Worker-Pid'] = str(os.getpid())
+        return response
+
+    return app
+
+
+def session_cookie():
+    """A session cookie of the benchmark user (id 1), signed like the app signs it."""
+    from app import app
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    return f"{app.config['SESSION_COOKIE_NAME']}={serializer.dumps({'_user_id': '1', '_fresh': True})}"
+
+
+def time_command(args, runs=3):
+    """The fastest of `runs` runs of a Python command, in seconds."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+class Prober:
+    """
+    Sends requests from a few threads, recording for every worker pid when
+    its first response arrived and how long the worker took for it.
+    """
+
+    def __init__(self, port, cookie, clients):
+        self.port = port
+        self.cookie = cookie
+        self.clients = clients
+        self.first = dict()  # pid -> (seconds since start, server time in seconds)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self.started = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self._threads = [threading.Thread(target=self._run) for _ in range(self.clients)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def wait_for(self, count, exclude=(), timeout=120):
+        """Waits until `count` workers not in `exclude` have answered. Returns their first responses."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                answered = {pid: first for pid, first in self.first.items() if pid not in exclude}
+            if len(answered) >= count:
+                return answered
+            time.sleep(0.005)
+        raise TimeoutError(f"Only {len(answered)} of {count} workers answered within {timeout}s")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+                conn.request('GET', PATH, headers={'Cookie': self.cookie})
+                response = conn.getresponse()
+                response.read()
+                conn.close()
+            except OSError:
+                time.sleep(0.005)  # not listening yet, or the worker was stopped
+                continue
+
+            arrived = time.monotonic() - self.started
+            self._stop.wait(0.02)  # so the probing doesn't slow down the booting workers
+            if response.status != 200:
+                continue
+            pid = int(response.headers['X-Worker-Pid'])
+            timing = re.search(r'app;dur=([\d.]+)', response.headers.get('Server-Timing', ''))
+            with self._lock:
+                if pid not in self.first:
+                    self.first[pid] = (arrived, float(timing.group(1)) / 1000 if timing else None)
+
+
+def run(config, args, env, port, cookie):
+    env = dict(env, GUNICORN_BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(args.workers), **CONFIGS[config])
+    prober = Prober(port, cookie, args.workers * 2)
+    prober.start()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '--chdir', os.path.dirname(os.path.abspath(__file__)), '--log-level', 'warning', 'bench_startup:create_app()'],
+        env=env,
+    )
+    try:
+        booted = prober.wait_for(args.workers)
+        ready = max(arrived for arrived, _ in booted.values())
+        first = sorted(duration for _, duration in booted.values())
+
+        stopped = next(iter(booted))
+        restart_start = time.monotonic() - prober.started
+        os.kill(stopped, signal.SIGTERM)
+        replacement = prober.wait_for(1, exclude=booted)
+        restart_arrived, restart_first = next(iter(replacement.values()))
+    finally:
+        prober.stop()
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+    print(f"{config:>8} {ready:>9.2f} {first[(len(first) - 1) // 2] * 1000:>12.1f} {first[-1] * 1000:>12.1f} "
+          f"{restart_arrived - restart_start:>10.2f} {restart_first * 1000:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configs', nargs='+', default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument('--workers', type=int, default=4, help="Gunicorn worker processes.")
+    parser.add_argument('--worker-class', default='gthread', help="Gunicorn worker model, see gunicorn.conf.py.")
+    parser.add_argument('--objects', type=int, default=600, help="Objects in the bucket (a third are videos).")
+    args = parser.parse_args()
+
+    python = time_command(['-c', 'pass'])
+    print(f"python -c pass                  {python:6.3f}s")
+    print(f"python -c 'import app'          {time_command(['-c', 'import app']):6.3f}s")
+    print(f"python upload_script.py --help  {time_command(['upload_script.py', '--help']):6.3f}s\n")
+
+    import boto3
+
+    moto, endpoint = start_moto()
+    credentials = dict(AWS_ENDPOINT_URL=endpoint, AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing',
+                       AWS_DEFAULT_REGION='us-east-1')
+    from app import app
+    client = boto3.client('s3', endpoint_url=endpoint, region_name='us-east-1', aws_access_key_id='testing',
+                          aws_secret_access_key='testing')
+    fill_bucket(client, args.objects, app.config['S3_BUCKET_NAME'])
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        WEB_WORKER_CLASS=args.worker_class,
+        METRICS_ENABLED='1',  # for the Server-Timing header
+        METRICS_TOKEN='bench',
+        HASH_WORKERS='1',
+        **credentials,
+    )
+
+    print(f"{args.workers} {args.worker_class} workers, {args.objects} objects in a moto bucket\n")
+    print(f"{'config':>8} {'ready s':>9} {'first p50 ms':>12} {'first max ms':>12} "
+          f"{'restart s':>10} {'restart ms':>11}")
+    try:
+        for config in args.configs:
+            with socket.socket() as s:
+                s.bind(('127.0.0.1', 0))
+                port = s.getsockname()[1]
+            run(config, args, env, port, session_cookie())
+    finally:
+        moto.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Compares the throughput of serving the SPA's static files from the in-memory
+asset store against reading them with send_from_directory on every request,
+for plain, compressed and revalidation (If-None-Match) requests.
+
+Usage: python benchmarks/bench_static.py [--requests 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import send_from_directory  # noqa: E402
+
+from app import app  # noqa: E402
+
+FILES = ['index.html', 'js/main.js', 'js/video.js', 'css/style.css', 'locales/en.json', 'img/flags/us.svg']
+
+
+@app.route('/_bench/send-from-directory/<path:path>')
+def send_from_disk(path):
+    return send_from_directory('static/public', path)
+
+
+def run(client, label, prefix, requests, headers=None, revalidate=False):
+    etags = dict()
+    if revalidate:
+        for name in FILES:
+            etags[name] = client.get(prefix + name, headers=headers).headers.get('ETag')
+
+    transferred = 0
+    start = time.perf_counter()
+    for i in range(requests):
+        name = FILES[i % len(FILES)]
+        request_headers = dict(headers or {})
+        if revalidate and etags[name]:
+            request_headers['If-None-Match'] = etags[name]
+        response = client.get(prefix + name, headers=request_headers)
+        transferred += len(response.data)
+    elapsed = time.perf_counter() - start
+
+    print(f"{label:>28} {requests / elapsed:>10.0f} req/s {transferred / requests:>10.0f} bytes/req")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    gzip = {'Accept-Encoding': 'gzip, br'}
+
+    run(client, 'send_from_directory', '/_bench/send-from-directory/', args.requests)
+    run(client, 'send_from_directory 304', '/_bench/send-from-directory/', args.requests, revalidate=True)
+    run(client, 'asset store', '/', args.requests)
+    run(client, 'asset store, compressed', '/', args.requests, headers=gzip)
+    run(client, 'asset store 304', '/', args.requests, headers=gzip, revalidate=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""
+Measures streaming a large video from local storage (STORAGE_BACKEND=local)
+to concurrent clients that seek around in it, the way players do.
+
+Three ways of serving the file run under gunicorn with sync workers, as in
+the Procfile:
+
+  read        reads the whole file into memory and answers the range from it
+  send_file   Flask's send_file with conditional=True (ranges read in Python)
+  storage     storage.send_file_range (open-ended ranges via sendfile(2))
+
+Each client alternates between a seek (a bounded 1MB range at a random
+offset) and playing on (an open-ended range from a random offset in the
+last `--tail` MB). Reported are requests/s, MB/s, the seek latency and the
+peak memory of the workers.
+
+Usage: python benchmarks/bench_storage.py [--size 512] [--clients 16] [--seconds 10]
+"""
+import argparse
+import http.client
+import os
+import random
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SEEK_SIZE = 1024 * 1024
+
+
+def create_app():
+    """The app gunicorn runs: one route per way of serving BENCH_FILE."""
+    from flask import Flask, Response, request, send_file
+
+    from storage import send_file_range
+
+    app = Flask(__name__)
+    path = os.environ['BENCH_FILE']
+
+    @app.route('/read')
+    def read():
+        with open(path, 'rb') as f:
+            response = Response(f.read(), mimetype='video/mp4')
+        return response.make_conditional(request, accept_ranges=True, complete_length=os.path.getsize(path))
+
+    @app.route('/send_file')
+    def flask_send_file():
+        return send_file(path, mimetype='video/mp4', conditional=True)
+
+    @app.route('/storage')
+    def storage():
+        return send_file_range(path)
+
+    return app
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def worker_peak_rss(master_pid):
+    """The largest peak RSS (VmHWM) among the master's worker processes, in MB."""
+    peak = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                status = dict(line.split(':', 1) for line in f if ':' in line)
+        except OSError:
+            continue
+        if int(status.get('PPid', '0').strip()) == master_pid:
+            peak = max(peak, int(status['VmHWM'].split()[0]) // 1024)
+    return peak
+
+
+def request_range(port, route, header):
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.request('GET', f'/{route}', headers={'Range': header})
+    response = connection.getresponse()
+    received = 0
+    while chunk := response.read(256 * 1024):
+        received += len(chunk)
+    connection.close()
+    assert response.status == 206, response.status
+    return time.perf_counter() - start, received
+
+
+def client(port, route, size, tail, deadline, stats, seed):
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        offset = rng.randrange(0, size - SEEK_SIZE)
+        elapsed, received = request_range(port, route, f'bytes={offset}-{offset + SEEK_SIZE - 1}')
+        stats['seeks'].append(elapsed)
+        stats['bytes'] += received
+        stats['requests'] += 1
+
+        offset = rng.randrange(size - tail, size)
+        _, received = request_range(port, route, f'bytes={offset}-')
+        stats['bytes'] += received
+        stats['requests'] += 1
+
+
+def run(route, path, size, args):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers),
+         '--chdir', os.path.dirname(os.path.abspath(__file__)), '--log-level', 'warning', 'bench_storage:create_app()'],
+        env=dict(os.environ, BENCH_FILE=path, PYTHONPATH=ROOT),
+    )
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        stats = {'seeks': [], 'bytes': 0, 'requests': 0}
+        deadline = time.monotonic() + args.seconds
+        threads = [
+            threading.Thread(target=client, args=(port, route, size, args.tail * 1024 * 1024, deadline, stats, i))
+            for i in range(args.clients)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        seeks = sorted(stats['seeks'])
+        p95 = seeks[int(len(seeks) * 0.95)] if seeks else float('nan')
+        print(f"{route:>10} {stats['requests'] / elapsed:>8.1f} {stats['bytes'] / elapsed / 1e6:>8.1f} "
+              f"{statistics.median(seeks) * 1000:>9.1f} {p95 * 1000:>9.1f} {worker_peak_rss(server.pid):>8}")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=512, help="Size of the video file in MB.")
+    parser.add_argument('--tail', type=int, default=8, help="Open-ended ranges start in the last TAIL MB.")
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--routes', nargs='+', default=['read', 'send_file', 'storage'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'video.mp4')
+        block = os.urandom(SEEK_SIZE)
+        with open(path, 'wb') as f:
+            for _ in range(args.size):
+                f.write(block)
+
+        print(f"{args.size}MB file, {args.clients} clients, {args.workers} sync workers, {args.seconds:g}s per route\n")
+        print(f"{'route':>10} {'req/s':>8} {'MB/s':>8} {'seek p50':>9} {'seek p95':>9} {'RSS MB':>8}")
+        for route in args.routes:
+            run(route, path, args.size * 1024 * 1024, args)
+
+
+if __name__ == '__main__':
+    main()
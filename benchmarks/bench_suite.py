@@ -0,0 +1,448 @@
+"""
+The site's load test: boots app.app under gunicorn (gunicorn.conf.py), runs
+the scenarios below against it one after the other, and writes a JSON report,
+so that runs on different commits can be compared.
+
+  login          POST /api/login, a password check and a user lookup
+  videos         GET /api/videos?limit=100, a page of the catalog with signed thumbnail URLs
+  videos_ndjson  GET /api/videos?format=ndjson, the whole catalog as the dashboard loads it
+  stream         GET /api/stream/<key> for random videos
+  search         GET /api/search?q=<prefix> for prefixes of the videos' numbers
+  static         GET of the pages' scripts and stylesheets
+
+S3 is the in-memory stand-in from fake_s3.py, waiting `--s3-latency` seconds
+per call, or a moto server (`--s3 moto`, needs `pip install moto[server]`).
+Either is filled with `--objects` objects, a third of them videos. The
+database is the stand-in from fake_db.py, waiting `--db-latency` seconds per
+query, or the PostgreSQL database given with `--database-url`, which is
+migrated and gets a benchmark user (use a scratch database).
+
+Each scenario runs `--concurrency` logged-in clients sending requests back
+to back, `--warmup` seconds untimed and then `--seconds` timed. Reported are
+requests/s, the mean, p50, p95 and p99 latency, the error count and the S3
+calls, presigned URLs and database queries per request, counted inside the
+workers. CSRF protection is off, so the clients don't need tokens.
+
+Usage: python benchmarks/bench_suite.py [--scenarios login videos stream static] [--output report.json] [--compare old.json]
+"""
+import argparse
+import datetime
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EMAIL, PASSWORD = 'viewer@example.com', 'secret'
+STATIC_FILES = ['/js/main.js', '/js/video.js', '/js/auth.js', '/css/style.css', '/css/dashboard.css']
+SCENARIOS = ['login', 'videos', 'videos_ndjson', 'stream', 'search', 'static']
+
+
+class CountingClient:
+    """Wraps an S3 client and counts the calls made through it, by method."""
+
+    def __init__(self, client, calls, lock):
+        self._client = client
+        self._calls = calls
+        self._lock = lock
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self._lock:
+                self._calls[name] += 1
+            return attr(*args, **kwargs)
+        return call
+
+
+def counting_connection(base):
+    """A connection class counting the statements executed on it in `counting_connection.queries`."""
+    import psycopg2.extensions
+
+    class CountingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            with counting_connection.lock:
+                counting_connection.queries += 1
+            return super().execute(query, vars)
+
+    class CountingConnection(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.cursor_factory = CountingCursor
+
+    return CountingConnection
+
+
+counting_connection.queries = 0
+counting_connection.lock = threading.Lock()
+
+
+def create_app():
+    """The app gunicorn runs, with S3 and the database configured by the BENCH_* variables."""
+    import psycopg2.extensions
+    from werkzeug.security import generate_password_hash
+
+    from app import app
+    import api_routes
+    import s3_client
+    from fake_db import FakeDatabase, FakePool
+    from fake_s3 import FakeS3Client, populate
+
+    s3_calls, lock = Counter(), threading.Lock()
+    requests = Counter()
+
+    if os.environ['BENCH_S3'] == 'fake':
+        s3 = FakeS3Client()
+        populate(s3, int(os.environ['BENCH_OBJECTS']), app.config['S3_BUCKET_NAME'])
+        s3.latency = float(os.environ['BENCH_S3_LATENCY'])  # after filling the bucket
+        client = CountingClient(s3, s3_calls, lock)
+        api_routes.get_s3_client = s3_client.get_s3_client = s3_client.get_warm_up_client = lambda: client
+    else:  # the app's own client, pointed at moto by AWS_ENDPOINT_URL
+        manager = app.extensions['s3_clients']
+        api_routes.get_s3_client = lambda: CountingClient(manager.get_client(), s3_calls, lock)
+
+    if os.environ.get('BENCH_DATABASE_URL'):
+        pool = app.extensions['db_pool']
+        pool.connection_factory = counting_connection(pool.connection_factory or psycopg2.extensions.connection)
+
+        def db_queries():
+            return counting_connection.queries
+    else:
+        db = FakeDatabase(latency=float(os.environ['BENCH_DB_LATENCY']))
+        db.add_user(EMAIL, generate_password_hash(PASSWORD))
+        app.extensions['db_pool'] = FakePool(db)
+
+        def db_queries():
+            return sum(db.queries.values())
+
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    @app.before_request
+    def count_request():
+        from flask import request
+        if not request.path.startswith('/_bench/'):
+            with lock:
+                requests['total'] += 1
+
+    @app.route('/_bench/counters')
+    def bench_counters():
+        with lock:
+            calls = dict(s3_calls)
+            total = requests['total']
+        return {
+            'pid': os.getpid(),
+            'requests': total,
+            's3_calls': sum(count for name, count in calls.items() if name != 'generate_presigned_url'),
+            'presigned_urls': calls.get('generate_presigned_url', 0),
+            'db_queries': db_queries(),
+        }
+
+    return app
+
+
+def fill_bucket(client, num_objects, bucket):
+    """Fills a real bucket with the objects fake_s3.populate creates."""
+    client.create_bucket(Bucket=bucket)
+    kinds = (('.mp4', b'\0' * 16), ('.png', b'\0' * 4), ('.txt', None))
+    for i in range(num_objects):
+        ext, body = kinds[i % 3]
+        name = f"video-{i // 3:06d}"
+        client.put_object(Bucket=bucket, Key=name + ext, Body=body if body is not None else f"Video {i // 3}")
+
+
+def prepare_database(database_url):
+    """Brings the schema up to date and (re)creates the benchmark user."""
+    import psycopg2
+    from werkzeug.security import generate_password_hash
+
+    from migrate import migrate
+
+    conn = psycopg2.connect(database_url)
+    try:
+        migrate(conn, log=lambda message: None)
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM users WHERE lower(email) = lower(%s)", (EMAIL,))
+            cur.execute("INSERT INTO users (email, password_hash) VALUES (%s, %s)",
+                        (EMAIL, generate_password_hash(PASSWORD)))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def request(port, method, path, body=None, cookie=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {'Content-Type': 'application/json'}
+    if cookie:
+        headers['Cookie'] = cookie
+    conn.request(method, path, body=json.dumps(body) if body else None, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response, data
+
+
+def login(port):
+    response, _ = request(port, 'POST', '/api/login', {'email': EMAIL, 'password': PASSWORD})
+    assert response.status == 200, response.status
+    return '; '.join(header.split(';')[0] for header in response.msg.get_all('Set-Cookie'))
+
+
+def make_request(scenario, videos, rng):
+    """The (method, path, body) of one request of the scenario."""
+    if scenario == 'login':
+        return 'POST', '/api/login', {'email': EMAIL, 'password': PASSWORD}
+    if scenario == 'videos':
+        return 'GET', '/api/videos?limit=100', None
+    if scenario == 'videos_ndjson':
+        return 'GET', '/api/videos?format=ndjson', None
+    if scenario == 'stream':
+        return 'GET', f"/api/stream/video-{rng.randrange(videos):06d}.mp4", None
+    if scenario == 'search':
+        return 'GET', f"/api/search?q={rng.randrange(100)}&limit=50", None  # prefixes of the labels' numbers
+    if scenario == 'static':
+        return 'GET', rng.choice(STATIC_FILES), None
+    raise ValueError(f"Unknown scenario {scenario!r}")
+
+
+def load(port, scenario, cookies, seconds, videos, seed=0):
+    """Runs one client per cookie for `seconds`. Returns the latencies, error statuses and elapsed time."""
+    latencies, errors = [], Counter()
+    deadline = time.monotonic() + seconds
+
+    def client(cookie, rng):
+        while time.monotonic() < deadline:
+            method, path, body = make_request(scenario, videos, rng)
+            start = time.perf_counter()
+            try:
+                status = request(port, method, path, body, cookie)[0].status
+            except OSError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors[str(status)] += 1
+
+    threads = [threading.Thread(target=client, args=(cookie, random.Random(seed + i))) for i, cookie in enumerate(cookies)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def counters(port, workers):
+    """The counters of as many workers as answer within a few tries, by pid."""
+    seen = dict()
+    for _ in range(workers * 20):
+        response, data = request(port, 'GET', '/_bench/counters')
+        worker = json.loads(data)
+        seen[worker['pid']] = worker
+        if len(seen) == workers:
+            break
+    return seen
+
+
+def per_request(before, after):
+    """S3 calls, presigned URLs and queries per request, over the workers counted before and after."""
+    pids = before.keys() & after.keys()
+    requests = sum(after[pid]['requests'] - before[pid]['requests'] for pid in pids)
+    return {
+        name: round(sum(after[pid][name] - before[pid][name] for pid in pids) / requests, 3) if requests else None
+        for name in ('s3_calls', 'presigned_urls', 'db_queries')
+    }
+
+
+def run_scenario(scenario, port, cookies, args):
+    videos = max(1, args.objects // 3)
+    load(port, scenario, cookies, args.warmup, videos, seed=1000)  # fills each worker's caches
+    before = counters(port, args.workers)
+    latencies, errors, elapsed = load(port, scenario, cookies, args.seconds, videos)
+    after = counters(port, args.workers)
+
+    return dict({
+        'requests': len(latencies),
+        'errors': sum(errors.values()),
+        'error_statuses': dict(errors),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+    }, **per_request(before, after))
+
+
+def git_commit():
+    """The commit the tree is at, marked if it has uncommitted changes."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        changes = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                 capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ' (modified)' if changes else commit
+
+
+def print_results(results, previous=None):
+    columns = [('requests_per_second', 'req/s', 1), ('p50_ms', 'p50 ms', 2), ('p95_ms', 'p95 ms', 2),
+               ('p99_ms', 'p99 ms', 2), ('errors', 'errors', 0), ('s3_calls', 'S3/req', 2),
+               ('presigned_urls', 'sign/req', 2), ('db_queries', 'DB/req', 2)]
+    print(f"\n{'scenario':>14} " + ' '.join(f"{title:>9}" for _, title, _ in columns))
+    for scenario, result in results.items():
+        print(f"{scenario:>14} " + ' '.join(
+            f"{result[key]:>9.{digits}f}" if result[key] is not None else f"{'-':>9}" for key, _, digits in columns
+        ))
+        old = (previous or {}).get(scenario)
+        if old:
+            changes = []
+            for key, _, _ in columns:
+                if result[key] is None or old.get(key) is None:
+                    changes.append(f"{'-':>9}")
+                elif old[key]:
+                    changes.append(f"{(result[key] - old[key]) / old[key]:>+9.0%}")
+                else:
+                    changes.append(f"{result[key] - old[key]:>+9g}")
+            print(f"{'vs. previous':>14} " + ' '.join(changes))
+
+
+def start_moto():
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        print("Error: --s3 moto needs moto, install it with `pip install moto[server]`.")
+        sys.exit(1)
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # moto logs every request
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=port)
+    server.start()
+    return server, f'http://127.0.0.1:{port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--concurrency', type=int, default=16, help="Clients sending requests at the same time.")
+    parser.add_argument('--seconds', type=float, default=10, help="Timed seconds per scenario.")
+    parser.add_argument('--warmup', type=float, default=3, help="Untimed seconds before each scenario.")
+    parser.add_argument('--workers', type=int, default=2, help="Gunicorn worker processes.")
+    parser.add_argument('--worker-class', default='gthread', help="Gunicorn worker model, see gunicorn.conf.py.")
+    parser.add_argument('--objects', type=int, default=3000, help="Objects in the bucket (a third are videos).")
+    parser.add_argument('--s3', choices=['fake', 'moto'], default='fake')
+    parser.add_argument('--s3-latency', type=float, default=0.02, help="Seconds per call to the fake S3.")
+    parser.add_argument('--database-url', help="A PostgreSQL database to use instead of the in-memory stand-in.")
+    parser.add_argument('--db-latency', type=float, default=0.002, help="Seconds per query to the stand-in.")
+    parser.add_argument('--output', default='bench_suite.json', help="The JSON report to write.")
+    parser.add_argument('--compare', help="An earlier report to compare the results with.")
+    args = parser.parse_args()
+
+    previous = None
+    if args.compare:
+        try:
+            with open(args.compare) as f:
+                previous = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not read the report {args.compare}: {e}")
+            sys.exit(1)
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        GUNICORN_BIND=f'127.0.0.1:{port}',
+        WEB_WORKER_CLASS=args.worker_class,
+        WEB_CONCURRENCY=str(args.workers),
+        BENCH_S3=args.s3,
+        BENCH_S3_LATENCY=str(args.s3_latency),
+        BENCH_DB_LATENCY=str(args.db_latency),
+        BENCH_OBJECTS=str(args.objects),
+    )
+
+    moto = None
+    if args.s3 == 'moto':
+        import boto3
+
+        moto, endpoint = start_moto()
+        env.update(AWS_ENDPOINT_URL=endpoint, AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing',
+                   AWS_DEFAULT_REGION='us-east-1')
+        from app import app
+        fill_bucket(boto3.client('s3', endpoint_url=endpoint, region_name='us-east-1', aws_access_key_id='testing',
+                                 aws_secret_access_key='testing'), args.objects, app.config['S3_BUCKET_NAME'])
+
+    if args.database_url:
+        prepare_database(args.database_url)
+        env.update(DATABASE_URL=args.database_url, BENCH_DATABASE_URL=args.database_url)
+
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '--chdir', os.path.dirname(os.path.abspath(__file__)), '--log-level', 'warning', 'bench_suite:create_app()'],
+        env=env,
+    )
+    try:
+        for _ in range(300):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        for _ in range(30):  # workers only answer once they have warmed up (app.warm_up)
+            if len(counters(port, args.workers)) == args.workers:
+                break
+
+        cookies = [login(port) for _ in range(args.concurrency)]
+        print(f"{args.concurrency} clients, {args.workers} {args.worker_class} workers, {args.objects} objects, "
+              f"S3: {args.s3}, database: {'PostgreSQL' if args.database_url else 'stand-in'}")
+
+        results = dict()
+        for scenario in args.scenarios:
+            results[scenario] = run_scenario(scenario, port, cookies, args)
+            print(f"  {scenario} done: {results[scenario]['requests_per_second']} req/s")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+        if moto is not None:
+            moto.stop()
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'database_url')},
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print_results(results, previous['results'] if previous else None)
+    print(f"\nReport written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Estimates the dashboard's page weight and time to render its thumbnail tiles
+with the uploaded originals and with the scaled variants from thumbnails.py.
+
+The originals are synthetic 1920x1080 images (a fractal with noise, saved as
+PNG and as JPEG, like screenshots and camera stills). For each set of images
+the benchmark reports the bytes a dashboard with `--tiles` thumbnails
+downloads, the time Pillow takes to decode them (a stand-in for the browser's
+decoding), and the time to render all tiles: the download at `--mbps` plus
+the decoding.
+
+Needs Pillow. Usage: python benchmarks/bench_thumbnails.py [--tiles 50] [--mbps 20] [--dpr 2]
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+from thumbnails import THUMBNAIL_WIDTHS, render_variants  # noqa: E402
+
+
+def make_original(seed, fmt):
+    random.seed(seed)
+    x, y = random.uniform(-1.5, 0.0), random.uniform(-0.5, 0.5)
+    image = Image.effect_mandelbrot((1920, 1080), (x - 1, y - 0.6, x + 1, y + 0.6), 200).convert('RGB')
+    noise = Image.effect_noise((1920, 1080), 24).convert('RGB')
+    image = Image.blend(image, noise, 0.15)
+
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, **({'quality': 92} if fmt == 'JPEG' else {}))
+    return buffer.getvalue()
+
+
+def decode_time(images):
+    start = time.perf_counter()
+    for data in images:
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tiles', type=int, default=50, help="Thumbnails on the dashboard.")
+    parser.add_argument('--mbps', type=float, default=20, help="Download bandwidth in Mbit/s.")
+    parser.add_argument('--dpr', type=int, default=2, help="Device pixel ratio, picks the variant width.")
+    args = parser.parse_args()
+
+    # the width a browser picks from the srcset for a 160px tile
+    width = min((w for w in THUMBNAIL_WIDTHS if w >= 160 * args.dpr), default=max(THUMBNAIL_WIDTHS))
+    distinct = min(args.tiles, 10)  # rendering is slow, so tiles reuse a few distinct images
+
+    print(f"{args.tiles} tiles at {args.mbps:g} Mbit/s, {args.dpr}x screen ({width}px variants)\n")
+    print(f"{'thumbnails':>16} {'page KB':>9} {'decode ms':>10} {'render ms':>10}")
+
+    for original_format in ('PNG', 'JPEG'):
+        originals = [make_original(i, original_format) for i in range(distinct)]
+        variants = [render_variants(data) for data in originals]
+
+        sets = {
+            f"{original_format.lower()} original": originals,
+            f"{width}px jpeg": [v[(width, 'jpeg')] for v in variants],
+            f"{width}px webp": [v[(width, 'webp')] for v in variants],
+        }
+        for label, images in sets.items():
+            tiles = [images[i % distinct] for i in range(args.tiles)]
+            size = sum(len(data) for data in tiles)
+            decode = decode_time(tiles)
+            render = size * 8 / (args.mbps * 1e6) + decode
+            print(f"{label:>16} {size / 1024:>9.0f} {decode * 1000:>10.1f} {render * 1000:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
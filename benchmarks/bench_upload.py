@@ -0,0 +1,83 @@
+"""
+Measures upload throughput of upload_script.py's upload path against a local
+S3 stand-in (a moto server, `pip install "moto[server]"`), comparing boto3's
+default transfer settings (8MB parts, 10 threads) with the script's tuned
+defaults and any other part size / concurrency combinations given.
+
+moto keeps objects in memory, so very large sizes need a lot of RAM.
+
+Usage: python benchmarks/bench_upload.py [--sizes 100 1000 5000] [--configs 8x10 64x10 64x16]
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moto.server import ThreadedMotoServer  # noqa: E402
+
+BUCKET = 'bench-bucket'
+
+
+def make_file(directory, size_mb):
+    path = os.path.join(directory, f"video-{size_mb}MB.mp4")
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500], help="File sizes in MB.")
+    parser.add_argument('--configs', nargs='+', default=['8x10', '64x10', '64x16'],
+                        help="Transfer settings as <part size MB>x<concurrency>.")
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    os.environ.update({
+        'AWS_ENDPOINT_URL': f"http://{host}:{port}",
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+    })
+
+    # imported after AWS_ENDPOINT_URL is set, so its clients talk to the stand-in
+    from upload_script import create_s3_client, create_transfer_config, upload_to_s3
+
+    print(f"{'size MB':>8} {'parts MB':>9} {'threads':>8} {'seconds':>8} {'MB/s':>8}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            path = make_file(directory, size)
+
+            for config in args.configs:
+                part_size, concurrency = (int(value) for value in config.split('x'))
+                s3_client = create_s3_client(None, 'us-east-1', concurrency)
+                s3_client.create_bucket(Bucket=BUCKET)
+
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    uploaded = upload_to_s3(s3_client, path, BUCKET, show_progress=False,
+                                            transfer_config=create_transfer_config(part_size, concurrency))
+                elapsed = time.perf_counter() - start
+
+                assert uploaded
+                s3_client.delete_object(Bucket=BUCKET, Key=os.path.basename(path))
+                print(f"{size:>8} {part_size:>9} {concurrency:>8} {elapsed:>8.2f} {size / elapsed:>8.1f}")
+
+            os.remove(path)
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
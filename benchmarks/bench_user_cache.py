@@ -0,0 +1,65 @@
+"""
+Counts the database queries per authenticated request with the user cache
+disabled (USER_CACHE_TTL=0, the previous behaviour) and enabled, using the app
+with in-memory S3 and database stand-ins.
+
+Usage: python benchmarks/bench_user_cache.py [--requests 500]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from app import app  # noqa: E402
+import api_routes  # noqa: E402
+import user_cache  # noqa: E402
+from fake_db import FakeDatabase, FakePool  # noqa: E402
+from fake_s3 import FakeS3Client, populate  # noqa: E402
+
+
+def run(ttl, requests, db_latency):
+    app.config['USER_CACHE_TTL'] = ttl
+    user_cache.init_app(app)
+
+    db = FakeDatabase(latency=db_latency)
+    app.extensions['db_pool'] = FakePool(db)
+    db.add_user('viewer@example.com', generate_password_hash('secret'))
+
+    client = app.test_client()
+    response = client.post('/api/login', json={'email': 'viewer@example.com', 'password': 'secret'})
+    assert response.status_code == 200, response.get_json()
+
+    db.queries.clear()
+    start = time.perf_counter()
+    for i in range(requests):
+        path = '/api/videos' if i % 2 else '/api/check-auth'
+        assert client.get(path).status_code == 200
+    elapsed = time.perf_counter() - start
+
+    stats = app.extensions['user_cache'].stats()
+    label = 'disabled' if ttl == 0 else 'enabled'
+    print(f"{label:>9} {sum(db.queries.values()) / requests:>13.3f} {elapsed / requests * 1000:>12.3f} {stats['hit_rate']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--db-latency', type=float, default=0.001, help="Simulated database round trip time in seconds.")
+    args = parser.parse_args()
+
+    s3 = FakeS3Client()
+    populate(s3, 300, app.config['S3_BUCKET_NAME'])
+    api_routes.get_s3_client = lambda: s3
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    print(f"{'cache':>9} {'queries/req':>13} {'ms/request':>12} hit rate")
+    run(0, args.requests, args.db_latency)
+    run(300, args.requests, args.db_latency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+Load test of /api/videos and /api/stream/<key> under the gunicorn worker
+models of gunicorn.conf.py: sync, gthread and gevent (needs `pip install gevent`).
+
+The app runs under gunicorn with in-memory S3 and database stand-ins that wait
+`--s3-latency` and `--db-latency` seconds per call, the time the real site
+spends waiting on S3 and PostgreSQL. The user cache is disabled, so every
+request loads its user from the database, and the catalog is refreshed from
+S3 every `--catalog-ttl` seconds. `--clients` logged-in clients send requests
+back to back; reported are requests/s and the p50 and p99 latency.
+
+Usage: python benchmarks/bench_workers.py [--clients 64] [--seconds 10] [--models sync gthread gevent]
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EMAIL, PASSWORD = 'viewer@example.com', 'secret'
+
+
+def create_app():
+    """The app gunicorn runs, with the stand-ins configured by the BENCH_* variables."""
+    from werkzeug.security import generate_password_hash
+
+    from app import app
+    import api_routes
+    import s3_client
+    from fake_db import FakeDatabase, FakePool
+    from fake_s3 import FakeS3Client, populate
+
+    s3 = FakeS3Client()
+    populate(s3, int(os.environ['BENCH_OBJECTS']), app.config['S3_BUCKET_NAME'])
+    s3.latency = float(os.environ['BENCH_S3_LATENCY'])  # after filling the bucket
+    api_routes.get_s3_client = s3_client.get_s3_client = s3_client.get_warm_up_client = lambda: s3
+
+    db = FakeDatabase(latency=float(os.environ['BENCH_DB_LATENCY']))
+    db.add_user(EMAIL, generate_password_hash(PASSWORD))
+    app.extensions['db_pool'] = FakePool(db)
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def request(port, method, path, body=None, cookie=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {'Content-Type': 'application/json'}
+    if cookie:
+        headers['Cookie'] = cookie
+    conn.request(method, path, body=json.dumps(body) if body else None, headers=headers)
+    response = conn.getresponse()
+    response.read()
+    conn.close()
+    return response
+
+
+def login(port):
+    response = request(port, 'POST', '/api/login', {'email': EMAIL, 'password': PASSWORD})
+    assert response.status == 200, response.status
+    return '; '.join(header.split(';')[0] for header in response.msg.get_all('Set-Cookie'))
+
+
+def load(port, path, cookies, seconds):
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + seconds
+
+    def client(cookie):
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            status = request(port, 'GET', path, cookie=cookie).status
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+
+    threads = [threading.Thread(target=client, args=(cookie,)) for cookie in cookies]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def run(model, args):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        GUNICORN_BIND=f'127.0.0.1:{port}',
+        WEB_WORKER_CLASS=model,
+        WEB_CONCURRENCY=str(args.workers),
+        USER_CACHE_TTL='0',
+        CATALOG_TTL=str(args.catalog_ttl),
+        HASH_WORKERS='0',
+        STATIC_PRELOAD='0',
+        BENCH_S3_LATENCY=str(args.s3_latency),
+        BENCH_DB_LATENCY=str(args.db_latency),
+        BENCH_OBJECTS=str(args.objects),
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--config', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '--chdir', os.path.dirname(os.path.abspath(__file__)), '--log-level', 'warning', 'bench_workers:create_app()'],
+        env=env,
+    )
+    try:
+        for _ in range(200):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        cookies = [login(port) for _ in range(args.clients)]
+        for path in ('/api/videos?limit=100', '/api/stream/video-000001.mp4'):
+            load(port, path, cookies, args.warmup)  # fills each worker's catalog and URL cache
+            latencies, errors, elapsed = load(port, path, cookies, args.seconds)
+            print(f"{model:>8} {path.split('?')[0][:18]:>18} {len(latencies) / elapsed:>8.1f} "
+                  f"{percentile(latencies, 0.5) * 1000:>8.1f} {percentile(latencies, 0.99) * 1000:>8.1f} {len(errors):>7}")
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', nargs='+', default=['sync', 'gthread', 'gevent'])
+    parser.add_argument('--workers', type=int, default=4, help="Gunicorn worker processes.")
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=10, help="Per model and endpoint.")
+    parser.add_argument('--s3-latency', type=float, default=0.05, help="Seconds per S3 call.")
+    parser.add_argument('--db-latency', type=float, default=0.01, help="Seconds per database query.")
+    parser.add_argument('--warmup', type=float, default=5, help="Seconds of untimed requests before each endpoint.")
+    parser.add_argument('--catalog-ttl', type=int, default=2)
+    parser.add_argument('--objects', type=int, default=3000, help="Objects in the bucket (a third are videos).")
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients, {args.workers} workers, S3 {args.s3_latency * 1000:g}ms, "
+          f"database {args.db_latency * 1000:g}ms per call\n")
+    print(f"{'model':>8} {'endpoint':>18} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for model in args.models:
+        run(model, args)
+
+
+if __name__ == '__main__':
+    main()
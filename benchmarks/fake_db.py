@@ -0,0 +1,117 @@
+"""
+An in-memory stand-in for the PostgreSQL connection pool, understanding just
+the queries the app runs against the `users` table. Every executed statement
+is counted in `FakeDatabase.queries`.
+"""
+import re
+import threading
+import time
+from collections import Counter
+
+import psycopg2
+import psycopg2.extensions
+
+from migrate import load_migrations
+
+
+class FakeDatabase:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.users = dict()  # id -> (id, email, password_hash)
+        self.queries = Counter()
+        self._lock = threading.Lock()
+
+    def add_user(self, email, password_hash):
+        with self._lock:
+            user_id = len(self.users) + 1
+            self.users[user_id] = (user_id, email, password_hash)
+            return user_id
+
+    def execute(self, sql, params):
+        sql = ' '.join(sql.split())
+        with self._lock:
+            self.queries[sql.split(' ')[0].upper()] += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if sql.startswith('INSERT INTO users'):
+            email, password_hash = params[:2]
+            if any(row[1].lower() == email.lower() for row in self.users.values()):
+                raise psycopg2.IntegrityError("duplicate key value violates unique constraint")
+            return [(self.add_user(email, password_hash),)]
+
+        if re.search(r'FROM users WHERE (lower\()?email', sql, re.IGNORECASE):
+            email = params[0].lower()
+            return [row for row in self.users.values() if row[1].lower() == email][:1]
+
+        if re.search(r'FROM users WHERE id', sql, re.IGNORECASE) or sql.startswith('EXECUTE user_get'):
+            row = self.users.get(int(params[0]))
+            return [row] if row else []
+
+        if 'schema_migrations' in sql:  # the schema is up to date
+            return [(True,)] if 'to_regclass' in sql else [(migration.version,) for migration in load_migrations()]
+        return [(1,)]
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self._db = db
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        self._rows = list(self._db.execute(sql, params))
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+
+class FakeConnection:
+    closed = 0
+
+    class info:
+        transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def __init__(self, db):
+        self._db = db
+
+    def cursor(self):
+        return FakeCursor(self._db)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    """Drop-in replacement for db.ConnectionPool."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def getconn(self):
+        return FakeConnection(self.db)
+
+    def putconn(self, conn):
+        pass
+
+    def warm(self):
+        pass
+
+    def stats(self):
+        return {'queries': dict(self.db.queries)}
@@ -0,0 +1,164 @@
+"""
+An in-memory stand-in for the parts of the boto3 S3 client used by the app.
+
+Every network call can be slowed down by a fixed `latency` (in seconds) to make
+round trips visible in benchmarks, and all calls are counted in `calls`.
+"""
+import bisect
+import hashlib
+import io
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError
+
+
+class FakeS3Client:
+    def __init__(self, latency=0.0, page_size=1000):
+        self.latency = latency
+        self.page_size = page_size
+        self.calls = Counter()
+        self._objects = dict()
+        self._keys = []  # sorted
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _error(code, operation):
+        return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+    def put_object(self, Bucket, Key, Body=b'', IfMatch=None, IfNoneMatch=None, **kwargs):
+        self._call('put_object')
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+
+        etag = '"' + hashlib.md5(Body).hexdigest() + '"'
+
+        with self._lock:
+            current = self._objects.get(Key)
+            if (IfMatch is not None and (current is None or current['ETag'] != IfMatch)) or \
+                    (IfNoneMatch == '*' and current is not None):
+                raise self._error('PreconditionFailed', 'PutObject')
+
+            if Key not in self._objects:
+                bisect.insort(self._keys, Key)
+            self._objects[Key] = {
+                'Body': bytes(Body),
+                'ETag': etag,
+                'Size': len(Body),
+                'LastModified': datetime.now(timezone.utc),
+            }
+        return {'ETag': etag}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call('delete_object')
+        with self._lock:
+            if self._objects.pop(Key, None) is not None:
+                self._keys.remove(Key)
+        return {}
+
+    def list_objects_v2(self, Bucket, ContinuationToken=None, StartAfter=None, MaxKeys=None, Prefix='', **kwargs):
+        self._call('list_objects_v2')
+        max_keys = min(MaxKeys or self.page_size, self.page_size)
+        after = ContinuationToken or StartAfter
+
+        with self._lock:
+            start = bisect.bisect_right(self._keys, after) if after else 0
+            contents = []
+            index = start
+
+            while index < len(self._keys) and len(contents) < max_keys:
+                key = self._keys[index]
+                index += 1
+                if not key.startswith(Prefix):
+                    continue
+                obj = self._objects[key]
+                contents.append({
+                    'Key': key,
+                    'Size': obj['Size'],
+                    'ETag': obj['ETag'],
+                    'LastModified': obj['LastModified'],
+                })
+
+            truncated = index < len(self._keys)
+
+        response = {'KeyCount': len(contents), 'IsTruncated': truncated}
+        if contents:
+            response['Contents'] = contents
+        if truncated:
+            response['NextContinuationToken'] = contents[-1]['Key'] if contents else after
+        return response
+
+    def get_paginator(self, operation_name):
+        return _FakePaginator(getattr(self, operation_name))
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call('head_object')
+        obj = self._objects.get(Key)
+        if obj is None:
+            raise self._error('404', 'HeadObject')
+        return {
+            'ContentLength': obj['Size'],
+            'ETag': obj['ETag'],
+            'LastModified': obj['LastModified'],
+        }
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self._call('get_object')
+        obj = self._objects.get(Key)
+        if obj is None:
+            raise self._error('NoSuchKey', 'GetObject')
+        if IfNoneMatch is not None and IfNoneMatch == obj['ETag']:
+            raise self._error('304', 'GetObject')
+        return {
+            'Body': io.BytesIO(obj['Body']),
+            'ContentLength': obj['Size'],
+            'ETag': obj['ETag'],
+            'LastModified': obj['LastModified'],
+        }
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        # signing happens locally in boto3, so there is no latency here
+        self._call('generate_presigned_url')
+        return f"https://{Params['Bucket']}.s3.fake/{Params['Key']}?X-Amz-Expires={ExpiresIn}&t={time.time()}"
+
+
+class _FakePaginator:
+    def __init__(self, method):
+        self._method = method
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self._method(**kwargs)
+            yield page
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+def populate(client, num_objects, bucket='bench-bucket'):
+    """
+    Fills the client with `num_objects` objects, grouped into videos that each
+    have a thumbnail and a label, like an upload_script.py upload produces.
+    """
+    index = 0
+    kinds = (('.mp4', b'\0' * 16), ('.png', b'\0' * 4), ('.txt', None))
+
+    while len(client._objects) < num_objects:
+        for ext, body in kinds:
+            if len(client._objects) >= num_objects:
+                break
+            name = f"video-{index:06d}"
+            client.put_object(Bucket=bucket, Key=name + ext, Body=body if body is not None else f"Video {index}")
+        index += 1
+
+    client.calls.clear()
@@ -0,0 +1,605 @@
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+from flask import current_app
+
+from hls import HLS_PREFIX, MASTER_PLAYLIST, master_key
+from metrics import bind_request_spans
+from thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_PREFIX, parse_variant_key
+
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv')
+THUMB_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+LABEL_EXTENSION = '.txt'
+
+# written by upload_script.py, so the site can read the catalog with a single GET
+MANIFEST_KEY = 'catalog.json'
+MANIFEST_VERSION = 1
+
+
+class ManifestConflict(Exception):
+    """Raised when the manifest was changed by someone else since it was read."""
+    pass
+
+
+def classify_key(key):
+    """
+    Splits an S3 key into its base name and the kind of asset it holds
+    ('video', 'thumbnail', 'label' or None for anything else). All assets that
+    belong to the same video share the base name, e.g. 'intro.mp4', 'intro.png'
+    and 'intro.txt'.
+    """
+    name, ext = os.path.splitext(key)
+    ext = ext.lower()
+
+    if ext in VIDEO_EXTENSIONS:
+        return name, 'video'
+    if ext in THUMB_EXTENSIONS:
+        return name, 'thumbnail'
+    if ext == LABEL_EXTENSION:
+        return name, 'label'
+    return name, None
+
+
+def iter_objects(s3, bucket_name, prefix=None):
+    """
+    Yields all objects in the bucket (or those whose key starts with `prefix`)
+    page by page, following the listing's continuation tokens, so only one page
+    is held in memory at a time.
+    """
+    kwargs = {'Bucket': bucket_name}
+    if prefix:
+        kwargs['Prefix'] = prefix
+
+    while True:
+        response = s3.list_objects_v2(**kwargs)
+        yield from response.get('Contents', [])
+
+        if not response.get('IsTruncated'):
+            return
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+def iter_assets(objects):
+    """
+    Groups a sorted stream of listing objects by base name and yields
+    `(name, asset)` tuples, where `asset` maps the asset kind to its listing object.
+
+    All keys of a group start with '<name>.', so they are adjacent in S3's
+    lexicographic listing order. A group is complete as soon as the listing has
+    moved past that prefix, which keeps only a handful of groups in memory.
+    """
+    groups = OrderedDict()
+
+    for obj in objects:
+        key = obj['Key']
+
+        # emit the oldest groups whose key range the listing has left behind
+        while groups:
+            name = next(iter(groups))
+            prefix = name + '.'
+            if key.startswith(prefix) or key < prefix:
+                break
+            yield name, groups.pop(name)
+
+        name, kind = classify_key(key)
+
+        if kind is not None:
+            groups.setdefault(name, dict())[kind] = obj
+
+    yield from groups.items()
+
+
+def read_label(s3, bucket_name, key):
+    """Downloads a label file and returns its stripped text content."""
+    label_obj = s3.get_object(Bucket=bucket_name, Key=key)
+    return label_obj['Body'].read().decode('utf-8').strip()
+
+
+def fetch_concurrently(executor, fn, keys, timeout):
+    """
+    Calls `fn(key)` for all keys on the executor and returns a dict with the
+    results of the calls that succeeded within `timeout` seconds. Failed and
+    timed out keys are logged and left out, so callers can fall back to defaults.
+    The calls' spans count towards the current request's Server-Timing.
+    """
+    fn = bind_request_spans(fn)
+    futures = {executor.submit(fn, key): key for key in keys}
+    done, not_done = wait(futures, timeout=timeout)
+    results = dict()
+
+    for future in done:
+        key = futures[future]
+        try:
+            results[key] = future.result()
+        except Exception as e:
+            logger.error(f"Could not fetch {key}: {e}")
+
+    for future in not_done:
+        future.cancel()
+        logger.error(f"Timed out fetching {futures[future]}")
+
+    return results
+
+
+def _version(obj):
+    # ETag changes whenever the content changes; LastModified covers stores that
+    # don't return an ETag in listings.
+    return obj.get('ETag'), obj.get('LastModified')
+
+
+class _Walk:
+    """
+    The batches of a walk of the bucket in progress. One thread walks; any
+    number of readers iterate over the batches found so far and wait for more.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.done = False
+        self.error = None
+        self._condition = threading.Condition()
+
+    def add(self, batch):
+        with self._condition:
+            self.batches.append(batch)
+            self._condition.notify_all()
+
+    def finish(self, error=None):
+        with self._condition:
+            self.done = True
+            self.error = error
+            self._condition.notify_all()
+
+    def __iter__(self):
+        """Yields every batch of the walk, then raises its error, if any."""
+        index = 0
+        while True:
+            with self._condition:
+                while index == len(self.batches) and not self.done:
+                    self._condition.wait()
+                batches = self.batches[index:]
+                done, error = self.done, self.error
+
+            index += len(batches)
+            yield from batches
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def make_entry(name, asset, label, thumbnail_widths=(), hls_key=None):
+    """
+    The catalog entry of a video, from its grouped listing objects.
+    `thumbnail_widths` are the widths of the thumbnail's scaled variants (see
+    thumbnails.py) and `hls_key` is the master playlist of the video's HLS
+    package (see package_hls.py). Only manifests record them, a listing
+    leaves them empty.
+    """
+    thumbnail = asset.get('thumbnail')
+    return {
+        'name': name,
+        'key': asset['video']['Key'],
+        'size': asset['video']['Size'],
+        'thumbnail_key': thumbnail['Key'] if thumbnail else None,
+        'thumbnail_widths': list(thumbnail_widths),
+        'hls_key': hls_key,
+        'label': label,
+    }
+
+
+def load_manifest(s3, bucket_name, etag=None):
+    """
+    Downloads the catalog manifest and returns `(videos, etag)`, with the videos
+    in the same form as the catalog's entries. Returns `(None, None)` if the
+    bucket has no manifest, and `(None, etag)` if `etag` was given and the
+    manifest hasn't changed since.
+    """
+    kwargs = {'Bucket': bucket_name, 'Key': MANIFEST_KEY}
+    if etag is not None:
+        kwargs['IfNoneMatch'] = etag
+
+    try:
+        response = s3.get_object(**kwargs)
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in ('304', 'NotModified'):
+            return None, etag
+        if code in ('NoSuchKey', '404'):
+            return None, None
+        raise
+
+    manifest = json.loads(response['Body'].read())
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported catalog manifest version {manifest.get('version')}")
+    return manifest['videos'], response['ETag']
+
+
+def save_manifest(s3, bucket_name, videos, etag=None):
+    """
+    Writes the manifest, but only if it is unchanged since it was read with
+    `etag` (or, without an etag, if there is no manifest yet). Returns the new
+    ETag, or raises ManifestConflict if someone else wrote it in between.
+    """
+    body = json.dumps(
+        {'version': MANIFEST_VERSION, 'videos': sorted(videos, key=lambda entry: entry['name'])},
+        separators=(',', ':'),
+    ).encode('utf-8')
+    condition = {'IfMatch': etag} if etag is not None else {'IfNoneMatch': '*'}
+
+    try:
+        response = s3.put_object(
+            Bucket=bucket_name,
+            Key=MANIFEST_KEY,
+            Body=body,
+            ContentType='application/json',
+            CacheControl='no-cache',
+            **condition,
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409'):
+            raise ManifestConflict() from e
+        raise
+    return response['ETag']
+
+
+def build_manifest(s3, bucket_name, max_workers=16):
+    """
+    Builds the manifest's list of videos from a full listing of the bucket,
+    downloading every label. Unlike a catalog refresh, a label that can't be
+    downloaded is an error rather than falling back to the base name.
+    Thumbnail variants are recorded for the widths that exist in all formats,
+    and HLS packages if their master playlist exists (it is uploaded last).
+    """
+    assets = [(name, asset) for name, asset in iter_assets(iter_objects(s3, bucket_name)) if 'video' in asset]
+    label_keys = [asset['label']['Key'] for _, asset in assets if 'label' in asset]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        labels = dict(zip(label_keys, executor.map(lambda key: read_label(s3, bucket_name, key), label_keys)))
+
+    variants = dict()  # name -> width -> formats
+    for obj in iter_objects(s3, bucket_name, THUMBNAIL_PREFIX):
+        parsed = parse_variant_key(obj['Key'])
+        if parsed is not None:
+            name, width, fmt = parsed
+            variants.setdefault(name, dict()).setdefault(width, set()).add(fmt)
+
+    packaged = {
+        obj['Key'] for obj in iter_objects(s3, bucket_name, HLS_PREFIX) if obj['Key'].endswith('/' + MASTER_PLAYLIST)
+    }
+
+    return [
+        make_entry(
+            name,
+            asset,
+            labels[asset['label']['Key']] if 'label' in asset else name,
+            sorted(width for width, formats in variants.get(name, dict()).items() if formats == set(THUMBNAIL_FORMATS))
+            if 'thumbnail' in asset else (),
+            master_key(name) if master_key(name) in packaged else None,
+        )
+        for name, asset in assets
+    ]
+
+
+def update_manifest(s3, bucket_name, update, retries=10):
+    """
+    Applies `update` to the manifest and writes it back atomically: `update`
+    is called with a dict of the entries by name and changes it in place. If
+    another upload changed the manifest in the meantime, the manifest is read
+    again and the update repeated. A bucket without a manifest gets one built
+    from its listing first, so existing videos aren't lost.
+    """
+    for attempt in range(retries):
+        videos, etag = load_manifest(s3, bucket_name)
+        if etag is None:
+            videos = build_manifest(s3, bucket_name)
+
+        entries = {entry['name']: entry for entry in videos}
+        update(entries)
+
+        try:
+            return save_manifest(s3, bucket_name, entries.values(), etag)
+        except ManifestConflict:
+            time.sleep(random.uniform(0, 0.1 * 2 ** attempt))
+
+    raise ManifestConflict(f"Gave up updating {MANIFEST_KEY} after {retries} conflicting writes")
+
+
+class Catalog:
+    """
+    An in-memory copy of the video catalog (videos with their thumbnail and label),
+    shared by all requests of a worker.
+
+    The catalog is rebuilt from a bucket listing once it is older than `ttl`
+    seconds. Label files are only downloaded again if their ETag/LastModified
+    changed since the previous build, so a refresh of an unchanged bucket costs
+    a listing and no GET requests. While one request refreshes a stale
+    catalog, the other requests of the worker are served the previous one.
+
+    Labels are downloaded concurrently by up to `max_workers` threads. A batch of
+    downloads that doesn't finish within `fetch_timeout` seconds is given up on,
+    and the affected videos fall back to their base name until the next refresh.
+
+    With `use_manifest`, the catalog is read from the manifest that
+    upload_script.py keeps in the bucket instead, a single GET that is answered
+    with 304 Not Modified while the manifest is unchanged. The listing is only
+    used for buckets without a manifest.
+    """
+
+    def __init__(self, ttl=60, batch_size=100, max_workers=16, fetch_timeout=10, use_manifest=True):
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.fetch_timeout = fetch_timeout
+        self.use_manifest = use_manifest
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+        self._lock = threading.Lock()  # guards _walking
+        self._walking = None  # the _Walk in progress, if any
+        self._snapshot = None  # (videos sorted by name, their names)
+        self._labels = dict()  # label key -> (version, text)
+        self._manifest_etag = None  # ETag of the manifest the snapshot was read from
+        self._loaded_at = 0.0
+        self.listeners = []  # called with the list of videos after every refresh
+
+    def is_fresh(self):
+        return self._snapshot is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def invalidate(self):
+        """Forces a refresh on the next call to `get_videos`."""
+        self._loaded_at = 0.0
+
+    def get_videos(self, s3, bucket_name):
+        """
+        Returns the list of videos, refreshing it first if it is stale. Each entry
+        is a dict with the keys 'name', 'key', 'size', 'thumbnail_key' and 'label'.
+        The returned list is shared and must not be modified.
+        """
+        return self._get_snapshot(s3, bucket_name)[0]
+
+    def get_page(self, s3, bucket_name, cursor=None, limit=100):
+        """
+        Returns up to `limit` videos whose name sorts after `cursor`, and the
+        cursor for the next page (None on the last page).
+        """
+        videos, names = self._get_snapshot(s3, bucket_name)
+        start = bisect.bisect_right(names, cursor) if cursor else 0
+        page = videos[start:start + limit]
+        next_cursor = page[-1]['name'] if start + limit < len(videos) else None
+        return page, next_cursor
+
+    def iter_videos(self, s3, bucket_name):
+        """Yields the videos one by one, see `iter_batches`."""
+        for batch in self.iter_batches(s3, bucket_name):
+            yield from batch
+
+    def iter_batches(self, s3, bucket_name):
+        """
+        Yields the videos in lists of up to `batch_size`. If the catalog is
+        stale, each batch is yielded as soon as its labels have been downloaded
+        while the bucket is being walked, so the first videos are available
+        long before the listing has finished, and the catalog is updated at the
+        end. As in `get_videos`, only one walk of the bucket runs at a time; the
+        other requests are served the previous catalog meanwhile, or, if there
+        is none yet, the batches of that walk as they come in.
+
+        The walk runs on a thread of its own, so a slow client only holds up
+        its own response, and the catalog is updated even if it disconnects.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and self.is_fresh():
+            yield from _chunks(snapshot[0], self.batch_size)
+            return
+
+        walk, started = self._join_walk()
+        if walk is None:
+            yield from _chunks(self._snapshot[0], self.batch_size)
+            return
+        if not started and snapshot is not None:
+            yield from _chunks(snapshot[0], self.batch_size)
+            return
+
+        if started:
+            # the label downloads still count towards this request's Server-Timing
+            thread = threading.Thread(
+                target=bind_request_spans(self._run_walk), args=(walk, s3, bucket_name),
+                name='catalog-walk', daemon=True,
+            )
+            thread.start()
+        yield from walk
+
+    def _get_snapshot(self, s3, bucket_name):
+        snapshot = self._snapshot
+        if snapshot is not None and self.is_fresh():
+            return snapshot
+
+        walk, started = self._join_walk()
+        if walk is None:
+            return self._snapshot
+
+        if started:
+            self._run_walk(walk, s3, bucket_name)
+            if walk.error is not None:
+                raise walk.error
+        elif snapshot is not None:
+            # while another request refreshes the catalog, serve the previous one
+            # rather than having every request of the worker wait on S3
+            return snapshot
+        else:
+            for _ in walk:
+                pass
+        return self._snapshot
+
+    def _join_walk(self):
+        """
+        Returns the walk in progress and False, or a new walk that the caller
+        must run and True. Returns (None, False) if another thread has
+        refreshed the catalog in the meantime.
+        """
+        with self._lock:
+            if self._walking is not None:
+                return self._walking, False
+            if self.is_fresh():
+                return None, False
+            self._walking = _Walk()
+            return self._walking, True
+
+    def _run_walk(self, walk, s3, bucket_name):
+        """Walks the bucket into `walk`, which records the error rather than raising it."""
+        error = None
+        try:
+            for batch in self._walk(s3, bucket_name):
+                walk.add(batch)
+        except Exception as e:
+            error = e
+        finally:
+            with self._lock:
+                self._walking = None
+            walk.finish(error)
+
+    def _walk(self, s3, bucket_name):
+        if self.use_manifest:
+            videos = self._load_manifest(s3, bucket_name)
+            if videos is not None:
+                yield from _chunks(videos, self.batch_size)
+                return
+
+        labels = dict()
+        videos = []
+        batch = []
+
+        for name, asset in iter_assets(iter_objects(s3, bucket_name)):
+            if 'video' not in asset:
+                continue
+
+            batch.append((name, asset))
+
+            if len(batch) >= self.batch_size:
+                yield self._resolve(s3, bucket_name, batch, labels, videos)
+                batch = []
+
+        if batch:
+            yield self._resolve(s3, bucket_name, batch, labels, videos)
+
+        videos.sort(key=lambda entry: entry['name'])
+        self._store(videos, labels, None)
+
+    def _load_manifest(self, s3, bucket_name):
+        """Refreshes the snapshot from the manifest. Returns the videos, or None if there is no manifest."""
+        snapshot = self._snapshot
+        etag = self._manifest_etag if snapshot is not None else None
+
+        videos, etag = load_manifest(s3, bucket_name, etag)
+        if etag is None:
+            return None
+
+        if videos is None:
+            videos = snapshot[0]  # not modified
+        else:
+            videos.sort(key=lambda entry: entry['name'])
+
+        self._store(videos, self._labels, etag)
+        return videos
+
+    def _store(self, videos, labels, manifest_etag):
+        self._snapshot = (videos, [entry['name'] for entry in videos])
+        self._labels = labels
+        self._manifest_etag = manifest_etag
+        self._loaded_at = time.monotonic()
+        for listener in self.listeners:
+            listener(videos)
+
+    def _get_executor(self):
+        # created on first use, so no threads exist before gunicorn forks its workers,
+        # and again in a forked worker if the preloaded app used it (threads don't survive a fork)
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._executor_lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='catalog')
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _resolve(self, s3, bucket_name, batch, labels, videos):
+        """Turns a batch of grouped assets into video entries, downloading changed labels. Returns the entries."""
+        stale = dict()
+
+        for name, asset in batch:
+            label_obj = asset.get('label')
+
+            if label_obj is not None:
+                key = label_obj['Key']
+                version = _version(label_obj)
+                cached = self._labels.get(key)
+
+                if cached is not None and cached[0] == version:
+                    labels[key] = cached
+                else:
+                    stale[key] = version
+
+        if stale:
+            texts = fetch_concurrently(
+                self._get_executor(),
+                lambda key: read_label(s3, bucket_name, key),
+                list(stale),
+                self.fetch_timeout,
+            )
+
+            # labels that failed aren't stored, so they are retried on the next refresh
+            for key, text in texts.items():
+                labels[key] = (stale[key], text)
+
+        entries = []
+        for name, asset in batch:
+            label = name
+            label_obj = asset.get('label')
+
+            if label_obj is not None and label_obj['Key'] in labels:
+                label = labels[label_obj['Key']][1]
+
+            entries.append(make_entry(name, asset, label))
+
+        videos.extend(entries)
+        return entries
+
+
+def get_catalog():
+    """Returns the catalog of the current application."""
+    return current_app.extensions['catalog']
+
+
+def init_app(app):
+    """
+    Attach a catalog to the app. Its refresh interval is read from the
+    CATALOG_TTL config value (in seconds).
+
+    Labels are downloaded by S3_FETCH_WORKERS threads, and a batch of downloads is
+    abandoned after S3_FETCH_TIMEOUT seconds. With CATALOG_MANIFEST set, the
+    catalog is read from the bucket's manifest where there is one.
+    """
+    app.config.setdefault('CATALOG_TTL', 60)
+    app.config.setdefault('CATALOG_MANIFEST', True)
+    app.config.setdefault('S3_FETCH_WORKERS', 16)
+    app.config.setdefault('S3_FETCH_TIMEOUT', 10)
+    app.extensions['catalog'] = Catalog(
+        ttl=app.config['CATALOG_TTL'],
+        max_workers=app.config['S3_FETCH_WORKERS'],
+        fetch_timeout=app.config['S3_FETCH_TIMEOUT'],
+        use_manifest=app.config['CATALOG_MANIFEST'],
+    )
@@ -1,27 +1,297 @@
+import os
+import re
+import threading
+import time
+
 import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
 from flask import current_app, g
 
+from metrics import span
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of PostgreSQL connections for one worker process.
+
+    Up to `max_size` connections are opened on demand and kept open between
+    requests. When all of them are in use, a checkout waits up to `timeout`
+    seconds for one to be returned before raising a PoolError, and opening a
+    new one gives up after `connect_timeout` seconds. Connections
+    that have been idle for more than `health_check_interval` seconds are
+    pinged before they are handed out, and every connection is rolled back
+    when it is returned, so no transaction leaks from one request to the next.
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=5, health_check_interval=30,
+                 connection_factory=None, connect_timeout=5):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connection_factory = connection_factory
+        self.connect_timeout = connect_timeout
+
+        self._cond = threading.Condition()
+        self._idle = []  # (connection, last used), most recently used last
+        self._size = 0  # open connections, idle or in use
+        self._pid = os.getpid()
+        self._orphans = []
+
+        self.in_use = 0
+        self.checkouts = 0
+        self.exhausted = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def getconn(self):
+        """Checks out a healthy connection, waiting for one if the pool is exhausted."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = None
+        blocked = False
+
+        with self._cond:
+            self._check_pid()
+
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolError(f"No database connection became available within {self.timeout}s.")
+
+                if not blocked:
+                    blocked = True
+                    self.exhausted += 1
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - start
+            self.in_use += 1
+            self.checkouts += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+
+        try:
+            if conn is not None and not self._is_healthy(conn, last_used):
+                self.discarded += 1
+                self._close(conn)
+                conn = None
+
+            if conn is None:
+                conn = psycopg2.connect(self.dsn, connection_factory=self.connection_factory,
+                                        connect_timeout=self.connect_timeout)
+
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self.in_use -= 1
+                self._cond.notify()
+            raise
+
+        return conn
+
+    def putconn(self, conn):
+        """Returns a connection to the pool, rolling back any open transaction."""
+        reusable = not conn.closed
+
+        if reusable and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                reusable = False
+
+        with self._cond:
+            if self._pid != os.getpid():
+                return  # checked out before a fork, belongs to the parent
+
+            self.in_use -= 1
+
+            if reusable:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+                self._close(conn)
+
+            self._cond.notify()
+
+    def warm(self):
+        """Opens connections until `min_size` of them are idle."""
+        conns = []
+        try:
+            while len(self._idle) + len(conns) < self.min_size and self._size < self.max_size:
+                conns.append(self.getconn())
+        finally:
+            for conn in conns:
+                self.putconn(conn)
+
+    def stats(self):
+        return {
+            'size': self._size,
+            'idle': len(self._idle),
+            'in_use': self.in_use,
+            'max_size': self.max_size,
+            'checkouts': self.checkouts,
+            'exhausted': self.exhausted,
+            'timeouts': self.timeouts,
+            'discarded': self.discarded,
+            'wait_time_total': round(self.wait_time_total, 6),
+            'wait_time_max': round(self.wait_time_max, 6),
+        }
+
+    def _check_pid(self):
+        # Connections inherited from the parent process share its sockets. Closing
+        # them here would end the parent's sessions, so they are only forgotten.
+        if self._pid != os.getpid():
+            self._orphans.extend(conn for conn, _ in self._idle)
+            self._idle = []
+            self._size = 0
+            self.in_use = 0
+            self._pid = os.getpid()
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed or conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """
+    A connection that remembers which statements it has prepared, so the hot
+    queries are parsed and planned once per connection instead of on every
+    execution (see execute_prepared). Prepared statements belong to the
+    database session, so they don't work through a pooler in transaction
+    mode (e.g. PgBouncer), where DB_PREPARED_STATEMENTS should be turned off.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def execute_prepared(conn, cur, name, sql, params):
+    """
+    Runs `sql` as the prepared statement `name`, preparing it on its first
+    use on the connection. The placeholders are $1, $2, ..., each used once
+    and in order. On connections that don't track their statements, it runs
+    as a plain query.
+    """
+    prepared = getattr(conn, 'prepared', None)
+    if prepared is None:
+        cur.execute(re.sub(r'\$\d+', '%s', sql), params)
+        return
+
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {sql}")
+        prepared.add(name)
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """Waits for a psycopg2 connection by yielding to other greenlets instead of blocking the worker."""
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        if state == psycopg2.extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == psycopg2.extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state}")
+
+
+def make_green():
+    """
+    Makes psycopg2 cooperate with gevent if the process runs gevent workers
+    (which monkey-patch the socket module). libpq doesn't use Python sockets,
+    so without this a query would block every greenlet of the worker.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+
+    if not monkey.is_module_patched('socket'):
+        return False
+
+    psycopg2.extensions.set_wait_callback(gevent_wait_callback)
+    return True
+
+
 def get_db():
     """
-    Opens a new database connection if there is none yet for the
+    Checks out a database connection from the pool if there is none yet for the
     current application context.
     """
     if 'db' not in g:
-        g.db = psycopg2.connect(current_app.config['DATABASE_URL'])
+        with span('db', 'checkout'):
+            g.db = current_app.extensions['db_pool'].getconn()
     return g.db
 
 def close_db(e=None):
     """
-    Closes the database connection. This function is called automatically
-    when the application context is torn down.
+    Returns the database connection to the pool. This function is called
+    automatically when the application context is torn down.
     """
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        current_app.extensions['db_pool'].putconn(db)
 
 def init_app(app):
     """
-    Register the close_db function with the Flask app. This ensures
-    it's called after each request.
+    Create the app's connection pool, sized by DB_POOL_MIN_SIZE and
+    DB_POOL_MAX_SIZE, and register the close_db function with the Flask app.
+    This ensures it's called after each request. Under gevent workers,
+    queries yield to other requests while they wait for the database. With
+    DB_PREPARED_STATEMENTS, connections prepare the hot queries. Opening a
+    connection gives up after DB_CONNECT_TIMEOUT seconds.
     """
-    app.teardown_appcontext(close_db)
\ No newline at end of file
+    app.config.setdefault('DB_POOL_MIN_SIZE', 1)
+    app.config.setdefault('DB_POOL_MAX_SIZE', 10)
+    app.config.setdefault('DB_POOL_TIMEOUT', 5)
+    app.config.setdefault('DB_HEALTH_CHECK_INTERVAL', 30)
+    app.config.setdefault('DB_CONNECT_TIMEOUT', 5)
+    app.config.setdefault('DB_PREPARED_STATEMENTS', True)
+    app.extensions['db_pool'] = ConnectionPool(
+        app.config['DATABASE_URL'],
+        min_size=app.config['DB_POOL_MIN_SIZE'],
+        max_size=app.config['DB_POOL_MAX_SIZE'],
+        timeout=app.config['DB_POOL_TIMEOUT'],
+        health_check_interval=app.config['DB_HEALTH_CHECK_INTERVAL'],
+        connection_factory=PreparingConnection if app.config['DB_PREPARED_STATEMENTS'] else None,
+        connect_timeout=app.config['DB_CONNECT_TIMEOUT'],
+    )
+    app.teardown_appcontext(close_db)
+    make_green()
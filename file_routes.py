@@ -1,23 +1,27 @@
-from flask import Blueprint, send_from_directory
+from flask import Blueprint
 from flask_login import login_required
 
+from static_assets import send_asset
+
 
 # Create a Blueprint. The first argument is the blueprint's name,
 # the second is the import name, which is used to locate resources.
 file_routes = Blueprint('file_routes', __name__)
 
 
+# Files are served from memory by the app's asset stores (see static_assets.py),
+# with compressed variants and ETags, instead of being read from disk every time.
 @file_routes.route('/')
 def serve_index():
-    return send_from_directory('static/public', 'index.html')
+    return send_asset('public', 'index.html')
 
 
 @file_routes.route('/protected/<path:filename>')
 @login_required
 def serve_protected_file(filename):
-    return send_from_directory('static/protected', filename)
+    return send_asset('protected', filename, private=True)
 
 
 @file_routes.route('/<path:path>')
 def serve_public_file(path):
-    return send_from_directory('static/public', path)
\ No newline at end of file
+    return send_asset('public', path)
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""
+Gunicorn settings for the site, see "Worker models" in the README. Every
+setting can be changed through the environment.
+"""
+import os
+
+
+bind = os.environ.get('GUNICORN_BIND', ':8000')
+
+# 'gthread' (the default) or 'gevent' let a worker serve other requests while
+# one waits on S3 or PostgreSQL; 'sync' handles one request per worker at a time.
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+# gthread: requests in flight per worker (gunicorn turns sync workers with threads into gthread ones)
+threads = int(os.environ.get('WEB_THREADS', 8)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 100))  # gevent: requests in flight per worker
+
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))  # seconds before a stuck worker is restarted
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))  # seconds, behind the load balancer
+
+# Load the app once in the master process and fork the workers from it, so
+# they start faster and share the memory of the imported modules and static
+# files. Database connections, S3 clients and the hashing processes are only
+# created in the workers. Not with gevent, which has to patch the standard
+# library before the app is imported.
+preload_app = os.environ.get('WEB_PRELOAD', '0') == '1' and worker_class != 'gevent'
+
+
+def when_ready(server):
+    # the app imports boto3 on first use, a preloaded app before the workers
+    # are forked, so they inherit it instead of each importing it
+    if server.cfg.preload_app:
+        from s3_client import import_boto3
+        import_boto3()
+
+
+def post_worker_init(worker):
+    # runs in each worker once it has loaded the app, before it accepts requests
+    from app import warm_up
+    warm_up(notify=worker.notify)
@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from metrics import span
+
+
+class HashingBusy(Exception):
+    """Raised when too many password hashes are already queued."""
+    pass
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification in a pool of `max_workers` processes,
+    so a burst of logins can't occupy every web worker with CPU-heavy hashing.
+
+    At most `max_pending` operations may be queued or running at once; beyond
+    that, calls fail immediately with HashingBusy so the caller can answer
+    with a 429 instead of queueing the request. With `max_workers=0` hashes are
+    computed in the calling thread (still subject to `max_pending`).
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, timeout=30):
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+        self.max_pending = max_pending or max(1, self.max_workers) * 4
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._dummy_hash = None
+
+        self.completed = 0
+        self.rejected = 0
+
+    def hash(self, password):
+        return self._run('hash', generate_password_hash, password)
+
+    def verify(self, password_hash, password):
+        return self._run('verify', check_password_hash, password_hash, password)
+
+    def verify_unknown_user(self, password):
+        """
+        Does the same work as `verify` for an email that has no account, so the
+        response time doesn't reveal whether the account exists. Always False.
+        """
+        if self._dummy_hash is None:
+            self._dummy_hash = self.hash('not-a-real-password')
+        self.verify(self._dummy_hash, password)
+        return False
+
+    def warm(self):
+        """
+        Starts the worker processes and computes the dummy hash of
+        `verify_unknown_user`, so the first logins don't wait for either.
+        """
+        if self.max_workers:
+            executor = self._get_executor()
+            # submitted together, so each spawns a process instead of waiting for an idle one
+            for future in [executor.submit(os.getpid) for _ in range(self.max_workers)]:
+                future.result(timeout=self.timeout)
+        if self._dummy_hash is None:
+            self._dummy_hash = self.hash('not-a-real-password')
+
+    def stats(self):
+        return {
+            'workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+            'rejected': self.rejected,
+        }
+
+    def _run(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingBusy()
+
+        try:
+            with span('hash', operation):  # includes the wait for a free process
+                if self.max_workers == 0:
+                    result = fn(*args)
+                else:
+                    result = self._get_executor().submit(fn, *args).result(timeout=self.timeout)
+            self.completed += 1
+            return result
+
+        finally:
+            self._slots.release()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # 'spawn' because forking a multi-threaded web worker can copy held locks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+
+def get_hasher():
+    """Returns the password hasher of the current application."""
+    return current_app.extensions['password_hasher']
+
+
+def init_app(app):
+    """
+    Attach a password hasher to the app, with HASH_WORKERS processes (default:
+    one per CPU core) and at most HASH_MAX_PENDING queued operations. Every
+    web worker has its own pool, so across the host there are WEB_CONCURRENCY
+    times as many processes; app.py divides the cores among the workers.
+    """
+    app.config.setdefault('HASH_WORKERS', None)
+    app.config.setdefault('HASH_MAX_PENDING', None)
+    app.extensions['password_hasher'] = PasswordHasher(
+        max_workers=app.config['HASH_WORKERS'],
+        max_pending=app.config['HASH_MAX_PENDING'],
+    )
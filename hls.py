@@ -0,0 +1,122 @@
+import math
+import re
+
+from botocore.exceptions import ClientError
+from flask import current_app
+
+from cache import LRUCache
+
+
+# Packaged videos live under hls/<name>/: a master playlist, and a media
+# playlist with its segments per rendition, e.g. hls/intro/720p/index.m3u8.
+HLS_PREFIX = 'hls/'
+MASTER_PLAYLIST = 'master.m3u8'
+PLAYLIST_MIMETYPE = 'application/vnd.apple.mpegurl'
+SEGMENT_MIMETYPE = 'video/mp2t'
+
+# the longest lifetime S3 accepts for a presigned URL (seven days)
+MAX_URL_LIFETIME = 7 * 24 * 3600
+# a cap below that is rounded down to this, so the URLs' cache keys don't change with every request
+LIFETIME_STEP = 300
+
+URI_ATTRIBUTE = re.compile(r'URI="([^"]+)"')
+
+
+def master_key(name):
+    """The S3 key of a video's master playlist."""
+    return f"{HLS_PREFIX}{name}/{MASTER_PLAYLIST}"
+
+
+def playlist_duration(text):
+    """The total duration of a media playlist in seconds (0 for a master playlist)."""
+    return sum(float(line[len('#EXTINF:'):].split(',')[0]) for line in text.splitlines() if line.startswith('#EXTINF:'))
+
+
+def segment_url_lifetimes(duration, max_lifetime=MAX_URL_LIFETIME):
+    """
+    Returns `(expires_in, min_lifetime)` for the segment URLs of a playlist
+    with the given duration: a URL must stay valid long enough to play the
+    whole video, with room for pauses, and is reused for about an hour.
+
+    Both are capped at `max_lifetime`, the time the credentials that sign the
+    URLs have left: a URL stops working when they expire, however long it was
+    signed for.
+    """
+    if max_lifetime < MAX_URL_LIFETIME:
+        max_lifetime = max(LIFETIME_STEP, max_lifetime // LIFETIME_STEP * LIFETIME_STEP)
+
+    min_lifetime = math.ceil(1.5 * duration) + 1800
+    expires_in = math.ceil((min_lifetime + 3600) / 3600) * 3600
+    return min(expires_in, max_lifetime), max(0, min(min_lifetime, max_lifetime - 3600))
+
+
+def rewrite_playlist(text, playlist_key, presign, max_lifetime=MAX_URL_LIFETIME):
+    """
+    Points the segment URIs of a playlist at presigned S3 URLs, created with
+    `presign(key, expires_in, min_lifetime)` and valid for at most
+    `max_lifetime` seconds. URIs of other playlists (the renditions in a
+    master playlist) are left relative, so the player fetches them from the
+    app as well.
+    """
+    base = playlist_key.rpartition('/')[0] + '/'
+    expires_in, min_lifetime = segment_url_lifetimes(playlist_duration(text), max_lifetime)
+
+    def sign(uri):
+        if uri.endswith('.m3u8') or '://' in uri:
+            return uri
+        return presign(base + uri, expires_in, min_lifetime)
+
+    lines = []
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            line = sign(line.strip())
+        elif line.startswith('#EXT-X-MAP:'):
+            line = URI_ATTRIBUTE.sub(lambda match: f'URI="{sign(match.group(1))}"', line)
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+class PlaylistCache:
+    """
+    Keeps the playlists downloaded from S3 in memory. Packaged playlists don't
+    change unless a video is packaged again, so they only expire after `ttl`
+    seconds.
+    """
+
+    def __init__(self, max_entries=1000, ttl=300):
+        self._cache = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    def get(self, s3, bucket_name, key):
+        """Returns the text of the playlist at `key`, or None if there is no such object."""
+        text = self._cache.get(key)
+        if text is None:
+            try:
+                response = s3.get_object(Bucket=bucket_name, Key=key)
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                    return None
+                raise
+            text = response['Body'].read().decode('utf-8')
+            self._cache.set(key, text)
+        return text
+
+    def stats(self):
+        return self._cache.stats()
+
+
+def get_playlist_cache():
+    """Returns the playlist cache of the current application."""
+    return current_app.extensions['hls_playlists']
+
+
+def init_app(app):
+    """
+    Attach a cache for HLS playlists to the app, holding up to
+    HLS_PLAYLIST_CACHE_SIZE playlists for HLS_PLAYLIST_CACHE_TTL seconds.
+    """
+    app.config.setdefault('HLS_PLAYLIST_CACHE_SIZE', 1000)
+    app.config.setdefault('HLS_PLAYLIST_CACHE_TTL', 300)
+    app.extensions['hls_playlists'] = PlaylistCache(
+        max_entries=app.config['HLS_PLAYLIST_CACHE_SIZE'],
+        ttl=app.config['HLS_PLAYLIST_CACHE_TTL'],
+    )
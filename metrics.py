@@ -0,0 +1,375 @@
+import bisect
+import contextlib
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, current_app, g, has_app_context, has_request_context, request
+from werkzeug.wsgi import ClosingIterator
+
+
+# seconds; from a cached page (a few ms) to a cold catalog listing
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_NO_SPAN = contextlib.nullcontext()
+
+# the spans of the request a pool thread is working for, see bind_request_spans
+_pool_thread = threading.local()
+# a request's spans may be added to from several threads at once
+_spans_lock = threading.Lock()
+
+
+class Histogram:
+    """
+    A thread-safe Prometheus histogram: cumulative counts of observations per
+    bucket, plus their sum and count, for each combination of label values.
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [count per bucket (the last one is +Inf), sum]
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self, extra_labels=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in sorted(self._series.items())]
+
+        for labels, counts, total in series:
+            pairs = list(zip(self.labelnames, labels)) + list(extra_labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                lines.append(f"{self.name}_bucket{{{format_labels(pairs + [('le', le)])}}} {cumulative}")
+            lines.append(f"{self.name}_sum{{{format_labels(pairs)}}} {total!r}")
+            lines.append(f"{self.name}_count{{{format_labels(pairs)}}} {cumulative}")
+        return lines
+
+
+def format_labels(pairs):
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class StackSampler:
+    """
+    A sampling profiler for one thread: every `interval` seconds a background
+    thread records the thread's current stack. `stop` returns how often each
+    stack was seen, as "file:function;file:function" strings from the
+    outermost frame in, the collapsed format flame graph tools read.
+
+    Under gevent workers all requests share one OS thread and the sampler only
+    runs when the request yields, so the samples show where it waited rather
+    than where it spent CPU time.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+
+def calls(count):
+    return f"{count} call" if count == 1 else f"{count} calls"
+
+
+def log_slow_request(app, method, path, duration, spans, samples):
+    """
+    The default hook for slow requests: logs the time spent per kind of span
+    and, if the request was profiled, the stacks sampled most often.
+    """
+    summary = ', '.join(f"{kind} {total * 1000:.1f}ms in {calls(count)}" for kind, (total, count) in spans.items())
+    message = f"Slow request {method} {path}: {duration * 1000:.1f}ms ({summary or 'no spans'})"
+
+    if samples:
+        total = sum(samples.values())
+        top = '\n'.join(
+            f"  {count / total:6.1%}  {';'.join(stack.split(';')[-8:])}" for stack, count in samples.most_common(5)
+        )
+        message += f"\nMost sampled stacks ({total} samples, innermost 8 frames):\n{top}"
+    app.logger.warning(message)
+
+
+class Span:
+    """Records the time spent in a `with` block (a class, as it is cheaper than a generator)."""
+
+    __slots__ = ('metrics', 'kind', 'operation', 'start')
+
+    def __init__(self, metrics, kind, operation):
+        self.metrics = metrics
+        self.kind = kind
+        self.operation = operation
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record_span(self.kind, self.operation, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """
+    Times every request, and the calls to S3, the database and the password
+    hasher made while serving it ("spans"). The durations are aggregated into
+    histograms, exported in the Prometheus text format at /metrics, and each
+    response gets a Server-Timing header with its spans, which shows up in the
+    browser's developer tools.
+
+    Requests slower than `slow_request_threshold` seconds are passed to
+    `slow_request_hook`. A `profile_rate` share of all requests is profiled by
+    a StackSampler, so for slow requests among them the hook also gets the
+    stacks they spent their time in.
+
+    The histograms belong to the worker process. Every series is labelled
+    with the worker's pid, so the workers' series stay apart when Prometheus
+    scrapes them one at a time through the load balancer.
+    """
+
+    def __init__(self, slow_request_threshold=None, profile_rate=0.0, profile_interval=0.005):
+        self.slow_request_threshold = slow_request_threshold
+        self.profile_rate = profile_rate
+        self.profile_interval = profile_interval
+        self.slow_request_hook = log_slow_request
+
+        self.requests = Histogram(
+            'http_request_duration_seconds',
+            "Time from receiving a request until its response was sent.",
+            ('method', 'endpoint', 'status'),
+        )
+        self.spans = Histogram(
+            'app_span_duration_seconds',
+            "Time spent in calls to S3, the database and the password hasher.",
+            ('kind', 'operation'),
+        )
+
+    def record_span(self, kind, operation, duration):
+        """Adds a span to the histograms and, during a request, to its Server-Timing header."""
+        self.spans.observe((kind, operation), duration)
+
+        spans = g.get('_metrics_spans') if has_request_context() else getattr(_pool_thread, 'spans', None)
+        if spans is not None:
+            with _spans_lock:
+                total, count = spans.get(kind, (0.0, 0))
+                spans[kind] = (total + duration, count + 1)
+
+    def span(self, kind, operation):
+        return Span(self, kind, operation)
+
+    def instrument_s3(self, client):
+        """Records a span for every API call of a boto3 S3 client (retries included)."""
+        def before_call(context, **kwargs):
+            context['metrics_start'] = time.perf_counter()
+
+        def after_call(event_name, context, **kwargs):
+            # after-call-error has no model, the event name ends in the operation
+            start = context.pop('metrics_start', None)
+            if start is not None:
+                self.record_span('s3', event_name.rsplit('.', 1)[-1], time.perf_counter() - start)
+
+        client.meta.events.register('before-call.s3', before_call)
+        client.meta.events.register('after-call.s3', after_call)
+        client.meta.events.register('after-call-error.s3', after_call)
+        return client
+
+    def render(self):
+        worker = [('pid', os.getpid())]
+        lines = self.requests.render(worker) + self.spans.render(worker)
+        return '\n'.join(lines) + '\n'
+
+    def before_request(self):
+        g._metrics_start = time.perf_counter()
+        g._metrics_spans = {}  # kind -> (total seconds, calls)
+        if self.profile_rate and random.random() < self.profile_rate:
+            g._metrics_sampler = StackSampler(threading.get_ident(), self.profile_interval).start()
+
+    def after_request(self, response):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return response
+
+        spans = g._metrics_spans  # left in place, spans of a streamed body are added later
+        sampler = g.pop('_metrics_sampler', None)
+        app = current_app._get_current_object()
+        labels = (request.method, request.endpoint or 'unmatched', str(response.status_code))
+        method, path = request.method, request.path
+
+        with _spans_lock:
+            timings = [
+                f'{kind};dur={total * 1000:.1f};desc="{calls(count)}"'
+                for kind, (total, count) in spans.items()
+            ]
+        timings.append(f'app;dur={(time.perf_counter() - start) * 1000:.1f}')
+        response.headers.add('Server-Timing', ', '.join(timings))
+
+        finished = []
+
+        # streamed responses are only done once the server closes them
+        def finish():
+            if finished:
+                return
+            finished.append(True)
+            duration = time.perf_counter() - start
+            self.requests.observe(labels, duration)
+            samples = sampler.stop() if sampler is not None else None
+
+            threshold = self.slow_request_threshold
+            if threshold and duration >= threshold and self.slow_request_hook is not None:
+                with _spans_lock:
+                    spans_so_far = dict(spans)
+                self.slow_request_hook(app, method, path, duration, spans_so_far, samples)
+
+        response.call_on_close(finish)
+        if response.direct_passthrough:
+            close_with(response, finish)
+        return response
+
+    def teardown_request(self, exc=None):
+        # only still there if after_request didn't run
+        sampler = g.pop('_metrics_sampler', None)
+        if sampler is not None:
+            sampler.stop()
+
+
+def close_with(response, callback):
+    """
+    Calls `callback` when the server closes the body of a direct_passthrough
+    response, which Werkzeug hands over without its close callbacks. A
+    wsgi.file_wrapper keeps its type, so the server can still send it with
+    sendfile(2); other bodies are wrapped.
+    """
+    body = response.response
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if not (isinstance(file_wrapper, type) and isinstance(body, file_wrapper)):
+        response.response = ClosingIterator(body, callback)
+        return
+
+    close = getattr(body, 'close', None)
+
+    def close_and_callback():
+        try:
+            if close is not None:
+                close()
+        finally:
+            callback()
+
+    body.close = close_and_callback
+
+
+def span(kind, operation):
+    """
+    A context manager that records the time spent in its block, e.g.
+    `with span('db', 'User.get'): ...`. Does nothing without an app context or
+    with metrics disabled.
+    """
+    if not has_app_context():
+        return _NO_SPAN
+    metrics = current_app.extensions.get('metrics')
+    return metrics.span(kind, operation) if metrics is not None else _NO_SPAN
+
+
+def bind_request_spans(fn):
+    """
+    Returns `fn` wrapped so the spans it records on another thread, such as
+    one of an executor, count towards the current request's Server-Timing
+    header. Outside a request or with metrics disabled, returns `fn` itself.
+    On a thread that was itself bound, the spans go to the same request.
+    """
+    spans = g.get('_metrics_spans') if has_request_context() else getattr(_pool_thread, 'spans', None)
+    if spans is None:
+        return fn
+
+    def run(*args, **kwargs):
+        _pool_thread.spans = spans
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _pool_thread.spans = None
+
+    return run
+
+
+def get_metrics():
+    """Returns the metrics of the current application, or None if they are disabled."""
+    return current_app.extensions.get('metrics')
+
+
+def metrics_view():
+    token = current_app.config['METRICS_TOKEN']
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return Response("Unauthorized\n", status=401, mimetype='text/plain')
+    return Response(get_metrics().render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """
+    With METRICS_ENABLED set, time requests and their spans and serve the
+    histograms at /metrics to requests bearing METRICS_TOKEN. The histograms
+    show the traffic and the worker pids, so without a token /metrics isn't
+    served at all (Server-Timing headers and slow-request logs still are).
+    Requests slower than SLOW_REQUEST_THRESHOLD seconds are logged, with
+    stack samples for the PROFILE_SAMPLE_RATE share of requests that are
+    profiled. Disabled, nothing is registered and spans are no-ops.
+    """
+    app.config.setdefault('METRICS_ENABLED', False)
+    app.config.setdefault('METRICS_TOKEN', None)
+    app.config.setdefault('SLOW_REQUEST_THRESHOLD', 0)
+    app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+    app.config.setdefault('PROFILE_INTERVAL', 0.005)
+
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    metrics = app.extensions['metrics'] = Metrics(
+        slow_request_threshold=app.config['SLOW_REQUEST_THRESHOLD'] or None,
+        profile_rate=app.config['PROFILE_SAMPLE_RATE'],
+        profile_interval=app.config['PROFILE_INTERVAL'],
+    )
+    app.before_request(metrics.before_request)
+    app.after_request(metrics.after_request)
+    app.teardown_request(metrics.teardown_request)
+    if app.config['METRICS_TOKEN']:
+        app.add_url_rule('/metrics', 'metrics', metrics_view)
+    else:
+        app.logger.warning("METRICS_TOKEN is not set, /metrics is not served")
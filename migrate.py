@@ -0,0 +1,176 @@
+import argparse
+import os
+import re
+import sys
+
+import psycopg2
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# taken for the duration of a run, so instances deploying at once don't both migrate
+ADVISORY_LOCK_ID = 0x5354524d  # 'STRM'
+
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+NO_TRANSACTION = '-- migrate: no-transaction'
+
+
+class Migration:
+    """
+    One file of the migrations directory, e.g. 0002_users_email_lower_unique.sql.
+
+    A migration runs in a transaction together with its entry in
+    schema_migrations, so it is applied completely or not at all. Files
+    starting with "-- migrate: no-transaction" run statement by statement
+    outside of a transaction instead, as e.g. CREATE INDEX CONCURRENTLY
+    requires. Their statements must end with ';' at the end of a line, and
+    they must be safe to run again after failing halfway.
+    """
+
+    def __init__(self, version, name, sql):
+        self.version = version
+        self.name = name
+        self.sql = sql
+        self.transactional = not sql.startswith(NO_TRANSACTION)
+
+    def statements(self):
+        return [statement.strip() for statement in re.split(r';\s*$', self.sql, flags=re.MULTILINE) if statement.strip()]
+
+    def __repr__(self):
+        return f"{self.version}_{self.name}"
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """The migrations in the directory, ordered by version."""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            with open(os.path.join(directory, filename)) as f:
+                migrations.append(Migration(match.group(1), match.group(2), f.read()))
+
+    migrations.sort(key=lambda migration: int(migration.version))
+    versions = [migration.version for migration in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def applied_versions(conn):
+    """The versions recorded in schema_migrations (an empty set if the table doesn't exist yet)."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            return set()
+        cur.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cur.fetchall()}
+
+
+def pending_migrations(conn, migrations=None):
+    """The migrations that haven't been applied to the database yet."""
+    migrations = load_migrations() if migrations is None else migrations
+    applied = applied_versions(conn)
+    return [migration for migration in migrations if migration.version not in applied]
+
+
+def apply_migration(conn, migration):
+    """Applies one migration and records it in schema_migrations."""
+    with conn.cursor() as cur:
+        if migration.transactional:
+            cur.execute(migration.sql)
+        else:
+            conn.autocommit = True
+            try:
+                for statement in migration.statements():
+                    cur.execute(statement)
+            finally:
+                conn.autocommit = False
+        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (migration.version, migration.name))
+    conn.commit()
+
+
+def migrate(conn, migrations=None, log=print):
+    """
+    Applies the pending migrations in order, holding an advisory lock so that
+    concurrent runs wait for each other and then find nothing left to do.
+    Running it again is a no-op. Returns the applied migrations.
+    """
+    migrations = load_migrations() if migrations is None else migrations
+    conn.autocommit = False
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+    conn.commit()  # session-level lock, held until pg_advisory_unlock
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            """)
+        conn.commit()
+
+        pending = pending_migrations(conn, migrations)
+        conn.commit()
+        for migration in pending:
+            log(f"Applying migration {migration}...")
+            apply_migration(conn, migration)
+        log(f"Applied {len(pending)} migrations." if pending else "The database schema is up to date.")
+        return pending
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    finally:
+        if not conn.closed:  # a lost connection released the lock with it
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (ADVISORY_LOCK_ID,))
+            conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Bring the database schema up to date by applying the pending migrations in migrations/."
+    )
+    parser.add_argument(
+        "--database-url",
+        default=os.environ.get('DATABASE_URL'),
+        help="The database to migrate. Defaults to the DATABASE_URL environment variable."
+    )
+    parser.add_argument(
+        "--status",
+        action="store_true",
+        help="Only list the pending migrations. Exits with 1 if there are any."
+    )
+    args = parser.parse_args()
+
+    if not args.database_url:
+        print("Error: No database given. Provide it with --database-url or the DATABASE_URL environment variable.")
+        sys.exit(1)
+
+    try:
+        conn = psycopg2.connect(args.database_url)
+    except psycopg2.Error as e:
+        print(f"Error: Could not connect to the database: {e}")
+        sys.exit(1)
+
+    try:
+        if args.status:
+            pending = pending_migrations(conn)
+            for migration in pending:
+                print(f"Pending: {migration}")
+            print(f"{len(pending)} pending migrations.")
+            sys.exit(1 if pending else 0)
+
+        migrate(conn)
+
+    except psycopg2.Error as e:
+        print(f"Error: Migration failed: {e}")
+        sys.exit(1)
+
+    finally:
+        conn.close()
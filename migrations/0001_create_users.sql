@@ -0,0 +1,7 @@
+-- The table the site has used from the start. Databases set up by hand
+-- already have it, so it is only created if it is missing.
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    password_hash VARCHAR(255) NOT NULL
+);
@@ -0,0 +1,8 @@
+-- migrate: no-transaction
+-- Logins and signups look users up by lower(email), which this index serves,
+-- and it stops two accounts from differing only in the case of their email.
+-- It is built concurrently so signups aren't blocked while it is built. A
+-- build that failed (e.g. on existing duplicates, which have to be merged by
+-- hand) leaves an invalid index behind, so that is dropped first.
+DROP INDEX CONCURRENTLY IF EXISTS users_email_lower_key;
+CREATE UNIQUE INDEX CONCURRENTLY users_email_lower_key ON users (lower(email));
@@ -1,5 +1,16 @@
 from flask_login import UserMixin
 
+from db import execute_prepared
+from metrics import span
+from user_cache import invalidate_user
+
+
+# The lookups run on every login and signup (and every request that misses the
+# user cache), so they are prepared once per connection. lower(email) matches
+# the unique index of migrations/0002_users_email_lower_unique.sql.
+GET_USER = "SELECT id, email, password_hash FROM users WHERE id = $1"
+GET_USER_BY_EMAIL = "SELECT id, email, password_hash FROM users WHERE lower(email) = lower($1)"
+
 
 class User(UserMixin):
     def __init__(self, id, email, password_hash):
@@ -9,8 +20,8 @@ class User(UserMixin):
 
     @staticmethod
     def get(conn, user_id):
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, email, password_hash FROM users WHERE id = %s", (user_id,))
+        with span('db', 'User.get'), conn.cursor() as cur:
+            execute_prepared(conn, cur, 'user_get', GET_USER, (user_id,))
             user_data = cur.fetchone()
         if user_data:
             return User(id=user_data[0], email=user_data[1], password_hash=user_data[2])
@@ -18,8 +29,8 @@ class User(UserMixin):
 
     @staticmethod
     def get_by_email(conn, email):
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, email, password_hash FROM users WHERE email = %s", (email,))
+        with span('db', 'User.get_by_email'), conn.cursor() as cur:
+            execute_prepared(conn, cur, 'user_get_by_email', GET_USER_BY_EMAIL, (email,))
             user_data = cur.fetchone()
         if user_data:
             return User(id=user_data[0], email=user_data[1], password_hash=user_data[2])
@@ -27,9 +38,10 @@ class User(UserMixin):
 
     @staticmethod
     def create(conn, email, password_hash):
-        with conn.cursor() as cur:
+        with span('db', 'User.create'), conn.cursor() as cur:
             cur.execute("INSERT INTO users (email, password_hash) VALUES (%s, %s) RETURNING id", (email, password_hash))
             user_id = cur.fetchone()[0]
+        invalidate_user(user_id)  # drop anything cached under this id
         return User(id=user_id, email=email, password_hash=password_hash)
 
 class DatabaseError(Exception):
@@ -0,0 +1,312 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import NoCredentialsError, ClientError
+
+from hls import HLS_PREFIX, MASTER_PLAYLIST, PLAYLIST_MIMETYPE, SEGMENT_MIMETYPE, master_key
+from upload_script import create_s3_client, record_manifest_update
+
+
+# name -> (height, video kbit/s, audio kbit/s), from the highest to the lowest
+RENDITIONS = {
+    '1080p': (1080, 5000, 192),
+    '720p': (720, 2800, 128),
+    '480p': (480, 1400, 128),
+    '360p': (360, 800, 96),
+}
+
+# H.264 Main profile, level 4.0 (plays on practically every device) and AAC-LC
+CODECS = 'avc1.4d4028,mp4a.40.2'
+
+MEDIA_PLAYLIST = 'index.m3u8'
+SEGMENT_PATTERN = 'seg_%05d.ts'
+
+DURATION = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)')
+VIDEO_STREAM = re.compile(r'Stream #\d+:\d+.*: Video: .*?, (\d{2,5})x(\d{2,5})')
+FRAME_RATE = re.compile(r'([\d.]+) fps')
+
+
+def probe(ffmpeg, file_path):
+    """
+    Reads the duration, frame size and frame rate of a video, and whether it
+    has audio, from ffmpeg's description of its input (so ffprobe isn't needed).
+    """
+    result = subprocess.run([ffmpeg, '-hide_banner', '-i', file_path], capture_output=True, text=True)
+    output = result.stderr
+
+    video = VIDEO_STREAM.search(output)
+    if video is None:
+        raise ValueError(f"'{file_path}' has no video stream:\n{output.strip()}")
+
+    duration = DURATION.search(output)
+    hours, minutes, seconds = duration.groups() if duration else (0, 0, 0)
+    video_line = output[video.start():output.find('\n', video.start())]
+    fps = FRAME_RATE.search(video_line)
+
+    return {
+        'width': int(video.group(1)),
+        'height': int(video.group(2)),
+        'duration': int(hours) * 3600 + int(minutes) * 60 + float(seconds),
+        'fps': float(fps.group(1)) if fps else None,
+        'audio': ': Audio: ' in output,
+    }
+
+
+def select_renditions(names, source_height):
+    """
+    The renditions to encode, lowest first. Renditions taller than the source
+    are left out, as upscaling only adds bytes; the lowest is always kept.
+    """
+    selected = sorted((RENDITIONS[name][0], name) for name in names)
+    kept = [name for height, name in selected if height <= source_height]
+    return kept or [selected[0][1]]
+
+
+def ffmpeg_command(ffmpeg, file_path, output_dir, renditions, segment_duration, has_audio, preset='veryfast'):
+    """
+    A single ffmpeg run that decodes the source once and encodes every
+    rendition into its own directory of segments with a media playlist.
+    Keyframes are forced at every segment boundary, so the segments of all
+    renditions line up and the player can switch between them at any segment.
+    """
+    command = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-i', file_path]
+
+    for name in renditions:
+        height, video_kbps, audio_kbps = RENDITIONS[name]
+        directory = os.path.join(output_dir, name)
+        os.makedirs(directory, exist_ok=True)
+
+        command += ['-map', '0:v:0']
+        if has_audio:
+            command += ['-map', '0:a:0', '-c:a', 'aac', '-b:a', f'{audio_kbps}k', '-ac', '2']
+        command += [
+            '-vf', f'scale=-2:{height}',
+            '-c:v', 'libx264', '-preset', preset, '-profile:v', 'main', '-level', '4.0', '-pix_fmt', 'yuv420p',
+            '-b:v', f'{video_kbps}k', '-maxrate', f'{video_kbps * 107 // 100}k', '-bufsize', f'{video_kbps * 3 // 2}k',
+            '-force_key_frames', f'expr:gte(t,n_forced*{segment_duration})', '-sc_threshold', '0',
+            '-f', 'hls', '-hls_time', str(segment_duration), '-hls_playlist_type', 'vod',
+            '-hls_flags', 'independent_segments',
+            '-hls_segment_filename', os.path.join(directory, SEGMENT_PATTERN),
+            os.path.join(directory, MEDIA_PLAYLIST),
+        ]
+    return command
+
+
+def measure_bandwidth(directory):
+    """
+    Returns (peak, average) bits per second of an encoded rendition, from the
+    sizes and durations of its segments, as the master playlist declares them.
+    """
+    with open(os.path.join(directory, MEDIA_PLAYLIST)) as f:
+        lines = f.read().splitlines()
+
+    segments = []
+    for line, uri in zip(lines, lines[1:]):
+        if line.startswith('#EXTINF:'):
+            duration = float(line[len('#EXTINF:'):].split(',')[0])
+            segments.append((os.path.getsize(os.path.join(directory, uri)) * 8, duration))
+
+    peak = max(bits / duration for bits, duration in segments if duration > 0)
+    average = sum(bits for bits, _ in segments) / sum(duration for _, duration in segments)
+    return round(peak), round(average)
+
+
+def scaled_width(source, height):
+    """The width ffmpeg's scale=-2:<height> gives: the source's aspect ratio, rounded to an even number."""
+    return round(height * source['width'] / (source['height'] * 2)) * 2
+
+
+def write_master_playlist(output_dir, renditions, source):
+    """
+    Writes the master playlist that lists the renditions, lowest bandwidth
+    first. BANDWIDTH is the peak rate of a rendition's segments and
+    AVERAGE-BANDWIDTH their mean, which players use to pick a rendition.
+    """
+    lines = ['#EXTM3U', '#EXT-X-VERSION:6', '#EXT-X-INDEPENDENT-SEGMENTS']
+
+    for name in renditions:
+        height = RENDITIONS[name][0]
+        peak, average = measure_bandwidth(os.path.join(output_dir, name))
+
+        attributes = (f'BANDWIDTH={peak},AVERAGE-BANDWIDTH={average},'
+                      f'RESOLUTION={scaled_width(source, height)}x{height},CODECS="{CODECS}"')
+        if source['fps']:
+            attributes += f',FRAME-RATE={source["fps"]:.3f}'
+        lines += [f'#EXT-X-STREAM-INF:{attributes}', f'{name}/{MEDIA_PLAYLIST}']
+
+    with open(os.path.join(output_dir, MASTER_PLAYLIST), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def package(ffmpeg, file_path, output_dir, rendition_names=tuple(RENDITIONS), segment_duration=4, preset='veryfast'):
+    """
+    Encodes a video into an HLS package in `output_dir`: a directory of
+    segments with a media playlist per rendition and the master playlist.
+
+    :return: The names of the encoded renditions.
+    """
+    source = probe(ffmpeg, file_path)
+    renditions = select_renditions(rendition_names, source['height'])
+    print(f"Source: {source['width']}x{source['height']}, {source['duration']:.1f}s"
+          f"{', no audio' if not source['audio'] else ''}. Encoding {', '.join(renditions)}...")
+
+    command = ffmpeg_command(ffmpeg, file_path, output_dir, renditions, segment_duration, source['audio'], preset)
+    subprocess.run(command, check=True)
+
+    write_master_playlist(output_dir, renditions, source)
+    return renditions
+
+
+def upload_package(s3_client, output_dir, bucket_name, name, jobs=8):
+    """
+    Uploads a package to hls/<name>/ in the bucket. The master playlist goes
+    last, so the site never links to a package with missing segments.
+
+    :return: The key of the master playlist.
+    """
+    prefix = f"{HLS_PREFIX}{name}/"
+    files = []
+    for directory, _, filenames in os.walk(output_dir):
+        for filename in sorted(filenames):
+            path = os.path.join(directory, filename)
+            relative = os.path.relpath(path, output_dir).replace(os.sep, '/')
+            if relative != MASTER_PLAYLIST:
+                files.append((path, prefix + relative))
+
+    def upload(path, key):
+        content_type = PLAYLIST_MIMETYPE if key.endswith('.m3u8') else SEGMENT_MIMETYPE
+        s3_client.upload_file(path, bucket_name, key, ExtraArgs={
+            'ContentType': content_type,
+            'CacheControl': 'max-age=3600',  # the keys stay the same when a video is packaged again
+        })
+
+    print(f"Uploading {len(files) + 1} files to s3://{bucket_name}/{prefix}...")
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(lambda item: upload(*item), files))
+    upload(os.path.join(output_dir, MASTER_PLAYLIST), master_key(name))
+
+    return master_key(name)
+
+
+def record_package(s3_client, bucket_name, name, hls_key):
+    """
+    Records the package in the catalog manifest, so the site offers adaptive
+    streaming for the video.
+
+    :return: True if the manifest was updated, else False.
+    """
+    def update(entries):
+        if name in entries:
+            entries[name]['hls_key'] = hls_key
+        else:
+            print(f"Warning: '{name}' is not in the catalog, upload the video itself with upload_script.py.")
+
+    return record_manifest_update(s3_client, bucket_name, update)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Package a video for adaptive bitrate streaming (HLS) with ffmpeg and upload it to AWS S3, next "
+                    "to the MP4 uploaded with upload_script.py.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("file_path", help="The video to package.")
+    parser.add_argument(
+        "-n", "--name",
+        help="The name of the video on the site, i.e. its object name without extension. Defaults to the file's base name."
+    )
+    parser.add_argument(
+        "-b", "--bucket",
+        default=os.environ.get('S3_BUCKET_NAME'),
+        help="The S3 bucket name. Defaults to S3_BUCKET_NAME environment variable."
+    )
+    parser.add_argument(
+        "-r", "--region",
+        default=os.environ.get('AWS_REGION'),
+        help="The AWS region of the bucket. Defaults to AWS_REGION environment variable."
+    )
+    parser.add_argument(
+        "-p", "--profile",
+        default="default",
+        help="The AWS profile name to use. Defaults to 'default'."
+    )
+    parser.add_argument(
+        "--renditions",
+        nargs="+",
+        choices=list(RENDITIONS),
+        default=list(RENDITIONS),
+        help="The renditions to encode. Renditions taller than the source are left out."
+    )
+    parser.add_argument(
+        "--segment-duration",
+        type=int,
+        default=4,
+        help="Target segment length in seconds. Shorter segments start faster and switch sooner, longer ones compress better."
+    )
+    parser.add_argument(
+        "--preset",
+        default="veryfast",
+        help="The x264 preset: slower presets take longer and produce smaller files at the same quality."
+    )
+    parser.add_argument(
+        "--ffmpeg",
+        default="ffmpeg",
+        help="The ffmpeg executable, built with libx264."
+    )
+    parser.add_argument(
+        "--output-dir",
+        help="Where to write the package. Defaults to a temporary directory that is removed after the upload."
+    )
+    parser.add_argument(
+        "--no-upload",
+        action="store_true",
+        help="Only write the package to --output-dir."
+    )
+
+    args = parser.parse_args()
+
+    if args.no_upload and not args.output_dir:
+        print("Error: --no-upload needs an --output-dir.")
+        sys.exit(1)
+    if not args.no_upload and not args.bucket:
+        print("Error: S3 bucket not specified. Provide it with --bucket or the S3_BUCKET_NAME environment variable.")
+        sys.exit(1)
+    if not args.no_upload and not args.region:
+        print("Error: AWS region not specified. Provide it with --region or the AWS_REGION environment variable.")
+        sys.exit(1)
+    if not os.path.isfile(args.file_path):
+        print(f"Error: The file '{args.file_path}' was not found.")
+        sys.exit(1)
+
+    name = args.name or os.path.splitext(os.path.basename(args.file_path))[0]
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        output_dir = args.output_dir or temporary_dir
+        try:
+            package(args.ffmpeg, args.file_path, output_dir, args.renditions, args.segment_duration, args.preset)
+        except FileNotFoundError:
+            print(f"Error: ffmpeg not found at '{args.ffmpeg}'. Install it or pass its path with --ffmpeg.")
+            sys.exit(1)
+        except (subprocess.CalledProcessError, ValueError) as e:
+            print(f"Error: Packaging failed: {e}")
+            sys.exit(1)
+
+        print(f"Packaged '{name}' in '{output_dir}'.")
+        if args.no_upload:
+            sys.exit(0)
+
+        s3_client = create_s3_client(args.profile, args.region)
+        try:
+            hls_key = upload_package(s3_client, output_dir, args.bucket, name)
+        except (NoCredentialsError, ClientError, S3UploadFailedError) as e:
+            print(f"Error: Upload failed: {e}")
+            sys.exit(1)
+
+    print(f"Uploaded the package, master playlist '{hls_key}'.")
+    if not record_package(s3_client, args.bucket, name, hls_key):
+        sys.exit(1)
@@ -0,0 +1,262 @@
+import base64
+import hashlib
+import io
+import json
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class UploadIntegrityError(Exception):
+    """Raised when the parts stored in S3 don't match what was uploaded."""
+    pass
+
+
+class PartReader(io.RawIOBase):
+    """
+    A read-only, seekable file object over `length` bytes of a memory-mapped
+    file, starting at `start`. botocore reads the body in small blocks, so a
+    part is never copied into a buffer of its own.
+    """
+
+    def __init__(self, mm, start, length):
+        self._mm = mm
+        self._start = start
+        self._length = length
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self._length - self._pos)
+        offset = self._start + self._pos
+        with memoryview(self._mm) as view, view[offset:offset + n] as block:
+            buffer[:n] = block
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._pos = max(0, min(offset, self._length))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def __len__(self):
+        return self._length
+
+
+class UploadState:
+    """
+    The progress of one multipart upload, kept in a JSON file next to the
+    video: the upload id, and the ETag and SHA-256 checksum of every part that
+    S3 has confirmed. The file is rewritten atomically after each part, so a
+    killed upload loses at most the parts that were in flight.
+    """
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path) as f:
+                return cls(path, json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def parts(self):
+        return self.data['parts']
+
+    def matches(self, bucket_name, object_name, stat, part_size):
+        """Whether this state belongs to an upload of the same, unchanged file."""
+        return (
+            self.data.get('bucket') == bucket_name
+            and self.data.get('key') == object_name
+            and self.data.get('size') == stat.st_size
+            and self.data.get('mtime_ns') == stat.st_mtime_ns
+            and self.data.get('part_size') == part_size
+        )
+
+    def add_part(self, part_number, etag, checksum):
+        with self._lock:
+            self.parts[str(part_number)] = {'etag': etag, 'checksum': checksum}
+            self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def default_state_path(file_path):
+    return file_path + '.upload-state.json'
+
+
+def part_checksum(mm, start, length):
+    """The SHA-256 checksum of a part, base64 encoded as S3 reports it."""
+    with memoryview(mm) as view, view[start:start + length] as part:
+        return base64.b64encode(hashlib.sha256(part).digest()).decode('ascii')
+
+
+def list_uploaded_parts(s3_client, bucket_name, object_name, upload_id):
+    """Returns {part number: part} for all parts S3 has stored for the upload."""
+    parts = dict()
+    kwargs = dict(Bucket=bucket_name, Key=object_name, UploadId=upload_id)
+    while True:
+        response = s3_client.list_parts(**kwargs)
+        for part in response.get('Parts', []):
+            parts[part['PartNumber']] = part
+        if not response.get('IsTruncated'):
+            return parts
+        kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+
+
+def resumable_upload(s3_client, file_path, bucket_name, object_name, part_size, max_concurrency=10,
+                     state_path=None, extra_args=None, callback=None):
+    """
+    Upload a file in parts, recording each completed part in a state file, so
+    a rerun after a crash or lost connection only uploads the missing parts.
+
+    Every part is sent with its SHA-256 checksum, which S3 verifies on receipt.
+    Before the upload is completed, the parts stored in S3 are compared with
+    the ETags and checksums recorded locally; parts that are missing or differ
+    are uploaded again. If the file changed since the state was written, the
+    old upload is aborted and a new one started.
+
+    :param callback: Called with the number of bytes of every part uploaded
+        (or found already uploaded), e.g. a progress bar.
+    :return: The response of complete_multipart_upload.
+    """
+    state_path = state_path or default_state_path(file_path)
+    extra_args = extra_args or dict()
+
+    with open(file_path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if stat.st_size == 0:
+            raise ValueError("resumable uploads need a non-empty file")
+
+        state = UploadState.load(state_path)
+        if state is not None and not state.matches(bucket_name, object_name, stat, part_size):
+            abort_upload(s3_client, state)
+            state = None
+
+        uploaded = dict()
+        if state is not None:
+            try:
+                uploaded = list_uploaded_parts(s3_client, bucket_name, object_name, state.data['upload_id'])
+            except s3_client.exceptions.NoSuchUpload:
+                state.remove()
+                state = None
+
+        if state is None:
+            response = s3_client.create_multipart_upload(
+                Bucket=bucket_name, Key=object_name, ChecksumAlgorithm='SHA256', **extra_args
+            )
+            state = UploadState(state_path, {
+                'bucket': bucket_name,
+                'key': object_name,
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'part_size': part_size,
+                'upload_id': response['UploadId'],
+                'parts': dict(),
+            })
+            state.save()
+
+        upload_id = state.data['upload_id']
+        part_count = (stat.st_size + part_size - 1) // part_size
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+            def part_range(part_number):
+                start = (part_number - 1) * part_size
+                return start, min(part_size, stat.st_size - start)
+
+            def upload_part(part_number):
+                start, length = part_range(part_number)
+                checksum = part_checksum(mm, start, length)
+                response = s3_client.upload_part(
+                    Bucket=bucket_name,
+                    Key=object_name,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=PartReader(mm, start, length),
+                    ContentLength=length,
+                    ChecksumSHA256=checksum,
+                )
+                if response.get('ChecksumSHA256', checksum) != checksum:
+                    raise UploadIntegrityError(f"S3 stored part {part_number} with a different checksum")
+                state.add_part(part_number, response['ETag'], checksum)
+                if callback:
+                    callback(length)
+
+            def is_intact(part_number):
+                recorded = state.parts.get(str(part_number))
+                stored = uploaded.get(part_number)
+                return (
+                    recorded is not None and stored is not None
+                    and stored['ETag'] == recorded['etag']
+                    and stored.get('ChecksumSHA256', recorded['checksum']) == recorded['checksum']
+                )
+
+            if callback:
+                callback(sum(part_range(n)[1] for n in range(1, part_count + 1) if is_intact(n)))
+
+            # the second round re-uploads parts that S3 doesn't list as recorded,
+            # the listing after it must have them all
+            for attempt in range(3):
+                missing = [n for n in range(1, part_count + 1) if not is_intact(n)]
+                if not missing:
+                    break
+                if attempt == 2:
+                    raise UploadIntegrityError(f"parts {missing} don't match the uploaded data")
+
+                with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                    list(executor.map(upload_part, missing))
+
+                uploaded = list_uploaded_parts(s3_client, bucket_name, object_name, upload_id)
+
+    response = s3_client.complete_multipart_upload(
+        Bucket=bucket_name,
+        Key=object_name,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': [
+            {'PartNumber': n, 'ETag': state.parts[str(n)]['etag'], 'ChecksumSHA256': state.parts[str(n)]['checksum']}
+            for n in range(1, part_count + 1)
+        ]},
+    )
+    state.remove()
+    return response
+
+
+def abort_upload(s3_client, state):
+    """Aborts the upload of `state` (if S3 still knows it) and removes the state file."""
+    try:
+        s3_client.abort_multipart_upload(
+            Bucket=state.data['bucket'], Key=state.data['key'], UploadId=state.data['upload_id']
+        )
+    except s3_client.exceptions.NoSuchUpload:
+        pass
+    state.remove()
@@ -0,0 +1,246 @@
+import os
+import threading
+import time
+
+from flask import current_app
+
+from cache import LRUCache
+from metrics import span
+from storage import LocalStorageManager
+
+
+class S3ClientManager:
+    """
+    Hands out one shared S3 client per worker process, so requests reuse its
+    HTTP connection pool instead of resolving the endpoint and credentials anew.
+    Handles both local development (using AWS_PROFILE) and deployed (using IAM Role)
+    scenarios.
+
+    The client is rebuilt when temporary (role) credentials are within
+    `refresh_margin` seconds of expiring, and when it is used in a different
+    process than the one that created it (e.g. after gunicorn forked).
+    Boto3 clients are thread-safe, so the same client is used by all threads.
+    Given `metrics`, every client records its API calls as spans.
+    """
+
+    def __init__(self, region_name=None, max_pool_connections=10, timeout=5, refresh_margin=300, metrics=None):
+        self.region_name = region_name
+        self.max_pool_connections = max_pool_connections
+        self.timeout = timeout
+        self.refresh_margin = refresh_margin
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._client = None
+        self._credentials = None
+        self._pid = None
+
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+
+    def get_client(self):
+        """Returns the shared client, building a new one if there is none or it went stale."""
+        with self._lock:
+            if self._client is not None and not self._is_stale():
+                self.hits += 1
+                return self._client
+
+            self.misses += 1
+            if self._client is not None:
+                self.rebuilds += 1
+
+            self._client = self._build()
+            return self._client
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'rebuilds': self.rebuilds}
+
+    def credentials_expiry(self):
+        """Returns the expiry of the current credentials as a Unix timestamp, or None if they don't expire."""
+        # botocore has no public accessor for the expiry of refreshable credentials
+        expiry = getattr(self._credentials, '_expiry_time', None)
+        return expiry.timestamp() if expiry is not None else None
+
+    def _is_stale(self):
+        if self._pid != os.getpid():
+            return True
+
+        # static credentials (or none at all) have no expiry
+        refresh_needed = getattr(self._credentials, 'refresh_needed', None)
+        return refresh_needed is not None and refresh_needed(self.refresh_margin)
+
+    def create_client(self, max_attempts=None):
+        """
+        Builds a new client configured like the shared one, not shared with
+        anybody. With `max_attempts`, a call is tried at most that many times
+        in total, for callers that mustn't wait through the default retries.
+        """
+        return self._create(max_attempts)[0]
+
+    def _build(self):
+        client, self._credentials = self._create()
+        self._pid = os.getpid()
+        return client
+
+    def _create(self, max_attempts=None):
+        boto3, Config = import_boto3()
+        session = boto3.session.Session()
+        client = session.client(
+            's3',
+            region_name=self.region_name,
+            config=Config(
+                signature_version='s3v4',  # Explicitly use v4 signatures
+                connect_timeout=self.timeout,
+                read_timeout=self.timeout,
+                max_pool_connections=self.max_pool_connections,
+                retries={'total_max_attempts': max_attempts} if max_attempts else None,
+            )
+        )
+
+        if self.metrics is not None:
+            self.metrics.instrument_s3(client)
+
+        return client, session.get_credentials()
+
+
+def import_boto3():
+    """
+    Imports boto3, which takes longer than importing the rest of the app, so
+    it is only imported when the first client is built. Returns boto3 and
+    botocore's client Config.
+    """
+    import boto3
+    from botocore.client import Config
+    return boto3, Config
+
+
+class PresignedUrlCache:
+    """
+    Reuses presigned GET URLs across requests and users. Signing is cheap but not
+    free, and stable URLs let browsers cache thumbnails between page loads.
+
+    A URL is handed out again until less than `safety_margin` seconds of its
+    lifetime (or of the credentials that signed it) are left, so clients always
+    get a URL that stays valid for at least that long.
+    """
+
+    def __init__(self, safety_margin=1800, max_entries=10000, max_bytes=8 * 1024 * 1024):
+        self.safety_margin = safety_margin
+        self._cache = LRUCache(
+            max_entries=max_entries,
+            max_bytes=max_bytes,
+            sizeof=lambda cache_key, url: len(cache_key[1]) + len(url),
+        )
+
+    def get_url(self, s3, bucket_name, key, expires_in=3600, credentials_expiry=None, min_lifetime=None):
+        """
+        Returns a presigned URL for the object. A cached URL is only handed out
+        while it stays valid for at least `min_lifetime` seconds (default: the
+        safety margin) longer.
+        """
+        cache_key = (bucket_name, key, expires_in)
+        url = self._cache.get(cache_key)
+
+        if url is None:
+            with span('s3', 'generate_presigned_url'):
+                url = s3.generate_presigned_url(
+                    'get_object',
+                    Params={'Bucket': bucket_name, 'Key': key},
+                    ExpiresIn=expires_in
+                )
+
+            lifetime = expires_in
+            if credentials_expiry is not None:
+                lifetime = min(lifetime, credentials_expiry - time.time())
+
+            margin = max(self.safety_margin, min_lifetime or 0)
+            if lifetime > margin:
+                self._cache.set(cache_key, url, ttl=lifetime - margin)
+
+        return url
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+def get_s3_client():
+    """Returns the current application's shared S3 client."""
+    return current_app.extensions['s3_clients'].get_client()
+
+
+def get_warm_up_client():
+    """
+    Returns an S3 client for warming up a worker, whose calls are tried only
+    once, so an unreachable S3 fails the warm-up quickly instead of retrying.
+    """
+    manager = current_app.extensions['s3_clients']
+    if not hasattr(manager, 'create_client'):  # local storage
+        return manager.get_client()
+    return manager.create_client(max_attempts=1)
+
+
+def presign_lifetime_cap(max_lifetime):
+    """
+    The longest lifetime worth signing a URL for: `max_lifetime`, or the time
+    until the current credentials expire, as the URL stops working then.
+    """
+    expiry = current_app.extensions['s3_clients'].credentials_expiry()
+    if expiry is None:
+        return max_lifetime
+    return max(0, min(max_lifetime, int(expiry - time.time())))
+
+
+def presign_get_object(s3, bucket_name, key, expires_in=3600, min_lifetime=None):
+    """Returns a presigned GET URL for the object, reusing a cached one while it is still valid long enough."""
+    return current_app.extensions['presigned_urls'].get_url(
+        s3, bucket_name, key, expires_in,
+        credentials_expiry=current_app.extensions['s3_clients'].credentials_expiry(),
+        min_lifetime=min_lifetime,
+    )
+
+
+def init_app(app):
+    """
+    Attach an S3 client manager to the app, configured by AWS_REGION,
+    S3_MAX_POOL_CONNECTIONS, S3_READ_TIMEOUT and S3_CREDENTIAL_REFRESH_MARGIN,
+    and a presigned URL cache, configured by PRESIGN_SAFETY_MARGIN,
+    PRESIGN_CACHE_ENTRIES and PRESIGN_CACHE_BYTES. S3 calls are timed if
+    metrics.init_app ran first.
+
+    With STORAGE_BACKEND set to 'local', the objects are read from the
+    directory STORAGE_ROOT instead, and the app streams the videos itself
+    (see storage.py).
+    """
+    app.config.setdefault('STORAGE_BACKEND', 's3')
+    app.config.setdefault('S3_MAX_POOL_CONNECTIONS', 32)
+    app.config.setdefault('S3_READ_TIMEOUT', 5)
+    app.config.setdefault('S3_CREDENTIAL_REFRESH_MARGIN', 300)
+
+    if app.config['STORAGE_BACKEND'] == 'local':
+        if not app.config.get('STORAGE_ROOT'):
+            raise ValueError("STORAGE_ROOT must be set for the local storage backend")
+        app.extensions['s3_clients'] = LocalStorageManager(app.config['STORAGE_ROOT'])
+
+    elif app.config['STORAGE_BACKEND'] == 's3':
+        app.extensions['s3_clients'] = S3ClientManager(
+            region_name=app.config.get('AWS_REGION'),
+            max_pool_connections=app.config['S3_MAX_POOL_CONNECTIONS'],
+            timeout=app.config['S3_READ_TIMEOUT'],
+            refresh_margin=app.config['S3_CREDENTIAL_REFRESH_MARGIN'],
+            metrics=app.extensions.get('metrics'),
+        )
+
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND {app.config['STORAGE_BACKEND']!r}, use 's3' or 'local'")
+
+    app.config.setdefault('PRESIGN_SAFETY_MARGIN', 1800)
+    app.config.setdefault('PRESIGN_CACHE_ENTRIES', 10000)
+    app.config.setdefault('PRESIGN_CACHE_BYTES', 8 * 1024 * 1024)
+    app.extensions['presigned_urls'] = PresignedUrlCache(
+        safety_margin=app.config['PRESIGN_SAFETY_MARGIN'],
+        max_entries=app.config['PRESIGN_CACHE_ENTRIES'],
+        max_bytes=app.config['PRESIGN_CACHE_BYTES'],
+    )
@@ -0,0 +1,204 @@
+import bisect
+import heapq
+import re
+import sys
+import threading
+
+from flask import current_app
+
+
+TOKEN = re.compile(r'[^\W_]+')  # runs of letters and digits, "my_video-2" -> my, video, 2
+
+# sort name -> key of a catalog entry, ties broken by name
+SORT_KEYS = {
+    'name': lambda entry: entry['name'],
+    'label': lambda entry: (entry['label'].casefold(), entry['name']),
+    'size': lambda entry: (entry['size'], entry['name']),
+}
+
+
+def tokenize(text):
+    return TOKEN.findall(text.casefold())
+
+
+def entry_terms(entry):
+    """The distinct words of an entry's name and label, interned so that each word is stored once."""
+    return tuple(sorted({sys.intern(word) for word in tokenize(entry['name'] + ' ' + entry['label'])}))
+
+
+class SearchIndex:
+    """
+    An inverted index over the catalog's videos for search-as-you-type: every
+    word of a query matches the videos with a word in their name or label
+    that starts with it, e.g. "int pro" finds "Introduction to the project".
+
+    The index maps each word to the videos containing it and keeps the words
+    sorted, so a prefix is resolved with a binary search. `sync` updates it
+    from the catalog's list of videos, touching only the videos that were
+    added, removed or changed since the last sync. Orderings for sorting are
+    built on first use and kept until the catalog changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None  # the catalog list the index was last synced with
+        self._entries = dict()  # doc id -> catalog entry
+        self._ids = dict()  # video name -> doc id
+        self._terms = dict()  # doc id -> its words (a sorted tuple)
+        self._postings = dict()  # word -> doc ids (lists take a third of the memory of sets)
+        self._words = []  # the words of _postings, sorted
+        self._orders = dict()  # sort name -> (doc ids in order, doc id -> position)
+        self._next_id = 0
+
+        self.syncs = 0
+        self.changes = 0
+
+    def sync(self, videos):
+        """Brings the index up to date with the catalog's list of videos."""
+        if videos is self._source:
+            return
+
+        with self._lock:
+            if videos is self._source:
+                return
+
+            current = {entry['name']: entry for entry in videos}
+            added, removed = set(), set()
+            changes = 0
+
+            for name in [name for name in self._ids if name not in current]:
+                self._remove(self._ids.pop(name), removed)
+                changes += 1
+
+            for name, entry in current.items():
+                doc_id = self._ids.get(name)
+                if doc_id is None:
+                    self._add(entry, added)
+                    changes += 1
+                    continue
+
+                previous = self._entries[doc_id]
+                if previous is entry or previous == entry:
+                    self._entries[doc_id] = entry
+                    continue
+
+                changes += 1
+                terms = entry_terms(entry)
+                if terms != self._terms[doc_id]:
+                    self._remove(doc_id, removed)
+                    self._add(entry, added, doc_id)
+                else:
+                    self._entries[doc_id] = entry
+
+            self._update_words(added - removed, removed - added)
+            if changes:
+                self._orders = dict()
+            self._source = videos
+            self.syncs += 1
+            self.changes += changes
+
+    def search(self, query='', sort='name', descending=False, offset=0, limit=50):
+        """
+        Returns the entries of the page of matches from `offset` on, in the
+        order of `sort` (a key of SORT_KEYS), and the total number of matches.
+        An empty query matches all videos.
+        """
+        words = sorted(set(tokenize(query)), key=len, reverse=True)  # longer prefixes match fewer videos
+
+        with self._lock:
+            order, rank = self._order(sort)
+
+            if not words:
+                total = len(order)
+                if descending:
+                    page = order[max(total - offset - limit, 0):max(total - offset, 0)][::-1]
+                else:
+                    page = order[offset:offset + limit]
+                return [self._entries[doc_id] for doc_id in page], total
+
+            matches = None
+            for word in words:
+                docs = self._prefix(word)
+                matches = docs if matches is None else matches & docs
+                if not matches:
+                    return [], 0
+
+            select = heapq.nlargest if descending else heapq.nsmallest
+            page = select(offset + limit, matches, key=rank.__getitem__)[offset:]
+            return [self._entries[doc_id] for doc_id in page], len(matches)
+
+    def stats(self):
+        return {
+            'videos': len(self._entries),
+            'words': len(self._words),
+            'syncs': self.syncs,
+            'changes': self.changes,
+        }
+
+    def _add(self, entry, added, doc_id=None):
+        if doc_id is None:
+            doc_id = self._next_id
+            self._next_id += 1
+            self._ids[entry['name']] = doc_id
+
+        terms = entry_terms(entry)
+        self._entries[doc_id] = entry
+        self._terms[doc_id] = terms
+        for word in terms:
+            docs = self._postings.get(word)
+            if docs is None:
+                docs = self._postings[word] = []
+                added.add(word)
+            docs.append(doc_id)
+
+    def _remove(self, doc_id, removed):
+        del self._entries[doc_id]
+        for word in self._terms.pop(doc_id):
+            docs = self._postings[word]
+            docs.remove(doc_id)
+            if not docs:
+                del self._postings[word]
+                removed.add(word)
+
+    def _update_words(self, added, removed):
+        # a few changes are patched in, a (re)build sorts all words once
+        if len(added) + len(removed) > 100:
+            self._words = sorted(self._postings)
+            return
+
+        for word in removed:
+            del self._words[bisect.bisect_left(self._words, word)]
+        for word in added:
+            bisect.insort(self._words, word)
+
+    def _prefix(self, prefix):
+        """The set of doc ids of the videos with a word starting with `prefix`."""
+        start = bisect.bisect_left(self._words, prefix)
+        end = bisect.bisect_left(self._words, prefix + '\U0010ffff', start)
+        return set().union(*(self._postings[word] for word in self._words[start:end]))
+
+    def _order(self, sort):
+        ordered = self._orders.get(sort)
+        if ordered is None:
+            key = SORT_KEYS[sort]
+            order = sorted(self._entries, key=lambda doc_id: key(self._entries[doc_id]))
+            rank = [0] * self._next_id
+            for position, doc_id in enumerate(order):
+                rank[doc_id] = position
+            ordered = self._orders[sort] = (order, rank)
+        return ordered
+
+
+def get_search_index():
+    """Returns the search index of the current application."""
+    return current_app.extensions['search_index']
+
+
+def init_app(app):
+    """
+    Attach a search index to the app. It is kept up to date by the app's
+    catalog, so searches don't wait for the index to be built.
+    """
+    index = app.extensions['search_index'] = SearchIndex()
+    if 'catalog' in app.extensions:
+        app.extensions['catalog'].listeners.append(index.sync)
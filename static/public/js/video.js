@@ -8,6 +8,120 @@ export const initializeDashboard = async () => {
 };
 
 
+// Presigned stream URLs prefetched for the videos that are on screen. The server
+// only hands out URLs that stay valid for a while, so they can be reused for a
+// few minutes before a fresh one is requested.
+const STREAM_URL_MAX_AGE_MS = 10 * 60 * 1000;
+const STREAM_URL_BATCH_SIZE = 100;
+const streamUrls = new Map();  // video key -> { url, fetchedAt }
+const pendingKeys = new Set();
+let prefetchTimer = null;
+
+
+const getCachedStreamUrl = (videoKey) => {
+    const cached = streamUrls.get(videoKey);
+    if (cached && Date.now() - cached.fetchedAt < STREAM_URL_MAX_AGE_MS) return cached.url;
+    return null;
+};
+
+
+const prefetchStreamUrls = async () => {
+    prefetchTimer = null;
+    const keys = [...pendingKeys];
+    pendingKeys.clear();
+
+    for (let i = 0; i < keys.length; i += STREAM_URL_BATCH_SIZE) {
+        try {
+            const response = await fetch('/api/stream/batch', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRF-Token': getCookie('csrf_token'),
+                },
+                body: JSON.stringify({ keys: keys.slice(i, i + STREAM_URL_BATCH_SIZE) }),
+            });
+            if (!response.ok) throw new Error(`Failed to prefetch video URLs: ${response.statusText}`);
+
+            const { urls } = await response.json();
+            const fetchedAt = Date.now();
+            Object.entries(urls).forEach(([key, url]) => streamUrls.set(key, { url, fetchedAt }));
+
+        } catch (error) {
+            // not fatal, playVideo requests the URL itself
+            console.error("Error prefetching video URLs:", error);
+        }
+    }
+};
+
+
+// Collects the keys of videos that scrolled into view and signs them in one request.
+const visibilityObserver = ('IntersectionObserver' in window) ? new IntersectionObserver((entries) => {
+    entries.forEach(entry => {
+        if (!entry.isIntersecting) return;
+        visibilityObserver.unobserve(entry.target);
+
+        const videoKey = entry.target.dataset.videoKey;
+        if (!getCachedStreamUrl(videoKey)) pendingKeys.add(videoKey);
+    });
+
+    if (pendingKeys.size > 0 && !prefetchTimer) {
+        prefetchTimer = setTimeout(prefetchStreamUrls, 200);
+    }
+}) : null;
+
+
+// Yields the objects of a newline-delimited JSON response as they arrive.
+const readNdjson = async function* (response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();  // keep the incomplete last line
+
+        for (const line of lines) {
+            if (line.trim()) yield JSON.parse(line);
+        }
+    }
+    if (buffer.trim()) yield JSON.parse(buffer);
+};
+
+
+const renderVideoItem = (video) => {
+    const label = video.label;
+    const thumbnailUrl = video.thumbnail_url;
+
+    let videoHTML = `<li class="video-link" data-video-key="${video.key}"`;
+    if (video.hls_url) videoHTML += ` data-hls-url="${video.hls_url}"`;
+    videoHTML += `>`;
+
+    if (thumbnailUrl && video.thumbnail_srcset) {
+        // scaled variants: the browser picks the format and the width for the 160px tile
+        const srcset = video.thumbnail_srcset;
+        videoHTML += `<picture>`;
+        if (srcset.webp) videoHTML += `<source type="image/webp" srcset="${srcset.webp}" sizes="160px">`;
+        videoHTML += `<img src="${thumbnailUrl}" srcset="${srcset.jpeg || ''}" sizes="160px" width="160" height="90"`;
+        videoHTML += ` loading="lazy" decoding="async" alt="Thumbnail for ${label}">`;
+        videoHTML += `</picture>`;
+
+    } else if (thumbnailUrl) {
+        videoHTML += `<img src="${thumbnailUrl}" loading="lazy" decoding="async" alt="Thumbnail for ${label}">`;
+
+    } else {
+        videoHTML += `<div class="thumbnail-placeholder">No Thumbnail</div>`;
+    }
+
+    videoHTML += `<span>${label}</span>`;
+    videoHTML += `</li>`;
+    return videoHTML;
+};
+
+
 const loadVideoList = async () => {
     console.log("in loadVideoList");
     const videoListContainer = document.getElementById('video-list');
@@ -19,39 +133,32 @@ const loadVideoList = async () => {
     }
     try {
         const csrfToken = getCookie('csrf_token');
-        const response = await fetch('/api/videos', {
+        // The list is streamed as one video per line, so the first tiles can be
+        // shown before the server has walked the whole bucket.
+        const response = await fetch('/api/videos?format=ndjson', {
             headers: {
                 'X-CSRF-Token': csrfToken,
             },
         });
         if (!response.ok) throw new Error(`Failed to load video list: ${response.statusText}`);
 
-        const videos = await response.json();
-
-        if (videos.length === 0) {
-            videoListContainer.innerHTML = "<p>No videos available. An admin needs to upload some.</p>";
-
-        } else {
-            let videoListHTML = `<ul>`;  // style="list-style-type: none; padding: 0;">`;
-            videos.forEach(video => {
-                const videoName = video.key;
-                const label = video.label;
-                const thumbnailUrl = video.thumbnail_url;
-                
-                videoListHTML += `<li class="video-link" data-video-key="${video.key}">`;
+        const videoList = document.createElement('ul');
+        let videoCount = 0;
 
-                if (thumbnailUrl) {
-                    videoListHTML += `<img src="${thumbnailUrl}" alt="Thumbnail for ${label}">`;
+        for await (const video of readNdjson(response)) {
+            if (video.error) throw new Error(video.error);
 
-                } else {
-                    videoListHTML += `<div class="thumbnail-placeholder">No Thumbnail</div>`;
-                }
+            if (videoCount === 0) {
+                videoListContainer.innerHTML = '';
+                videoListContainer.appendChild(videoList);
+            }
+            videoList.insertAdjacentHTML('beforeend', renderVideoItem(video));
+            if (visibilityObserver) visibilityObserver.observe(videoList.lastElementChild);
+            videoCount++;
+        }
 
-                videoListHTML += `<span>${label}</span>`;
-                videoListHTML += `</li>`;
-            });
-            videoListHTML += "</ul>";
-            videoListContainer.innerHTML = videoListHTML;
+        if (videoCount === 0) {
+            videoListContainer.innerHTML = "<p>No videos available. An admin needs to upload some.</p>";
         }
 
     } catch (error) {
@@ -60,6 +167,42 @@ const loadVideoList = async () => {
     }
 };
 
+// Adaptive streaming for videos packaged with package_hls.py. Safari plays HLS
+// itself; other browsers use hls.js, which is only downloaded once it's needed.
+// It is served by the site (vendor_hls.py), never by a third party, as it runs
+// with access to the session. Without it, videos play as MP4.
+const HLS_MIMETYPE = 'application/vnd.apple.mpegurl';
+const HLS_JS_URL = '/js/vendor/hls.js';
+let hlsPlayer = null;
+
+
+const stopHls = () => {
+    if (hlsPlayer) {
+        hlsPlayer.destroy();
+        hlsPlayer = null;
+    }
+};
+
+
+// Returns true if the video is playing over HLS, false if the browser can't play it that way.
+const playHls = async (videoPlayer, hlsUrl) => {
+    if (videoPlayer.canPlayType(HLS_MIMETYPE)) {
+        videoPlayer.src = hlsUrl;
+        videoPlayer.play();
+        return true;
+    }
+
+    const { default: Hls } = await import(HLS_JS_URL);
+    if (!Hls.isSupported()) return false;
+
+    hlsPlayer = new Hls();
+    hlsPlayer.loadSource(hlsUrl);
+    hlsPlayer.attachMedia(videoPlayer);
+    hlsPlayer.on(Hls.Events.MANIFEST_PARSED, () => videoPlayer.play());
+    return true;
+};
+
+
 export const playVideo = async (videoKey) => {
     const videoPlayer = document.getElementById('main-video-player');
 
@@ -75,16 +218,33 @@ export const playVideo = async (videoKey) => {
         newPlayingItem.classList.add('is-playing');
     }
 
+    stopHls();
+
+    const hlsUrl = newPlayingItem ? newPlayingItem.dataset.hlsUrl : null;
+    if (hlsUrl) {
+        try {
+            if (await playHls(videoPlayer, hlsUrl)) return;
+        } catch (error) {
+            console.error("Error starting HLS playback, falling back to MP4:", error);
+            stopHls();
+        }
+    }
+
     try {
-        const csrfToken = getCookie('csrf_token');
-        const response = await fetch(`/api/stream/${encodeURIComponent(videoKey)}`, {
-            headers: {
-                'X-CSRF-Token': csrfToken,
-            },
-        });
-        if (!response.ok) throw new Error(`Failed to get video URL: ${response.statusText}`);
+        let url = getCachedStreamUrl(videoKey);
+
+        if (!url) {
+            const csrfToken = getCookie('csrf_token');
+            const response = await fetch(`/api/stream/${encodeURIComponent(videoKey)}`, {
+                headers: {
+                    'X-CSRF-Token': csrfToken,
+                },
+            });
+            if (!response.ok) throw new Error(`Failed to get video URL: ${response.statusText}`);
+
+            ({ url } = await response.json());
+        }
 
-        const { url } = await response.json();
         videoPlayer.src = url;
         videoPlayer.play();
         
@@ -0,0 +1,148 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from stat import S_ISREG
+
+from flask import Response, abort, current_app, request
+from werkzeug.security import safe_join
+
+try:
+    import brotli  # optional, only used if installed
+except ImportError:
+    brotli = None
+
+
+# e.g. 'main.3f2a9c1b.js': the content hash is part of the name, so it never changes
+FINGERPRINTED = re.compile(r'\.[0-9a-f]{8,}\.[A-Za-z0-9]+$')
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+class StaticAsset:
+    def __init__(self, data, mimetype, mtime_ns, mtime):
+        self.mimetype = mimetype
+        self.mtime_ns = mtime_ns
+        self.mtime = mtime
+        self.etag = hashlib.sha256(data).hexdigest()[:32]
+        self.variants = {'identity': data}
+
+    def add_variant(self, encoding, data):
+        # only worth keeping if it actually saves bytes
+        if len(data) < len(self.variants['identity']):
+            self.variants[encoding] = data
+
+
+class AssetStore:
+    """
+    Keeps the files of a static directory in memory, together with gzip (and,
+    if the brotli package is installed, brotli) compressed copies and a strong
+    ETag per file.
+
+    Files are loaded on first request, or all at once with `preload`. Each
+    request checks the file's modification time, so an updated file is
+    reloaded without restarting the app.
+    """
+
+    def __init__(self, root, min_compress_size=512):
+        self.root = root
+        self.min_compress_size = min_compress_size
+        self._assets = dict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """Returns the asset at `path` (relative to the root), or None if there is no such file."""
+        full_path = safe_join(self.root, path)
+        if full_path is None:
+            return None
+
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            return None
+
+        if not S_ISREG(stat.st_mode):
+            return None
+
+        asset = self._assets.get(path)
+        if asset is None or asset.mtime_ns != stat.st_mtime_ns:
+            asset = self._load(full_path, stat)
+            with self._lock:
+                self._assets[path] = asset
+        return asset
+
+    def preload(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                self.get(os.path.relpath(os.path.join(dirpath, filename), self.root).replace(os.sep, '/'))
+
+    def _load(self, full_path, stat):
+        with open(full_path, 'rb') as f:
+            data = f.read()
+
+        mimetype = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        asset = StaticAsset(data, mimetype, stat.st_mtime_ns, stat.st_mtime)
+
+        if len(data) >= self.min_compress_size and mimetype.startswith(COMPRESSIBLE_TYPES):
+            asset.add_variant('gzip', gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                asset.add_variant('br', brotli.compress(data))
+
+        return asset
+
+
+def send_asset(store_name, path, private=False):
+    """
+    Serves a file from one of the app's asset stores, picking the best encoding
+    the client accepts and answering conditional requests with 304.
+    """
+    asset = current_app.extensions['static_assets'][store_name].get(path)
+    if asset is None:
+        abort(404)
+
+    encoding = 'identity'
+    for candidate in ('br', 'gzip'):
+        if candidate in asset.variants and request.accept_encodings[candidate]:
+            encoding = candidate
+            break
+
+    response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+    response.vary.add('Accept-Encoding')
+
+    if encoding != 'identity':
+        response.content_encoding = encoding
+        response.set_etag(f"{asset.etag}-{encoding}")
+    else:
+        response.set_etag(asset.etag)
+
+    response.last_modified = asset.mtime
+
+    if FINGERPRINTED.search(path):
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    else:
+        # the browser keeps a copy, but revalidates it with the ETag
+        response.cache_control.no_cache = True
+        if private:
+            response.cache_control.private = True
+
+    return response.make_conditional(request)
+
+
+def init_app(app):
+    """
+    Create the asset stores for the public and protected static files. With
+    STATIC_PRELOAD set, all files are loaded and compressed at startup.
+    """
+    app.config.setdefault('STATIC_PRELOAD', False)
+    app.extensions['static_assets'] = {
+        'public': AssetStore(os.path.join(app.root_path, 'static', 'public')),
+        'protected': AssetStore(os.path.join(app.root_path, 'static', 'protected')),
+    }
+
+    if app.config['STATIC_PRELOAD']:
+        for store in app.extensions['static_assets'].values():
+            store.preload()
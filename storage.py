@@ -0,0 +1,243 @@
+import bisect
+import io
+import mimetypes
+import os
+import threading
+from datetime import datetime, timezone
+from stat import S_ISREG
+
+from botocore.exceptions import ClientError
+from flask import Response, request, url_for
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+
+from hls import PLAYLIST_MIMETYPE, SEGMENT_MIMETYPE
+
+
+# types mimetypes gets wrong or doesn't know on every platform
+CONTENT_TYPES = {
+    '.m3u8': PLAYLIST_MIMETYPE,
+    '.ts': SEGMENT_MIMETYPE,
+    '.mp4': 'video/mp4',
+    '.mkv': 'video/x-matroska',
+}
+
+
+def content_type(key):
+    ext = os.path.splitext(key)[1].lower()
+    return CONTENT_TYPES.get(ext) or mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+def file_etag(stat):
+    # changes with every write, without reading the file (which may be several GB)
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+class LocalStorage:
+    """
+    Serves the site's objects from a local directory instead of S3, for
+    on-premises deployments and tests. The directory takes the place of the
+    bucket, with one file per key (e.g. hls/intro/master.m3u8).
+
+    It implements the part of the S3 client API the site uses (listing,
+    downloads and presigned URLs), so the catalog and the HLS playlists work
+    unchanged. "Presigned" URLs point at the app's /api/media route, which
+    streams the files itself, see send_file_range.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._listing = []  # sorted (key, stat) of the last full listing, for its continuation pages
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        """The file of a key, or None if the key points outside the directory."""
+        return safe_join(self.root, key)
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, MaxKeys=1000, **kwargs):
+        # a listing walks the directory once; its next pages continue in the same snapshot
+        if ContinuationToken is None:
+            listing = self._walk()
+            with self._lock:
+                self._listing = listing
+        else:
+            with self._lock:
+                listing = self._listing
+
+        keys = [key for key, _ in listing]
+        start = bisect.bisect_right(keys, ContinuationToken) if ContinuationToken else bisect.bisect_left(keys, Prefix)
+        contents = []
+        for key, stat in listing[start:]:
+            if not key.startswith(Prefix):
+                break
+            contents.append(self._describe(key, stat))
+            if len(contents) == MaxKeys:
+                break
+
+        response = {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': False}
+        end = start + len(contents)
+        if len(contents) == MaxKeys and end < len(listing) and listing[end][0].startswith(Prefix):
+            response['IsTruncated'] = True
+            response['NextContinuationToken'] = contents[-1]['Key']
+        return response
+
+    def head_object(self, Bucket, Key, **kwargs):
+        path, stat = self._stat(Key, 'HeadObject')
+        return {**self._describe(Key, stat), 'ContentLength': stat.st_size, 'ContentType': content_type(Key)}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        """
+        Reads the whole object into memory, like `response['Body'].read()`
+        would. The site only downloads small objects (labels, the manifest,
+        playlists); videos are streamed by send_file_range.
+        """
+        path, stat = self._stat(Key, 'GetObject')
+        description = self._describe(Key, stat)
+        if IfNoneMatch is not None and IfNoneMatch == description['ETag']:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+
+        with open(path, 'rb') as f:
+            body = f.read()
+        return {**description, 'Body': io.BytesIO(body), 'ContentLength': len(body), 'ContentType': content_type(Key)}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        # access is checked by the login on the media route instead of a signature
+        return url_for('api_routes.serve_media', key=Params['Key'])
+
+    def _walk(self):
+        listing = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # removed while walking
+                if S_ISREG(stat.st_mode):
+                    listing.append((os.path.relpath(path, self.root).replace(os.sep, '/'), stat))
+        listing.sort(key=lambda item: item[0])
+        return listing
+
+    def _stat(self, key, operation):
+        path = self.path(key)
+        try:
+            stat = os.stat(path) if path is not None else None
+        except OSError:
+            stat = None
+
+        if stat is None or not S_ISREG(stat.st_mode):
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': f"No such key: {key}"}}, operation)
+        return path, stat
+
+    @staticmethod
+    def _describe(key, stat):
+        return {
+            'Key': key,
+            'Size': stat.st_size,
+            'ETag': f'"{file_etag(stat)}"',
+            'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+        }
+
+
+class LocalStorageManager:
+    """Stands in for S3ClientManager when the site is served from a local directory."""
+
+    def __init__(self, root):
+        self._storage = LocalStorage(root)
+
+    def get_client(self):
+        return self._storage
+
+    def stats(self):
+        return {'backend': 'local', 'root': self._storage.root}
+
+    def credentials_expiry(self):
+        return None
+
+
+def if_range_matches(etag, last_modified):
+    """Whether a Range request's If-Range condition (if any) holds for the file."""
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return if_range.date == last_modified
+    return True
+
+
+def iter_file(f, length, chunk_size):
+    """Yields `length` bytes of the file from its current position, a chunk at a time, then closes it."""
+    try:
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def send_file_range(path, chunk_size=256 * 1024, max_age=3600):
+    """
+    Streams a file with support for Range requests (206, or 416 for a range
+    outside the file; multiple ranges get the whole file) and conditional
+    requests (ETag and Last-Modified, 304).
+
+    The file is never read into memory as a whole: open-ended ranges, which is
+    what players request while playing, are handed to the server's
+    wsgi.file_wrapper, so gunicorn sends them with sendfile(2) straight from
+    the page cache. Bounded ranges (seeking) are read `chunk_size` bytes at a
+    time, as file wrappers would read past the end of the range.
+    """
+    f = open(path, 'rb')
+    try:
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        etag = file_etag(stat)
+        last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+
+        response = Response(mimetype=content_type(path), direct_passthrough=True)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.accept_ranges = 'bytes'
+        response.cache_control.private = True
+        response.cache_control.max_age = max_age
+
+        if not is_resource_modified(request.environ, etag, last_modified=last_modified):
+            f.close()
+            response.status_code = 304
+            return response
+
+        start, stop = 0, size
+        # multiple ranges would need a multipart/byteranges body; the whole file is a valid answer too
+        if request.range is not None and len(request.range.ranges) == 1 and if_range_matches(etag, last_modified):
+            bounds = request.range.range_for_length(size)
+            if bounds is None:
+                f.close()
+                response.status_code = 416
+                response.headers['Content-Range'] = f"bytes */{size}"
+                return response
+
+            start, stop = bounds
+            response.status_code = 206
+            response.content_range = ContentRange('bytes', start, stop, size)
+
+        response.content_length = stop - start
+        if request.method == 'HEAD':
+            f.close()
+            return response
+
+        f.seek(start)
+
+        file_wrapper = request.environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None and stop == size:
+            response.response = file_wrapper(f, chunk_size)
+        else:
+            response.response = iter_file(f, stop - start, chunk_size)
+        return response
+
+    except BaseException:
+        f.close()
+        raise
@@ -0,0 +1,111 @@
+import io
+
+
+# The dashboard draws thumbnails as 160x90 tiles, so these cover 1x, 2x and 3x screens.
+THUMBNAIL_WIDTHS = (160, 320, 480)
+THUMBNAIL_ASPECT = (16, 9)
+
+# format -> (Pillow format, content type, key extension, encoder options)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'image/webp', '.webp', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+THUMBNAIL_PREFIX = 'thumbnails/'
+
+# the variant the site falls back to for browsers without srcset support
+DEFAULT_WIDTH = 320
+
+
+def variant_key(name, width, fmt):
+    """The S3 key of a thumbnail variant, e.g. 'thumbnails/intro-320.webp' for the video 'intro'."""
+    return f"{THUMBNAIL_PREFIX}{name}-{width}{THUMBNAIL_FORMATS[fmt][2]}"
+
+
+def parse_variant_key(key):
+    """The inverse of variant_key: returns (name, width, format), or None for other keys."""
+    if not key.startswith(THUMBNAIL_PREFIX):
+        return None
+
+    stem, dot, ext = key[len(THUMBNAIL_PREFIX):].rpartition('.')
+    name, dash, width = stem.rpartition('-')
+    fmt = next((fmt for fmt, spec in THUMBNAIL_FORMATS.items() if spec[2] == dot + ext), None)
+
+    if not dash or not width.isdigit() or fmt is None:
+        return None
+    return name, int(width), fmt
+
+
+def import_pillow():
+    """
+    Imports Pillow, which is optional and only needed to create the variants,
+    so the web workers, which only build keys and srcsets, never load it.
+    Returns Image and ImageOps, or None if Pillow isn't installed.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+    return Image, ImageOps
+
+
+def can_render():
+    return import_pillow() is not None
+
+
+def render_variants(data, widths=THUMBNAIL_WIDTHS):
+    """
+    Scales and crops an uploaded thumbnail to the tile's 16:9 shape at each of
+    `widths`, in every format. Widths larger than the original are left out
+    rather than upscaled. Returns {(width, format): encoded bytes}.
+    """
+    Image, ImageOps = import_pillow()
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    variants = dict()
+    for width in widths:
+        if width > image.width and width != min(widths):
+            continue
+
+        height = round(width * THUMBNAIL_ASPECT[1] / THUMBNAIL_ASPECT[0])
+        resized = ImageOps.fit(image, (width, height), method=Image.Resampling.LANCZOS)
+
+        for fmt, (pil_format, _, _, options) in THUMBNAIL_FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, pil_format, **options)
+            variants[(width, fmt)] = buffer.getvalue()
+
+    return variants
+
+
+def upload_variants(s3_client, bucket_name, name, data, extra_args=None):
+    """
+    Renders the variants of a thumbnail and uploads them under their
+    predictable keys. Returns the list of widths that were uploaded.
+    """
+    extra_args = extra_args or dict()
+    variants = render_variants(data)
+
+    for (width, fmt), body in variants.items():
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=variant_key(name, width, fmt),
+            Body=body,
+            ContentType=THUMBNAIL_FORMATS[fmt][1],
+            CacheControl='max-age=3600',  # the key stays the same when a thumbnail is replaced
+            **extra_args
+        )
+
+    return sorted({width for width, _ in variants})
+
+
+def srcsets(urls):
+    """
+    Turns {(width, format): url} into a srcset attribute value per format,
+    e.g. {'webp': 'https://...-160.webp 160w, https://...-320.webp 320w'}.
+    """
+    result = dict()
+    for (width, fmt), url in sorted(urls.items()):
+        result.setdefault(fmt, []).append(f"{url} {width}w")
+    return {fmt: ', '.join(candidates) for fmt, candidates in result.items()}
@@ -1,11 +1,16 @@
 import argparse
-import boto3
 import os
 import sys
 import threading
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import NoCredentialsError, ClientError
 
+from catalog import (
+    MANIFEST_KEY, ManifestConflict, build_manifest, classify_key, load_manifest, save_manifest, update_manifest
+)
+from resumable_upload import UploadIntegrityError, default_state_path, resumable_upload
+import thumbnails
+
 
 class ProgressPercentage(object):
     """A class to display a progress bar for Boto3 uploads."""
@@ -26,35 +31,120 @@ class ProgressPercentage(object):
             sys.stdout.flush()
 
 
-def upload_to_s3(file_path, bucket_name, region_name, profile_name, object_name=None):
+def create_s3_client(profile_name, region_name, max_concurrency=10):
+    """
+    Create the S3 client used for all uploads of a run. Its connection pool is
+    large enough for the parallel part uploads of the video plus the label and
+    thumbnail uploads running next to it.
+    """
+    # boto3 is imported here rather than at the top, so that e.g. --help doesn't wait for it
+    import boto3
+    from botocore.client import Config
+
+    session = boto3.session.Session(profile_name=profile_name)
+    return session.client(
+        's3',
+        region_name=region_name,
+        config=Config(max_pool_connections=max_concurrency + 4)
+    )
+
+
+def create_transfer_config(part_size_mb=64, max_concurrency=10):
+    """
+    Multipart settings for large videos: files above one part are split into
+    parts of `part_size_mb` MB, of which `max_concurrency` are uploaded at once.
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    part_size = part_size_mb * 1024 * 1024
+    return TransferConfig(
+        multipart_threshold=part_size,
+        multipart_chunksize=part_size,
+        max_concurrency=max_concurrency,
+        use_threads=max_concurrency > 1
+    )
+
+
+def transfer_file(s3_client, file_path, bucket_name, object_name, transfer_config=None, callback=None,
+                  resume=False, state_path=None, extra_args=None):
+    """
+    Upload a file, in parts if it is larger than one part. Unlike upload_to_s3,
+    errors are raised rather than printed.
+
+    :param callback: Called with the number of bytes transferred, e.g. a progress bar.
+    :param resume: Upload files larger than one part resumably, see resumable_upload.
+    :param state_path: Where a resumable upload keeps its progress. Defaults to next to the file.
+    :param extra_args: Extra arguments for the upload request, e.g. the ACL or metadata.
+    """
+    from boto3.s3.transfer import TransferConfig
+
+    transfer_config = transfer_config or TransferConfig()
+    extra_args = extra_args or dict()
+
+    if resume and os.path.getsize(file_path) > transfer_config.multipart_chunksize:
+        resumable_upload(
+            s3_client,
+            file_path,
+            bucket_name,
+            object_name,
+            transfer_config.multipart_chunksize,
+            max_concurrency=transfer_config.max_concurrency,
+            state_path=state_path,
+            extra_args=extra_args,
+            callback=callback
+        )
+    else:
+        s3_client.upload_file(
+            file_path,
+            bucket_name,
+            object_name,
+            ExtraArgs=extra_args,
+            Callback=callback,
+            Config=transfer_config
+        )
+
+
+def upload_to_s3(s3_client, file_path, bucket_name, object_name=None, transfer_config=None, show_progress=True,
+                 resume=False, state_path=None):
     """
     Upload a file to an S3 bucket.
 
+    :param s3_client: The S3 client to upload with.
     :param file_path: Path to the file to upload.
     :param bucket_name: Bucket to upload to.
-    :param region_name: AWS region of the bucket.
-    :param profile_name: The AWS credentials profile to use.
     :param object_name: S3 object name. If not specified, the file's basename is used.
+    :param transfer_config: Multipart settings, see create_transfer_config.
+    :param show_progress: Whether to print a progress bar.
+    :param resume: Upload files larger than one part resumably, see resumable_upload.
+    :param state_path: Where a resumable upload keeps its progress. Defaults to next to the file.
     :return: True if file was uploaded, else False.
     """
+    from boto3.exceptions import S3UploadFailedError
+
     # If S3 object_name was not specified, use file_name
     if object_name is None:
         object_name = os.path.basename(file_path)
 
-    session = boto3.session.Session(profile_name=profile_name)
-    s3_client = session.client('s3', region_name=region_name)
+    region_name = s3_client.meta.region_name
 
     try:
         print(f"Starting upload of '{file_path}' to bucket '{bucket_name}' in region '{region_name}' as '{object_name}'...")
-        progress = ProgressPercentage(file_path)
-        s3_client.upload_file(
+        state_path = state_path or default_state_path(file_path)
+        if resume and os.path.exists(state_path):
+            print(f"Resuming upload from '{state_path}'...")
+
+        transfer_file(
+            s3_client,
             file_path,
             bucket_name,
             object_name,
-            ExtraArgs={'ACL': 'bucket-owner-full-control'},
-            Callback=progress
+            transfer_config,
+            callback=ProgressPercentage(file_path) if show_progress else None,
+            resume=resume,
+            state_path=state_path,
+            extra_args={'ACL': 'bucket-owner-full-control'}
         )
-        sys.stdout.write("\nUpload Complete!\n")
+        sys.stdout.write(f"\nUpload of '{object_name}' complete!\n")
 
     except FileNotFoundError:
         print(f"Error: The file was not found at '{file_path}'")
@@ -71,15 +161,202 @@ def upload_to_s3(file_path, bucket_name, region_name, profile_name, object_name=
         else:
             print(f"\nAn S3 client error occurred: {e}")
         return False
+
+    except S3UploadFailedError as e:  # upload_file wraps the ClientErrors of its requests
+        print(f"\nAn S3 client error occurred: {e}")
+        return False
+
+    except UploadIntegrityError as e:
+        print(f"\nError: {e}. Run the upload again to resume it.")
+        return False
     
     return True
 
+
+def upload_label(s3_client, label, bucket_name, object_name):
+    """Upload a label as a small text object, without going through a temporary file."""
+    try:
+        s3_client.put_object(
+            Bucket=bucket_name,
+            Key=object_name,
+            Body=label.encode('utf-8'),
+            ContentType='text/plain; charset=utf-8',
+            ACL='bucket-owner-full-control'
+        )
+        print(f"\nUpload of '{object_name}' complete!")
+
+    except (NoCredentialsError, ClientError) as e:
+        print(f"\nError uploading label '{object_name}': {e}")
+        return False
+
+    return True
+
+
+def upload_thumbnail_variants(s3_client, bucket_name, name, data):
+    """
+    Upload the scaled WebP/JPEG variants of a thumbnail that the site shows
+    instead of the original, see thumbnails.py. Needs Pillow.
+
+    :return: The widths of the uploaded variants, or None if none were uploaded.
+    """
+    if not thumbnails.can_render():
+        print(f"\nWarning: Pillow is not installed, so no scaled thumbnails are created for '{name}'. "
+              "Install it and run --backfill-thumbnails.")
+        return None
+
+    try:
+        return thumbnails.upload_variants(
+            s3_client, bucket_name, name, data, extra_args={'ACL': 'bucket-owner-full-control'}
+        )
+
+    except (NoCredentialsError, ClientError) as e:
+        print(f"\nError uploading the scaled thumbnails of '{name}': {e}")
+
+    except OSError as e:  # Pillow's error for files it can't read
+        print(f"\nError: the thumbnail of '{name}' can't be scaled: {e}")
+
+    return None
+
+
+def delete_thumbnail_variants(s3_client, bucket_name, name, widths):
+    for width in widths:
+        for fmt in thumbnails.THUMBNAIL_FORMATS:
+            s3_client.delete_object(Bucket=bucket_name, Key=thumbnails.variant_key(name, width, fmt))
+
+
+def backfill_thumbnails(s3_client, bucket_name, jobs=4):
+    """
+    Create the scaled thumbnail variants for the videos in the catalog manifest
+    that don't have them yet, from the thumbnails already in the bucket, and
+    record them in the manifest.
+
+    :return: True if all thumbnails were processed, else False.
+    """
+    videos, _ = load_manifest(s3_client, bucket_name)
+    if videos is None:
+        print(f"Error: The bucket has no '{MANIFEST_KEY}' yet. Create it with --rebuild-manifest first.")
+        return False
+
+    pending = [video for video in videos if video['thumbnail_key'] and not video.get('thumbnail_widths')]
+    print(f"Creating scaled thumbnails for {len(pending)} of {len(videos)} videos...")
+
+    def backfill(video):
+        try:
+            data = s3_client.get_object(Bucket=bucket_name, Key=video['thumbnail_key'])['Body'].read()
+        except ClientError as e:
+            print(f"Error downloading thumbnail '{video['thumbnail_key']}': {e}")
+            return None
+        return upload_thumbnail_variants(s3_client, bucket_name, video['name'], data)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(backfill, pending))
+
+    done = {video['name']: (video['thumbnail_key'], widths) for video, widths in zip(pending, results) if widths}
+
+    def update(entries):
+        for name, (thumbnail_key, widths) in done.items():
+            # unless the video got a new thumbnail in the meantime
+            if name in entries and entries[name]['thumbnail_key'] == thumbnail_key:
+                entries[name]['thumbnail_widths'] = widths
+
+    if done and not record_manifest_update(s3_client, bucket_name, update):
+        return False
+
+    print(f"Created scaled thumbnails for {len(done)} videos.")
+    return len(done) == len(pending)
+
+
+def thumbnail_widths(video, previous):
+    if video.get('thumbnail_widths') is not None:
+        return video['thumbnail_widths']
+    if video['thumbnail_key'] in (None, previous.get('thumbnail_key')):
+        return previous.get('thumbnail_widths', [])
+    return []
+
+
+def record_in_manifest(s3_client, bucket_name, videos):
+    """
+    Adds the uploaded videos to the bucket's catalog manifest, which the site
+    reads instead of listing the bucket. `videos` are catalog entries (name,
+    key, size, thumbnail_key, thumbnail_widths, label); a thumbnail_key or
+    label of None keeps what the manifest already has for the video, and
+    thumbnail_widths of None keeps the recorded variants if the thumbnail
+    is the same. Without an hls_key, the recorded HLS package is kept.
+
+    :return: True if the manifest was updated, else False.
+    """
+    def update(entries):
+        for video in videos:
+            previous = entries.get(video['name'], dict())
+            entries[video['name']] = {
+                'name': video['name'],
+                'key': video['key'],
+                'size': video['size'],
+                'thumbnail_key': video['thumbnail_key'] or previous.get('thumbnail_key'),
+                'thumbnail_widths': thumbnail_widths(video, previous),
+                # a new upload of the video replaces its HLS package (see package_hls.py)
+                'hls_key': video['hls_key'] if 'hls_key' in video else previous.get('hls_key'),
+                'label': video['label'] or previous.get('label') or video['name'],
+            }
+
+    return record_manifest_update(s3_client, bucket_name, update)
+
+
+def record_manifest_update(s3_client, bucket_name, update):
+    """Apply `update` to the catalog manifest, see catalog.update_manifest, and report the outcome."""
+    try:
+        update_manifest(s3_client, bucket_name, update)
+        print(f"Updated the catalog manifest '{MANIFEST_KEY}'.")
+
+    except (NoCredentialsError, ClientError, ManifestConflict, ValueError) as e:
+        print(f"Error: could not update the catalog manifest '{MANIFEST_KEY}': {e}")
+        print("The site won't show the change until the manifest is rebuilt with --rebuild-manifest.")
+        return False
+
+    return True
+
+
+def rebuild_manifest(s3_client, bucket_name):
+    """
+    Replaces the catalog manifest with one built from a listing of the bucket,
+    e.g. for a bucket filled before the manifest existed, or after objects
+    were deleted.
+
+    :return: True if the manifest was written, else False.
+    """
+    try:
+        print(f"Listing bucket '{bucket_name}' and reading labels...")
+        videos = build_manifest(s3_client, bucket_name)
+        try:
+            etag = s3_client.head_object(Bucket=bucket_name, Key=MANIFEST_KEY)['ETag']
+        except ClientError:
+            etag = None
+
+        save_manifest(s3_client, bucket_name, videos, etag)
+        print(f"Wrote '{MANIFEST_KEY}' with {len(videos)} videos.")
+
+    except ManifestConflict:
+        print(f"Error: '{MANIFEST_KEY}' was changed by an upload during the rebuild. Please run it again.")
+        return False
+
+    except (NoCredentialsError, ClientError) as e:
+        print(f"Error rebuilding '{MANIFEST_KEY}': {e}")
+        return False
+
+    return True
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Upload a file to AWS S3. Configuration is sourced from command-line arguments, then environment variables.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
-    parser.add_argument("file_path", help="The full path to the file you want to upload.")
+    parser.add_argument(
+        "file_path",
+        nargs="?",
+        help="The full path to the file you want to upload. For a batch upload, a directory (videos, thumbnails and "
+             ".txt labels grouped by base name) or a CSV/JSONL manifest with the columns file, label and thumbnail."
+    )
     parser.add_argument(
         "-b", "--bucket",
         default=os.environ.get('S3_BUCKET_NAME'),
@@ -110,6 +387,52 @@ if __name__ == "__main__":
         help="The S3 object name to use. If not specified, the file's basename is used."
     )
 
+    parser.add_argument(
+        "--part-size",
+        type=int,
+        default=64,
+        help="Size of the parts of a multipart upload in MB (min. 5). Files larger than this are uploaded in parts."
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=10,
+        help="Number of parts uploaded in parallel."
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Upload the video resumably: completed parts are recorded in a state file, and running the same command "
+             "again after an interruption uploads only the missing parts. Every part is verified with a SHA-256 checksum."
+    )
+    parser.add_argument(
+        "--state-file",
+        help="Where --resume keeps its progress. Defaults to the video's path with '.upload-state.json' appended."
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=4,
+        help="Batch uploads only: number of files uploaded in parallel."
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Batch uploads only: list what would be uploaded and skipped, without uploading anything."
+    )
+    parser.add_argument(
+        "--backfill-thumbnails",
+        action="store_true",
+        help="Create the scaled thumbnails (needs Pillow) for all videos in the catalog manifest that don't have them "
+             "yet, instead of uploading anything."
+    )
+    parser.add_argument(
+        "--rebuild-manifest",
+        action="store_true",
+        help=f"Rebuild the bucket's catalog manifest ({MANIFEST_KEY}) from a listing of the bucket instead of "
+             "uploading anything, e.g. for videos uploaded before the manifest existed."
+    )
+
     args = parser.parse_args()
 
     if not args.bucket:
@@ -118,6 +441,32 @@ if __name__ == "__main__":
     if not args.region:
         print("Error: AWS region not specified. Provide it with --region or the AWS_REGION environment variable.")
         sys.exit(1)
+    if args.part_size < 5:
+        print("Error: S3 requires multipart upload parts of at least 5 MB.")
+        sys.exit(1)
+
+    if args.rebuild_manifest:
+        s3_client = create_s3_client(args.profile, args.region)
+        sys.exit(0 if rebuild_manifest(s3_client, args.bucket) else 1)
+    if args.backfill_thumbnails:
+        s3_client = create_s3_client(args.profile, args.region, args.jobs)
+        sys.exit(0 if backfill_thumbnails(s3_client, args.bucket, args.jobs) else 1)
+    if not args.file_path:
+        print("Error: No file to upload given.")
+        sys.exit(1)
+
+    if os.path.isdir(args.file_path) or args.file_path.lower().endswith(('.csv', '.jsonl')):
+        from batch_upload import ingest
+
+        if args.label or args.thumbnail or args.object_name or args.state_file:
+            print("Error: --label, --thumbnail, --object-name and --state-file only apply to single uploads.")
+            sys.exit(1)
+
+        s3_client = create_s3_client(args.profile, args.region, args.jobs * args.max_concurrency)
+        transfer_config = create_transfer_config(args.part_size, args.max_concurrency)
+        if not ingest(args.file_path, s3_client, args.bucket, transfer_config, args.jobs, args.resume, args.dry_run):
+            sys.exit(1)
+        sys.exit(0)
 
     # determine the base name for all assets to ensure they are linked.
     if args.object_name:
@@ -132,33 +481,74 @@ if __name__ == "__main__":
         base_name, video_ext = os.path.splitext(os.path.basename(args.file_path))
         video_object_name = base_name + video_ext
 
-    # 1. Upload the main video file first.
-    print("\n--- Uploading Video File ---")
-    success = upload_to_s3(args.file_path, args.bucket, args.region, args.profile, video_object_name)
+    s3_client = create_s3_client(args.profile, args.region, args.max_concurrency)
+    transfer_config = create_transfer_config(args.part_size, args.max_concurrency)
+
+    # The label and thumbnail (with its scaled variants) are small, so they are
+    # uploaded next to the video instead of after it. Only the video shows a progress bar.
+    side_uploads = dict()
+    thumbnail_variants = None
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        print("\n--- Uploading Video File ---")
+        video_upload = executor.submit(
+            upload_to_s3, s3_client, args.file_path, args.bucket, video_object_name, transfer_config,
+            resume=args.resume, state_path=args.state_file
+        )
+
+        if args.label:
+            print("\n--- Uploading Label File ---")
+            label_object_name = base_name + ".txt"
+            side_uploads[label_object_name] = executor.submit(
+                upload_label, s3_client, args.label, args.bucket, label_object_name
+            )
+
+        if args.thumbnail:
+            print("\n--- Uploading Thumbnail File ---")
+            if not os.path.exists(args.thumbnail):
+                print(f"Error: Thumbnail file not found at '{args.thumbnail}'. Skipping thumbnail upload.")
+            else:
+                _, thumb_ext = os.path.splitext(args.thumbnail)
+                thumbnail_object_name = base_name + thumb_ext.lower()
+                side_uploads[thumbnail_object_name] = executor.submit(
+                    upload_to_s3, s3_client, args.thumbnail, args.bucket, thumbnail_object_name, transfer_config, False
+                )
+                with open(args.thumbnail, 'rb') as f:
+                    thumbnail_variants = executor.submit(
+                        upload_thumbnail_variants, s3_client, args.bucket, base_name, f.read()
+                    )
+
+        success = video_upload.result()
+        uploaded = [name for name, upload in side_uploads.items() if upload.result()]
+        variant_widths = thumbnail_variants.result() if thumbnail_variants else None
+
+    if not success or (variant_widths and thumbnail_object_name not in uploaded):
+        # the scaled thumbnails are only used together with the original
+        delete_thumbnail_variants(s3_client, args.bucket, base_name, variant_widths or [])
+        variant_widths = None
 
     if not success:
+        # don't leave a label or thumbnail behind that belongs to no video
+        for object_name in uploaded:
+            s3_client.delete_object(Bucket=args.bucket, Key=object_name)
         print("\nVideo upload failed. Aborting.")
         sys.exit(1)
 
-    # 2. Handle and upload the label file if provided.
-    if args.label:
-        print("\n--- Uploading Label File ---")
-        label_object_name = base_name + ".txt"
-
-        # Use a temporary file to hold the label content for upload.
-        with tempfile.NamedTemporaryFile(mode='w+', delete=False, suffix=".txt", encoding='utf-8') as temp_label_file:
-            temp_label_file.write(args.label)
-            temp_label_file_path = temp_label_file.name
-            
-        upload_to_s3(temp_label_file_path, args.bucket, args.region, args.profile, label_object_name)
-        os.remove(temp_label_file_path) # Clean up the temporary file.
-
-    # 3. Handle and upload the thumbnail file if provided.
-    if args.thumbnail:
-        print("\n--- Uploading Thumbnail File ---")
-        if not os.path.exists(args.thumbnail):
-            print(f"Error: Thumbnail file not found at '{args.thumbnail}'. Skipping thumbnail upload.")
+    video = {
+        'name': base_name,
+        'key': video_object_name,
+        'size': os.path.getsize(args.file_path),
+        'thumbnail_key': None,
+        'thumbnail_widths': None,
+        'hls_key': None,
+        'label': None,
+    }
+    for object_name in uploaded:
+        if classify_key(object_name)[1] == 'label':
+            video['label'] = args.label.strip()
         else:
-            _, thumb_ext = os.path.splitext(args.thumbnail)
-            thumbnail_object_name = base_name + thumb_ext.lower()
-            upload_to_s3(args.thumbnail, args.bucket, args.region, args.profile, thumbnail_object_name)
\ No newline at end of file
+            video['thumbnail_key'] = object_name
+            video['thumbnail_widths'] = variant_widths or []
+
+    if not record_in_manifest(s3_client, args.bucket, [video]):
+        sys.exit(1)
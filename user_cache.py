@@ -0,0 +1,64 @@
+from flask import current_app, has_app_context
+
+from cache import LRUCache
+
+
+class UserCache:
+    """
+    Caches the users table rows looked up by Flask-Login's user_loader, so
+    authenticated requests don't need a database query to identify the user.
+
+    Rows are stored as (id, email, password_hash) tuples in `backend`, which
+    by default is an in-process LRUCache. Any object with the same `get`,
+    `set`, `delete` and `stats` methods can be plugged in instead, e.g. a
+    wrapper around a cache shared by all workers.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, user_id):
+        return self.backend.get(self._key(user_id))
+
+    def set(self, user):
+        self.backend.set(self._key(user.id), (user.id, user.email, user.password_hash))
+
+    def invalidate(self, user_id):
+        self.backend.delete(self._key(user_id))
+
+    def stats(self):
+        stats = self.backend.stats()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+        return stats
+
+    @staticmethod
+    def _key(user_id):
+        # Flask-Login passes the id as a string, the database returns an int
+        return f"user:{user_id}"
+
+
+def get_user_cache():
+    """Returns the user cache of the current application."""
+    return current_app.extensions['user_cache']
+
+
+def invalidate_user(user_id):
+    """Removes a user from the cache, if there is an application to cache it in."""
+    if has_app_context() and 'user_cache' in current_app.extensions:
+        get_user_cache().invalidate(user_id)
+
+
+def init_app(app, backend=None):
+    """
+    Attach a user cache to the app. Without a `backend`, an in-process cache is
+    used, sized by USER_CACHE_SIZE and expiring entries after USER_CACHE_TTL
+    seconds (0 disables caching).
+    """
+    app.config.setdefault('USER_CACHE_SIZE', 10000)
+    app.config.setdefault('USER_CACHE_TTL', 300)
+
+    if backend is None:
+        backend = LRUCache(max_entries=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
+    app.extensions['user_cache'] = UserCache(backend)
@@ -0,0 +1,79 @@
+import argparse
+import base64
+import glob
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+import urllib.request
+
+
+HLS_JS_VERSION = '1.5.17'
+REGISTRY_URL = 'https://registry.npmjs.org/hls.js/{version}'
+MODULE_PATH = 'package/dist/hls.mjs'
+
+VENDOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'public', 'js', 'vendor')
+# the module the player imports; it is revalidated on every load and only names the fingerprinted copy
+ENTRY_MODULE = 'hls.js'
+
+
+def fetch(url):
+    with urllib.request.urlopen(url, timeout=60) as response:
+        return response.read()
+
+
+def download_module(version):
+    """
+    Downloads the hls.js package from the npm registry and returns its ES
+    module build. The tarball is checked against the integrity hash the
+    registry publishes for it, as npm itself does.
+    """
+    dist = json.loads(fetch(REGISTRY_URL.format(version=version)))['dist']
+    algorithm, _, expected = dist['integrity'].partition('-')
+    tarball = fetch(dist['tarball'])
+
+    if base64.b64encode(hashlib.new(algorithm, tarball).digest()).decode() != expected:
+        raise ValueError(f"the tarball of hls.js {version} doesn't match its {algorithm} integrity hash")
+
+    with tarfile.open(fileobj=io.BytesIO(tarball), mode='r:gz') as archive:
+        return archive.extractfile(MODULE_PATH).read()
+
+
+def vendor(data, version, vendor_dir=VENDOR_DIR):
+    """
+    Writes the module as hls.<content hash>.js, which the asset store serves
+    as immutable, and points the entry module at it. Copies of other
+    versions are removed. Returns the name of the fingerprinted copy.
+    """
+    os.makedirs(vendor_dir, exist_ok=True)
+    name = f"hls.{hashlib.sha256(data).hexdigest()[:12]}.js"
+
+    for old in glob.glob(os.path.join(vendor_dir, 'hls.*.js')):
+        if os.path.basename(old) not in (name, ENTRY_MODULE):
+            os.remove(old)
+
+    with open(os.path.join(vendor_dir, name), 'wb') as f:
+        f.write(data)
+    with open(os.path.join(vendor_dir, ENTRY_MODULE), 'w') as f:
+        f.write(f"// hls.js {version}, written by vendor_hls.py\nexport {{ default }} from './{name}';\n")
+    return name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Copy hls.js into static/public/js/vendor, so the player loads it from the site instead of a "
+                    "third-party CDN. Commit the files it writes.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--version", default=HLS_JS_VERSION, help="The hls.js version from the npm registry.")
+    args = parser.parse_args()
+
+    try:
+        name = vendor(download_module(args.version), args.version)
+    except (OSError, KeyError, ValueError, tarfile.TarError) as e:
+        print(f"Error: Could not vendor hls.js {args.version}: {e}")
+        sys.exit(1)
+
+    print(f"Wrote hls.js {args.version} to {os.path.join(VENDOR_DIR, name)}.")